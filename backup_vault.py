@@ -3,11 +3,23 @@ Obsidian Vault のバックアップを作成するスクリプト
 """
 
 import os
+import sys
+import bz2
+import gzip
+import json
+import lzma
 import shutil
+import hashlib
+import tarfile
+import argparse
 import datetime
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
 
+import metrics
+
 # --- 設定読み込み ---
 
 SCRIPT_DIR = Path(__file__).parent
@@ -38,19 +50,332 @@ except ValueError:
     BACKUP_GENERATIONS = 5
     print("警告: BACKUP_GENERATIONS の設定が不正です。デフォルト値(5)を使用します。")
 
+# full: 毎回 Vault 全体をコピー / incremental: 前世代から未変更ファイルをハードリンク
+# archive: 世代ごとに圧縮済み tar ファイル 1 つを作成
+BACKUP_MODE = os.getenv("BACKUP_MODE", "incremental").lower()
+if BACKUP_MODE not in ("full", "incremental", "archive"):
+    print(f"警告: BACKUP_MODE の設定が不正です ({BACKUP_MODE})。incremental を使用します。")
+    BACKUP_MODE = "incremental"
+
+# 圧縮形式: (拡張子, 圧縮関数, 展開用ファイルオブジェクト)
+# 各ブロックを独立したストリームとして圧縮し連結するため、通常の tar ツールでもそのまま展開できる。
+ARCHIVE_CODECS = {
+    "gz": (".tar.gz", lambda data: gzip.compress(data, compresslevel=6, mtime=0), lambda f: gzip.GzipFile(fileobj=f, mode="rb")),
+    "xz": (".tar.xz", lzma.compress, lzma.LZMAFile),
+    "bz2": (".tar.bz2", bz2.compress, bz2.BZ2File),
+}
+try:
+    from compression import zstd  # Python 3.14 以降
+    ARCHIVE_CODECS["zst"] = (".tar.zst", zstd.compress, zstd.ZstdFile)
+except ImportError:
+    pass
+
+# 世代管理の対象とするアーカイブの拡張子 (実行環境で使えない形式も削除対象に含める)
+ARCHIVE_SUFFIXES = (".tar.gz", ".tar.xz", ".tar.bz2", ".tar.zst")
+
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "gz").lower()
+if BACKUP_COMPRESSION not in ARCHIVE_CODECS:
+    print(f"警告: BACKUP_COMPRESSION の設定が不正か、この環境では使用できません ({BACKUP_COMPRESSION})。gz を使用します。")
+    BACKUP_COMPRESSION = "gz"
+
+try:
+    BACKUP_WORKERS = max(1, int(os.getenv("BACKUP_WORKERS", str(os.cpu_count() or 4))))
+except ValueError:
+    BACKUP_WORKERS = os.cpu_count() or 4
+    print(f"警告: BACKUP_WORKERS の設定が不正です。デフォルト値({BACKUP_WORKERS})を使用します。")
+
+# 各世代フォルダに保存するマニフェスト (パス・サイズ・更新日時・ハッシュ)
+# アーカイブ世代では "<アーカイブ名>.manifest.json" として隣に保存する
+MANIFEST_NAME = ".backup_manifest.json"
+ARCHIVE_MANIFEST_SUFFIX = ".manifest.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 検証時に Vault 側のハッシュを再利用するためのキャッシュ
+VAULT_HASH_CACHE = BACKUP_DIR / ".vault_hashes.json"
+
+# 1 ワーカーがまとめて圧縮する非圧縮データ量。これより大きいファイルは分割する
+ARCHIVE_BLOCK_SIZE = 4 * 1024 * 1024
+
+# アーカイブ内の 1 要素。header が None の場合は前ブロックから続くファイルデータ
+# whole はファイル全体が 1 要素に収まっていることを示す
+ArchivePiece = namedtuple("ArchivePiece", ["rel", "src", "header", "offset", "length", "pad", "whole"])
+
 # --- 関数定義 ---
 
-def rotate_backups(backup_dir, max_generations):
-    """古いバックアップを削除して世代数を維持する"""
+def file_sha256(path):
+    """ファイル内容の SHA-256 を返す"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+def scan_vault(vault_path):
+    """Vault 内のディレクトリとファイルを列挙する (相対パスは / 区切り)"""
+    dirs = []
+    files = []
+    for root, dirnames, filenames in os.walk(vault_path):
+        dirnames.sort()
+        rel_root = Path(root).relative_to(vault_path)
+        for d in dirnames:
+            dirs.append((rel_root / d).as_posix())
+        for name in sorted(filenames):
+            src = Path(root) / name
+            try:
+                st = src.stat()
+            except OSError as e:
+                print(f"  警告: ファイル情報を取得できません {src}: {e}")
+                continue
+            files.append(((rel_root / name).as_posix(), src, st))
+    return dirs, files
+
+def is_archive_generation(path):
+    """アーカイブ形式の世代かどうか"""
+    return path.name.endswith(ARCHIVE_SUFFIXES)
+
+def manifest_path_for(generation):
+    """世代に対応するマニフェストのパスを返す"""
+    if is_archive_generation(generation):
+        return generation.with_name(generation.name + ARCHIVE_MANIFEST_SUFFIX)
+    return generation / MANIFEST_NAME
+
+def list_generations(backup_dir):
+    """バックアップ世代 (フォルダ・アーカイブ) を古い順に返す"""
     backups = []
     try:
         for p in backup_dir.iterdir():
-            if p.is_dir() and p.name.startswith("backup_"):
+            if not p.name.startswith("backup_"):
+                continue
+            if p.is_dir() or (p.is_file() and is_archive_generation(p)):
                 backups.append(p)
     except FileNotFoundError:
-        return
+        return []
 
     backups.sort(key=lambda x: x.name)
+    return backups
+
+def load_manifest(generation):
+    """世代のマニフェストを読み込む。存在しない場合は None を返す"""
+    try:
+        with open(manifest_path_for(generation), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def save_manifest(generation, files, **extra):
+    """世代のマニフェストを書き込む"""
+    manifest = {
+        "version": 1,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        **extra,
+        "files": files,
+    }
+    with open(manifest_path_for(generation), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+def find_latest_snapshot(backup_dir, include_archives=False):
+    """マニフェストを持つ最新の世代を返す (既定ではフォルダ形式のみ)"""
+    for p in reversed(list_generations(backup_dir)):
+        if not include_archives and not p.is_dir():
+            continue
+        manifest = load_manifest(p)
+        if manifest is not None:
+            return p, manifest
+    return None, None
+
+def create_snapshot(vault_path, target_path, previous_path=None, previous_manifest=None):
+    """
+    Vault のスナップショットを作成する。
+    前世代と サイズ・更新日時・ハッシュ が一致するファイルはハードリンクし、変更分のみコピーする。
+    """
+    prev_files = previous_manifest["files"] if previous_manifest else {}
+    dirs, files = scan_vault(vault_path)
+
+    target_path.mkdir(parents=True)
+    for d in dirs:
+        (target_path / d).mkdir(parents=True, exist_ok=True)
+
+    manifest_files = {}
+    stats = {"linked": 0, "copied": 0, "bytes_copied": 0}
+    link_supported = previous_path is not None
+
+    for rel, src, st in files:
+        dst = target_path / rel
+        prev = prev_files.get(rel)
+
+        # サイズと更新日時が一致すればハッシュを再計算しない
+        if prev and prev["size"] == st.st_size and prev["mtime_ns"] == st.st_mtime_ns:
+            digest = prev["sha256"]
+        else:
+            digest = file_sha256(src)
+
+        linked = False
+        if link_supported and prev and prev["sha256"] == digest:
+            try:
+                os.link(previous_path / rel, dst)
+                linked = True
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # ハードリンク非対応のファイルシステムではコピーに切り替える
+                print(f"  警告: ハードリンクを作成できないため、通常コピーに切り替えます: {e}")
+                link_supported = False
+
+        if linked:
+            stats["linked"] += 1
+        else:
+            shutil.copy2(src, dst)
+            stats["copied"] += 1
+            stats["bytes_copied"] += st.st_size
+
+        manifest_files[rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+
+    save_manifest(target_path, manifest_files)
+    return stats
+
+def _tar_header(rel, st=None):
+    """tar のメンバーヘッダーを作成する (st が None の場合はディレクトリ)"""
+    info = tarfile.TarInfo(rel)
+    if st is None:
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+    else:
+        info.size = st.st_size
+        info.mtime = st.st_mtime
+        info.mode = st.st_mode & 0o777 or 0o644
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+def _plan_archive_blocks(dirs, files, block_size):
+    """圧縮単位のブロックに分割する。大きいファイルは複数ブロックにまたがる"""
+    block = [ArchivePiece(d, None, _tar_header(d), 0, 0, 0, False) for d in dirs]
+    block_bytes = 0
+
+    for rel, src, st in files:
+        size = st.st_size
+        pad = -size % tarfile.BLOCKSIZE
+        header = _tar_header(rel, st)
+
+        if block and block_bytes + size > block_size:
+            yield block
+            block, block_bytes = [], 0
+
+        if size <= block_size:
+            block.append(ArchivePiece(rel, src, header, 0, size, pad, True))
+            block_bytes += len(header) + size + pad
+            continue
+
+        for offset in range(0, size, block_size):
+            length = min(block_size, size - offset)
+            is_first = offset == 0
+            is_last = offset + length == size
+            yield [ArchivePiece(rel, src, header if is_first else None, offset, length, pad if is_last else 0, False)]
+
+    if block:
+        yield block
+
+def _build_archive_block(pieces, compress):
+    """ブロック内のファイルを読み込み tar データとして圧縮する (ワーカースレッドで実行)"""
+    buf = bytearray()
+    members = []
+    hashes = {}
+    chunks = []
+    for piece in pieces:
+        if piece.header is not None:
+            members.append((piece.rel, len(buf)))
+            buf += piece.header
+
+        if piece.src is not None:
+            with open(piece.src, "rb") as f:
+                f.seek(piece.offset)
+                data = f.read(piece.length)
+            if len(data) != piece.length:
+                # 読み込み中にファイルが変更された場合も tar の構造を壊さないようサイズを合わせる
+                print(f"  警告: バックアップ中にファイルが変更されました: {piece.rel}")
+                data = data[:piece.length].ljust(piece.length, b"\0")
+            buf += data
+            # 全体が 1 ブロックに収まるファイルは読み込んだデータからハッシュを計算する。
+            # 分割されたファイルは書き込み側で順にハッシュに加えるため、データを返す
+            if piece.whole:
+                hashes[piece.rel] = hashlib.sha256(data).hexdigest()
+            else:
+                chunks.append((piece.rel, data))
+
+        buf += b"\0" * piece.pad
+
+    return compress(bytes(buf)), members, hashes, chunks
+
+def create_archive(vault_path, target_path, codec, workers):
+    """
+    Vault を 1 つの圧縮 tar ファイルとして保存する。
+    ファイルの読み込みと圧縮はワーカープールで並列に行い、書き込みは順序どおり逐次行う。
+    マニフェストには各ファイルが含まれる圧縮ブロックの位置を記録する。
+    """
+    _, compress, _ = ARCHIVE_CODECS[codec]
+    dirs, files = scan_vault(vault_path)
+    stat_map = {rel: st for rel, _, st in files}
+
+    manifest_files = {}
+    # 複数ブロックに分割されるファイルのハッシュ。アーカイブに書き込んだデータから順に計算するため、
+    # 読み込みの合間にファイルが変更されてもマニフェストとアーカイブの内容は一致する
+    split_hashes = {}
+    stats = {"files": len(files), "bytes_read": 0, "bytes_written": 0}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool, open(target_path, "wb") as out:
+        def write_block(future):
+            data, members, hashes, chunks = future.result()
+            block_offset = out.tell()
+            out.write(data)
+            stats["bytes_written"] += len(data)
+            for rel, skip in members:
+                if rel not in stat_map:
+                    continue
+                entry = manifest_files.setdefault(rel, {})
+                entry["block"] = block_offset
+                entry["skip"] = skip
+                if rel in hashes:
+                    entry["sha256"] = hashes[rel]
+            for rel, chunk in chunks:
+                split_hashes.setdefault(rel, hashlib.sha256()).update(chunk)
+
+        # 先読みするブロック数を制限してメモリ使用量を抑える
+        pending = deque()
+        for pieces in _plan_archive_blocks(dirs, files, ARCHIVE_BLOCK_SIZE):
+            stats["bytes_read"] += sum(p.length for p in pieces)
+            pending.append(pool.submit(_build_archive_block, pieces, compress))
+            if len(pending) >= workers * 2:
+                write_block(pending.popleft())
+        while pending:
+            write_block(pending.popleft())
+
+        # tar の終端 (512 バイトのゼロブロック 2 つ)
+        end_of_archive = compress(b"\0" * (tarfile.BLOCKSIZE * 2))
+        out.write(end_of_archive)
+        stats["bytes_written"] += len(end_of_archive)
+
+    for rel, h in split_hashes.items():
+        manifest_files[rel]["sha256"] = h.hexdigest()
+
+    for rel, st in stat_map.items():
+        manifest_files[rel]["size"] = st.st_size
+        manifest_files[rel]["mtime_ns"] = st.st_mtime_ns
+
+    return manifest_files, stats
+
+def remove_generation(generation):
+    """世代を削除する (アーカイブの場合はマニフェストも削除)"""
+    if generation.is_dir():
+        shutil.rmtree(generation)
+    else:
+        generation.unlink()
+        manifest_path_for(generation).unlink(missing_ok=True)
+
+def rotate_backups(backup_dir, max_generations):
+    """
+    古いバックアップを削除して世代数を維持する
+    フォルダ形式とアーカイブ形式の世代をまとめて、名前 (日時) 順に数える。
+    ハードリンクされたファイルは参照が残っている限り実体が消えないため、世代フォルダ単位で削除してよい。
+    """
+    backups = list_generations(backup_dir)
 
     if len(backups) > max_generations:
         excess_count = len(backups) - max_generations
@@ -60,7 +385,7 @@ def rotate_backups(backup_dir, max_generations):
             old_backup = backups[i]
             try:
                 print(f"  削除中: {old_backup.name}")
-                shutil.rmtree(old_backup)
+                remove_generation(old_backup)
             except Exception as e:
                 print(f"  削除失敗 {old_backup.name}: {e}")
         print("バックアップ世代管理完了。")
@@ -80,14 +405,352 @@ def create_backup():
         backup_folder_name = f"backup_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
         target_backup_path = BACKUP_DIR / backup_folder_name
 
+        if BACKUP_MODE == "archive":
+            target_backup_path = BACKUP_DIR / (backup_folder_name + ARCHIVE_CODECS[BACKUP_COMPRESSION][0])
+
+        # 作成途中の世代が前世代として参照されないよう、一時名で作成してから名前を変更する
+        temp_backup_path = BACKUP_DIR / f".tmp_{target_backup_path.name}"
+
         try:
-            shutil.copytree(VAULT_PATH, target_backup_path)
+            if BACKUP_MODE == "archive":
+                print(f"アーカイブ作成中 ({BACKUP_COMPRESSION}, ワーカー {BACKUP_WORKERS} 並列)...")
+                manifest_files, stats = create_archive(VAULT_PATH, temp_backup_path, BACKUP_COMPRESSION, BACKUP_WORKERS)
+                save_manifest(target_backup_path, manifest_files, format="archive", codec=BACKUP_COMPRESSION)
+                temp_backup_path.rename(target_backup_path)
+                print(f"  ファイル: {stats['files']} 件 / 読み込み: {stats['bytes_read']:,} bytes / 書き込み: {stats['bytes_written']:,} bytes")
+                metrics.count("records_in", stats["files"])
+                metrics.count("bytes_read", stats["bytes_read"])
+                metrics.count("bytes_written", stats["bytes_written"])
+            elif BACKUP_MODE == "incremental":
+                previous_path, previous_manifest = find_latest_snapshot(BACKUP_DIR)
+                if previous_path:
+                    print(f"差分バックアップ: 前世代 {previous_path.name} を参照します。")
+                else:
+                    print("差分バックアップ: 参照できる前世代がないため、全ファイルをコピーします。")
+                stats = create_snapshot(VAULT_PATH, temp_backup_path, previous_path, previous_manifest)
+                temp_backup_path.rename(target_backup_path)
+                print(f"  リンク: {stats['linked']} 件 / コピー: {stats['copied']} 件 ({stats['bytes_copied']:,} bytes)")
+                metrics.count("records_in", stats["linked"] + stats["copied"])
+                metrics.count("records_out", stats["copied"])
+                metrics.count("bytes_written", stats["bytes_copied"])
+            else:
+                shutil.copytree(VAULT_PATH, target_backup_path)
             print(f"バックアップ完了: {target_backup_path}")
             rotate_backups(BACKUP_DIR, BACKUP_GENERATIONS)
             return True
         except Exception as e:
             print(f"警告: バックアップ処理中にエラーが発生しました。バックアップをスキップして続行します。\n理由: {e}")
+            if temp_backup_path.is_dir():
+                shutil.rmtree(temp_backup_path, ignore_errors=True)
+            elif temp_backup_path.exists():
+                temp_backup_path.unlink(missing_ok=True)
             return False
 
+# --- 検証・差分・復元 ---
+
+def hash_files_parallel(files, known, workers):
+    """
+    (相対パス, 実パス, stat) のリストからマニフェストを作成する。
+    known にサイズ・更新日時が一致するエントリがあればハッシュを再利用し、残りを並列に計算する。
+    """
+    result = {}
+    to_hash = []
+    for rel, src, st in files:
+        k = known.get(rel)
+        if k and k.get("sha256") and k["size"] == st.st_size and k["mtime_ns"] == st.st_mtime_ns:
+            result[rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": k["sha256"]}
+        else:
+            to_hash.append((rel, src, st))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = pool.map(file_sha256, [src for _, src, _ in to_hash])
+        for (rel, _, st), digest in zip(to_hash, digests):
+            result[rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+
+    return result, len(to_hash)
+
+def load_vault_hash_cache():
+    try:
+        with open(VAULT_HASH_CACHE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_vault_hash_cache(files):
+    try:
+        with open(VAULT_HASH_CACHE, "w", encoding="utf-8") as f:
+            json.dump(files, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"警告: ハッシュキャッシュの保存に失敗しました: {e}")
+
+def build_vault_manifest(known=None):
+    """現在の Vault のマニフェストを作成する (キャッシュと known のハッシュを再利用)"""
+    # キャッシュの方が新しいため、世代のマニフェストより優先する
+    reusable = dict(known or {})
+    reusable.update(load_vault_hash_cache())
+    _, files = scan_vault(VAULT_PATH)
+    manifest_files, hashed_count = hash_files_parallel(files, reusable, BACKUP_WORKERS)
+    save_vault_hash_cache(manifest_files)
+    print(f"Vault: {len(manifest_files)} 件 (ハッシュ計算 {hashed_count} 件、残りはキャッシュを再利用)")
+    return manifest_files
+
+def resolve_generation(name):
+    """世代名 (省略時・latest は最新) から世代のパスを返す。前方一致でも指定できる"""
+    generations = list_generations(BACKUP_DIR)
+    if not generations:
+        return None
+    if name in (None, "latest"):
+        return generations[-1]
+
+    matches = [p for p in generations if p.name == name or p.name.startswith(name)]
+    if len(matches) == 1:
+        return matches[0]
+    exact = [p for p in matches if p.name == name]
+    if exact:
+        return exact[0]
+    if matches:
+        print(f"エラー: 世代名 '{name}' に一致する世代が複数あります: {', '.join(p.name for p in matches)}")
+    return None
+
+def diff_manifests(old_files, new_files):
+    """2 つのマニフェストの差分 (追加, 変更, 削除) を返す"""
+    added = sorted(rel for rel in new_files if rel not in old_files)
+    deleted = sorted(rel for rel in old_files if rel not in new_files)
+    changed = sorted(
+        rel for rel in new_files
+        if rel in old_files and new_files[rel]["sha256"] != old_files[rel]["sha256"]
+    )
+    return added, changed, deleted
+
+def print_diff(added, changed, deleted):
+    for rel in added:
+        print(f"  + {rel}")
+    for rel in changed:
+        print(f"  M {rel}")
+    for rel in deleted:
+        print(f"  - {rel}")
+    print(f"追加: {len(added)} 件 / 変更: {len(changed)} 件 / 削除: {len(deleted)} 件")
+
+def _manifest_for_target(name):
+    """diff の比較対象 (世代名または vault) のマニフェストを返す"""
+    if name == "vault":
+        return build_vault_manifest()
+    generation = resolve_generation(name)
+    if generation is None:
+        print(f"エラー: 世代が見つかりません: {name}")
+        return None
+    manifest = load_manifest(generation)
+    if manifest is None:
+        print(f"エラー: {generation.name} にマニフェストがありません。")
+        return None
+    print(f"{generation.name}: {len(manifest['files'])} 件")
+    return manifest["files"]
+
+def diff_generations(old_name, new_name="vault"):
+    """2 つの世代、または世代と現在の Vault の差分を表示する"""
+    old_files = _manifest_for_target(old_name)
+    new_files = _manifest_for_target(new_name)
+    if old_files is None or new_files is None:
+        return False
+    print_diff(*diff_manifests(old_files, new_files))
+    return True
+
+def _open_archive_stream(generation, codec, block_offset, skip):
+    """アーカイブの指定ブロックから展開を始めるストリームを返す"""
+    f = open(generation, "rb")
+    f.seek(block_offset)
+    stream = ARCHIVE_CODECS[codec][2](f)
+    while skip > 0:
+        skipped = len(stream.read(min(skip, HASH_CHUNK_SIZE)))
+        if not skipped:
+            break
+        skip -= skipped
+    return f, stream
+
+def _iter_archive_members(generation, manifest, rels):
+    """
+    アーカイブから rels に含まれるファイルを (相対パス, ファイルオブジェクト) として返す。
+    先頭ではなく、対象を含む最初の圧縮ブロックから展開を始める。
+    """
+    codec = manifest["codec"]
+    if codec not in ARCHIVE_CODECS:
+        raise ValueError(f"この環境では圧縮形式 {codec} を展開できません。")
+
+    if not rels:
+        return
+    files = manifest["files"]
+    first = min(rels, key=lambda rel: (files[rel]["block"], files[rel]["skip"]))
+    remaining = set(rels)
+    f, stream = _open_archive_stream(generation, codec, files[first]["block"], files[first]["skip"])
+    try:
+        with tarfile.open(fileobj=stream, mode="r|") as tar:
+            for member in tar:
+                if member.name in remaining and member.isfile():
+                    yield member.name, tar.extractfile(member)
+                    remaining.discard(member.name)
+                    if not remaining:
+                        break
+    finally:
+        stream.close()
+        f.close()
+
+def _hash_stream(fileobj):
+    h = hashlib.sha256()
+    while chunk := fileobj.read(HASH_CHUNK_SIZE):
+        h.update(chunk)
+    return h.hexdigest()
+
+def check_generation_integrity(generation, manifest, deep=False):
+    """
+    世代の中身がマニフェストと一致するか確認し、問題のあるファイルのリストを返す。
+    通常はサイズのみ確認し、deep=True の場合はハッシュを再計算する。
+    """
+    files = manifest["files"]
+    problems = []
+
+    if is_archive_generation(generation):
+        if not deep:
+            return problems
+        seen = set()
+        for rel, member in _iter_archive_members(generation, manifest, list(files)):
+            seen.add(rel)
+            if _hash_stream(member) != files[rel]["sha256"]:
+                problems.append(rel)
+        problems.extend(sorted(set(files) - seen))
+        return problems
+
+    entries = []
+    for rel, info in files.items():
+        path = generation / rel
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            problems.append(rel)
+            continue
+        if st.st_size != info["size"]:
+            problems.append(rel)
+        elif deep:
+            entries.append((rel, path))
+
+    if entries:
+        with ThreadPoolExecutor(max_workers=BACKUP_WORKERS) as pool:
+            digests = pool.map(file_sha256, [path for _, path in entries])
+            for (rel, _), digest in zip(entries, digests):
+                if digest != files[rel]["sha256"]:
+                    problems.append(rel)
+
+    return sorted(problems)
+
+def verify_backup(name=None, deep=False):
+    """世代がマニフェストどおりに保存されているか、また現在の Vault と一致するかを確認する"""
+    generation = resolve_generation(name)
+    if generation is None:
+        print("エラー: 検証するバックアップ世代が見つかりません。")
+        return False
+    manifest = load_manifest(generation)
+    if manifest is None:
+        print(f"エラー: {generation.name} にマニフェストがありません。")
+        return False
+
+    print(f"検証中: {generation.name} ({'ハッシュ再計算' if deep else 'サイズ確認'})")
+    problems = check_generation_integrity(generation, manifest, deep)
+    for rel in problems:
+        print(f"  破損/欠落: {rel}")
+
+    print("現在の Vault と比較中...")
+    vault_files = build_vault_manifest(manifest["files"])
+    added, changed, deleted = diff_manifests(manifest["files"], vault_files)
+    print_diff(added, changed, deleted)
+
+    if problems:
+        print(f"検証失敗: {len(problems)} 件のファイルがマニフェストと一致しません。")
+        return False
+    print("検証完了: バックアップはマニフェストと一致しています。")
+    return True
+
+def restore_backup(name, target, dest=None, overwrite=False):
+    """世代から 1 ファイルまたはフォルダ配下を復元する (既定の復元先は Vault)"""
+    generation = resolve_generation(name)
+    if generation is None:
+        print(f"エラー: 世代が見つかりません: {name}")
+        return False
+    manifest = load_manifest(generation)
+    if manifest is None:
+        print(f"エラー: {generation.name} にマニフェストがありません。")
+        return False
+
+    dest = Path(dest) if dest else VAULT_PATH
+    prefix = Path(target).as_posix().strip("/")
+    if prefix in ("", "."):
+        rels = list(manifest["files"])
+    else:
+        rels = [rel for rel in manifest["files"] if rel == prefix or rel.startswith(prefix + "/")]
+    if not rels:
+        print(f"エラー: {generation.name} に {target} は含まれていません。")
+        return False
+
+    if not overwrite:
+        existing = [rel for rel in rels if (dest / rel).exists()]
+        if existing:
+            print(f"{len(existing)} 件は復元先に既に存在するためスキップします (上書きする場合は --overwrite)。")
+            existing = set(existing)
+            rels = [rel for rel in rels if rel not in existing]
+    if not rels:
+        print(f"復元完了: 0 件 ({generation.name} -> {dest})")
+        return True
+
+    restored = 0
+    if is_archive_generation(generation):
+        for rel, member in _iter_archive_members(generation, manifest, rels):
+            out_path = dest / rel
+            out_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(out_path, "wb") as out:
+                shutil.copyfileobj(member, out)
+            mtime_ns = manifest["files"][rel]["mtime_ns"]
+            os.utime(out_path, ns=(mtime_ns, mtime_ns))
+            restored += 1
+    else:
+        for rel in rels:
+            out_path = dest / rel
+            out_path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(generation / rel, out_path)
+            restored += 1
+
+    print(f"復元完了: {restored} 件 ({generation.name} -> {dest})")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Obsidian Vault のバックアップ・検証・復元")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("backup", help="バックアップを作成 (既定)")
+
+    p_verify = sub.add_parser("verify", help="世代を検証し、現在の Vault との差分を表示")
+    p_verify.add_argument("generation", nargs="?", help="世代名 (省略時は最新)")
+    p_verify.add_argument("--deep", action="store_true", help="バックアップ側のハッシュも再計算する")
+
+    p_diff = sub.add_parser("diff", help="2 つの世代、または世代と Vault の差分を表示")
+    p_diff.add_argument("old", help="比較元の世代名 (latest 可)")
+    p_diff.add_argument("new", nargs="?", default="vault", help="比較先の世代名 (省略時は現在の Vault)")
+
+    p_restore = sub.add_parser("restore", help="世代からファイルまたはフォルダを復元")
+    p_restore.add_argument("generation", help="世代名 (latest 可)")
+    p_restore.add_argument("path", help="Vault 内の相対パス (ファイルまたはフォルダ)")
+    p_restore.add_argument("--dest", default=None, help="復元先フォルダ (省略時は Vault)")
+    p_restore.add_argument("--overwrite", action="store_true", help="既存ファイルを上書きする")
+
+    args = parser.parse_args()
+
+    if args.command == "verify":
+        ok = verify_backup(args.generation, args.deep)
+    elif args.command == "diff":
+        ok = diff_generations(args.old, args.new)
+    elif args.command == "restore":
+        ok = restore_backup(args.generation, args.path, args.dest, args.overwrite)
+    else:
+        ok = create_backup()
+
+    if args.command is not None and not ok:
+        sys.exit(1)
+
 if __name__ == "__main__":
-    create_backup()
\ No newline at end of file
+    main()
\ No newline at end of file
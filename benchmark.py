@@ -0,0 +1,534 @@
+"""
+合成データで各処理の所要時間を計測するベンチマーク。
+複数年分の Timeline JSON・Chrome の History・Vault を規模ごとに生成し、
+Places API と Open-Meteo はローカルのスタブサーバーで代用して、
+各処理を初回 (キャッシュなし) と 2 回目 (キャッシュあり) で計測する。
+
+`uv run benchmark.py --save-baseline` で結果を基準値として保存し、
+以降の `uv run benchmark.py` で基準値と比較する (悪化があれば終了コード 1)。
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import datetime
+import threading
+import contextlib
+import subprocess
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import metrics
+
+SCRIPT_DIR = Path(__file__).parent
+BENCH_DATA_DIR = SCRIPT_DIR / "bench_data"
+BASELINE_PATH = SCRIPT_DIR / "benchmark_baseline.json"
+
+# 規模ごとの生成パラメータ
+# years: Timeline と閲覧履歴の期間 / visits: History の訪問数 / urls: History の URL 数
+# notes: Vault のノート数 (うち期間内の日付はデイリーノート) / attachments: 添付ファイル数
+SCALES = {
+    "small": {"years": 1, "visits": 50_000, "urls": 5_000, "notes": 1_000, "attachments": 100},
+    "medium": {"years": 3, "visits": 300_000, "urls": 20_000, "notes": 5_000, "attachments": 500},
+    "large": {"years": 6, "visits": 1_200_000, "urls": 60_000, "notes": 20_000, "attachments": 2_000},
+}
+ATTACHMENT_BYTES = 32 * 1024
+PLACE_COUNT = 300
+SEED = 20240301
+
+# 基準値より何倍遅くなったら悪化とみなすか
+REGRESSION_RATIO = metrics.REGRESSION_RATIO
+# 短い処理のぶれを警告しないための下限 (秒)
+REGRESSION_MIN_SECONDS = 0.1
+
+JST = datetime.timezone(datetime.timedelta(hours=9))
+WEBKIT_EPOCH_DIFF = 11644473600
+DAILY_FOLDER = "daily"
+
+# --- 合成データの生成 ---
+
+def _lat_lng(lat, lon):
+    return f"{lat:.7f}°, {lon:.7f}°"
+
+def _place(n):
+    """場所 ID と座標 (東京周辺)。スタブサーバーも同じ規則で応答する"""
+    rng = random.Random(n)
+    return f"bench-place-{n:05d}", 35.5 + rng.random() * 0.4, 139.4 + rng.random() * 0.5
+
+def generate_timeline(path, day, years, rng):
+    """
+    day までの years 年分の Timeline JSON (semanticSegments 形式) を生成する。
+    1 日あたり訪問 3〜7 件と、その間の移動 (activity) と経路 (timelinePath) を含む。
+    戻り値はセグメント数
+    """
+    first = day - datetime.timedelta(days=365 * years - 1)
+    # 自宅と、よく行く場所ほど選ばれやすくする
+    weights = [1 / (i + 1) for i in range(PLACE_COUNT)]
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"semanticSegments": [\n')
+        current = first
+        while current <= day:
+            day_start = datetime.datetime.combine(current, datetime.time.min, JST)
+            visits = [0] + rng.choices(range(1, PLACE_COUNT), weights[1:], k=rng.randint(2, 6))
+            t = 0
+            for i, n in enumerate(visits):
+                place_id, lat, lon = _place(n)
+                last = i == len(visits) - 1
+                stay = 1440 - t if last else min(rng.randint(60, 300), 1440 - t - 60)
+                start, t = t, t + max(stay, 1)
+                segment = {
+                    "startTime": (day_start + datetime.timedelta(minutes=start)).isoformat(timespec="milliseconds"),
+                    "endTime": (day_start + datetime.timedelta(minutes=t)).isoformat(timespec="milliseconds"),
+                    "visit": {"hierarchyLevel": 0, "probability": 0.9,
+                              "topCandidate": {"placeID": place_id, "semanticType": "UNKNOWN", "probability": 0.8,
+                                               "placeLocation": {"latLng": _lat_lng(lat, lon)}}},
+                }
+                segments = [segment]
+                if not last and t < 1440:
+                    _, lat2, lon2 = _place(visits[i + 1])
+                    move = rng.randint(10, 60)
+                    move_start = day_start + datetime.timedelta(minutes=t)
+                    move_end = move_start + datetime.timedelta(minutes=move)
+                    times = (move_start.isoformat(timespec="milliseconds"), move_end.isoformat(timespec="milliseconds"))
+                    segments.append({
+                        "startTime": times[0], "endTime": times[1],
+                        "activity": {"start": {"latLng": _lat_lng(lat, lon)}, "end": {"latLng": _lat_lng(lat2, lon2)},
+                                     "distanceMeters": rng.randint(500, 20000),
+                                     "topCandidate": {"type": rng.choice(["WALKING", "IN_TRAIN", "IN_PASSENGER_VEHICLE"]),
+                                                      "probability": 0.7}},
+                    })
+                    points = 8
+                    segments.append({
+                        "startTime": times[0], "endTime": times[1],
+                        "timelinePath": [
+                            {"point": _lat_lng(lat + (lat2 - lat) * k / points, lon + (lon2 - lon) * k / points),
+                             "time": (move_start + datetime.timedelta(minutes=move * k / points)).isoformat(timespec="milliseconds")}
+                            for k in range(points + 1)
+                        ],
+                    })
+                    t += move
+                for s in segments:
+                    f.write(("" if count == 0 else ",\n") + json.dumps(s, ensure_ascii=False))
+                    count += 1
+                if t >= 1440:
+                    break
+            current += datetime.timedelta(days=1)
+        f.write("\n]}\n")
+    return count
+
+def generate_chrome_history(path, day, years, visit_count, url_count, rng):
+    """Chrome の History と同じ構造の SQLite を生成する (day の終わりまでの years 年分)"""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE meta(key LONGVARCHAR NOT NULL UNIQUE PRIMARY KEY, value LONGVARCHAR);
+        CREATE TABLE urls(id INTEGER PRIMARY KEY AUTOINCREMENT, url LONGVARCHAR, title LONGVARCHAR,
+                          visit_count INTEGER DEFAULT 0 NOT NULL, typed_count INTEGER DEFAULT 0 NOT NULL,
+                          last_visit_time INTEGER NOT NULL, hidden INTEGER DEFAULT 0 NOT NULL);
+        CREATE TABLE visits(id INTEGER PRIMARY KEY, url INTEGER NOT NULL, visit_time INTEGER NOT NULL,
+                            from_visit INTEGER, transition INTEGER DEFAULT 0 NOT NULL, segment_id INTEGER,
+                            visit_duration INTEGER DEFAULT 0 NOT NULL);
+        CREATE INDEX visits_url_index ON visits (url);
+        CREATE INDEX visits_time_index ON visits (visit_time);
+    """)
+    conn.execute("INSERT INTO meta VALUES ('version', '68')")
+
+    end = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min).timestamp()
+    start = end - 365 * years * 86400
+    domains = max(1, url_count // 20)
+    conn.executemany(
+        "INSERT INTO urls (id, url, title, last_visit_time) VALUES (?, ?, ?, 0)",
+        ((i, f"https://site{i % domains}.example.com/page/{i}", f"ページ {i}") for i in range(1, url_count + 1)),
+    )
+
+    # 閲覧は一部の URL に偏り、遷移はリンクが大半でフレーム内の読み込みも含む
+    transitions = [0x30000000, 0x30000001, 3, 0x30000008, 0x30000007]
+    transition_weights = [70, 10, 10, 5, 5]
+    times = sorted(rng.uniform(start, end) for _ in range(visit_count))
+    batch = 100_000
+    for offset in range(0, visit_count, batch):
+        rows = []
+        for i, t in enumerate(times[offset:offset + batch], offset + 1):
+            url = min(int(rng.paretovariate(1.1)), url_count)
+            rows.append((i, url, int((t + WEBKIT_EPOCH_DIFF) * 1_000_000),
+                         rng.choices(transitions, transition_weights)[0], rng.randint(0, 600) * 1_000_000))
+        conn.executemany("INSERT INTO visits (id, url, visit_time, transition, visit_duration) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+def _note_text(rng, paragraphs):
+    words = ["今日", "作業", "メモ", "会議", "読書", "散歩", "買い物", "料理", "設計", "レビュー", "調査", "旅行"]
+    return "\n\n".join(" ".join(rng.choices(words, k=rng.randint(20, 120))) for _ in range(paragraphs))
+
+def generate_vault(vault, day, years, note_count, attachment_count, rng):
+    """
+    Vault を生成する。期間内の日付 (新しい順) のデイリーノートと通常のノート・添付ファイルを作る。
+    対象日のデイリーノートは必ず作成する。
+    """
+    daily_dir = vault / DAILY_FOLDER
+    daily_dir.mkdir(parents=True)
+    daily_count = min(note_count // 2, 365 * years)
+    for i in range(max(daily_count, 1)):
+        d = day - datetime.timedelta(days=i)
+        text = f"---\ntags: daily\n---\n\n# {d.isoformat()}\n\n{_note_text(rng, rng.randint(1, 4))}\n"
+        (daily_dir / f"{d.isoformat()}.md").write_text(text, encoding="utf-8")
+
+    for i in range(note_count - daily_count):
+        folder = vault / "notes" / f"{i // 500:03d}"
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / f"note{i:05d}.md").write_text(f"# ノート {i}\n\n{_note_text(rng, rng.randint(1, 8))}\n", encoding="utf-8")
+
+    attachments = vault / "attachments"
+    attachments.mkdir()
+    for i in range(attachment_count):
+        (attachments / f"image{i:05d}.png").write_bytes(rng.randbytes(ATTACHMENT_BYTES))
+
+def prepare_inputs(scale, day, data_dir):
+    """
+    規模ごとの入力データを用意する。同じ規模・対象日のデータが生成済みであれば再利用する。
+    戻り値は入力データのフォルダ
+    """
+    params = SCALES[scale]
+    inputs = data_dir / scale / "inputs"
+    manifest_path = inputs / "manifest.json"
+    manifest = {"scale": scale, "day": day.isoformat(), "seed": SEED, **params}
+    if manifest_path.exists():
+        try:
+            if json.loads(manifest_path.read_text(encoding="utf-8")) == manifest:
+                return inputs
+        except (OSError, ValueError):
+            pass
+
+    if inputs.exists():
+        shutil.rmtree(inputs)
+    inputs.mkdir(parents=True)
+    rng = random.Random(f"{SEED}-{scale}")
+
+    print(f"[{scale}] 入力データを生成中...")
+    started = time.monotonic()
+    segments = generate_timeline(inputs / "Timeline.json", day, params["years"], rng)
+    print(f"  Timeline: {segments:,} セグメント ({(inputs / 'Timeline.json').stat().st_size / 1024 / 1024:.1f}MB)")
+    generate_chrome_history(inputs / "History", day, params["years"], params["visits"], params["urls"], rng)
+    print(f"  History: {params['visits']:,} 訪問 / {params['urls']:,} URL")
+    generate_vault(inputs / "vault", day, params["years"], params["notes"], params["attachments"], rng)
+    print(f"  Vault: {params['notes']:,} ノート / 添付 {params['attachments']:,} 件")
+    shutil.copy2(inputs / "vault" / DAILY_FOLDER / f"{day.isoformat()}.md", inputs / "daily_note.md")
+    print(f"  生成完了 ({time.monotonic() - started:.1f} 秒)")
+
+    manifest_path.write_text(json.dumps(manifest), encoding="utf-8")
+    return inputs
+
+# --- Places API / Open-Meteo のスタブ ---
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Places API (/places/{id}) と Open-Meteo (daily / hourly) に決まった値を返す"""
+
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, body, status=200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        parts = urlsplit(self.path)
+        if parts.path.startswith("/places/"):
+            place_id = parts.path.rsplit("/", 1)[-1]
+            try:
+                n = int(place_id.rsplit("-", 1)[-1])
+            except ValueError:
+                self._send_json({"error": "not found"}, 404)
+                return
+            _, lat, lon = _place(n)
+            self._send_json({"displayName": {"text": f"場所 {n}"}, "formattedAddress": f"東京都 {n} 番地",
+                             "location": {"latitude": lat, "longitude": lon}})
+            return
+
+        q = parse_qs(parts.query)
+        try:
+            start = datetime.date.fromisoformat(q["start_date"][0])
+            end = datetime.date.fromisoformat(q["end_date"][0])
+        except (KeyError, ValueError):
+            self._send_json({"error": "bad request"}, 400)
+            return
+        days = [(start + datetime.timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+        if "hourly" in q:
+            times = [f"{d}T{h:02d}:00" for d in days for h in range(24)]
+            self._send_json({"hourly": {"time": times,
+                                        "weathercode": [(i // 6) % 4 for i in range(len(times))],
+                                        "temperature_2m": [15 + (i % 24) / 2 for i in range(len(times))]}})
+        else:
+            n = len(days)
+            self._send_json({"daily": {"time": days, "weathercode": [1] * n,
+                                       "temperature_2m_max": [22.5] * n, "temperature_2m_min": [12.5] * n,
+                                       "surface_pressure_max": [1015.0] * n, "surface_pressure_min": [1005.0] * n}})
+
+def start_stub_server(latency=0.0, handler_class=None):
+    """スタブサーバーを別スレッドで起動し、(サーバー, ベース URL) を返す (handler_class は StubHandler の派生クラス)"""
+    handler = type("Handler", (handler_class or StubHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# --- 計測対象の処理 ---
+# 各関数は作業フォルダで準備を行い、計測する処理 (引数なしの関数) を返す。子プロセス内で呼ばれる。
+
+def _case_backup(day, work, inputs):
+    from backup_vault import create_backup
+    return create_backup
+
+def _case_location(day, work, inputs):
+    import exportDailyLocation
+    # インデックスは通常スクリプトと同じフォルダに作られるため、作業フォルダに置き換える
+    exportDailyLocation.INDEX_PATH = str(work / "location_index.json")
+    sys.argv = ["exportDailyLocation.py", day]
+    return exportDailyLocation.main
+
+def _case_places(day, work, inputs):
+    import getLocationData
+    sys.argv = ["getLocationData.py", day]
+    return getLocationData.main
+
+def _case_chrome(day, work, inputs):
+    import getChromeHistory
+    sys.argv = ["getChromeHistory.py", day]
+    return getChromeHistory.main
+
+def _case_weather(day, work, inputs):
+    from update_weather import update_weather_in_note, VAULT_PATH, DAILY_NOTE_FOLDER_STR
+    return lambda: update_weather_in_note(VAULT_PATH / DAILY_NOTE_FOLDER_STR / f"{day}.md", day)
+
+def _case_note(day, work, inputs):
+    import exportDailyNote
+    return exportDailyNote.main
+
+def _case_index(day, work, inputs):
+    import search_index
+    return search_index.update_index
+
+CASES = {
+    "backup": ("backup_vault.create_backup", _case_backup),
+    "location": ("exportDailyLocation.main", _case_location),
+    "places": ("getLocationData.main", _case_places),
+    "chrome": ("getChromeHistory.main", _case_chrome),
+    "weather": ("update_weather.update_weather_in_note", _case_weather),
+    "note": ("exportDailyNote.main", _case_note),
+    "index": ("search_index.update_index", _case_index),
+}
+PHASES = ("cold", "warm")
+
+def run_case(name, day, work, inputs):
+    """子プロセス側: 1 つの処理を計測し、結果を JSON で標準出力の最終行に書く"""
+    func = CASES[name][1](day, Path(work), Path(inputs))
+    error = None
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        with metrics.StageMeter(name) as meter:
+            try:
+                if func() is False:
+                    error = "False を返しました"
+            except Exception as e:
+                error = repr(e)
+    print(json.dumps({**meter.result, "error": error}, ensure_ascii=False))
+
+def bench_env(work, inputs, base_url):
+    """
+    子プロセスの環境変数。.env の設定で結果が変わらないよう、各スクリプトの設定をすべて指定する
+    (load_dotenv は既存の環境変数を上書きしない)。
+    """
+    env = dict(os.environ)
+    env.update({
+        "VAULT_PATH": str(inputs / "vault"),
+        "DAILY_NOTE_FOLDER": DAILY_FOLDER,
+        "BACKUP_DIR": str(work / "backup"),
+        "BACKUP_GENERATIONS": "5",
+        "BACKUP_MODE": "incremental",
+        "BACKUP_COMPRESSION": "gz",
+        "BACKUP_WORKERS": str(os.cpu_count() or 4),
+        "LOCATION_HISTORY_PATH": str(inputs / "Timeline.json"),
+        "LOCATION_POINTS_DIR": str(work / "location_points"),
+        "GOOGLE_MAPS_API_KEY": "benchmark",
+        "PLACES_API_BASE_URL": base_url,
+        "PLACES_QPS": "5",
+        "PLACES_MAX_WORKERS": "8",
+        "PLACES_TIMEOUT": "10",
+        "PLACES_MAX_RETRIES": "4",
+        "PLACE_CACHE_TTL_DAYS": "0",
+        "PLACE_NEGATIVE_TTL_DAYS": "7",
+        "PLACE_MATCH_RADIUS_M": "100",
+        "CHROME_HISTORY_PATH": str(inputs / "History"),
+        "CHROME_EXE_PATH": "",
+        "CHROME_HISTORY_PATHS": "",
+        "CHROME_PROFILE_ROOTS": "",
+        "CHROME_MAX_WORKERS": "4",
+        "CHROME_WAREHOUSE_PATH": str(work / "chrome_history.sqlite3"),
+        "CHROME_SNAPSHOT_MODE": "auto",
+        "HISTORY_TOP_N": "20",
+        "HISTORY_SESSION_GAP_MINUTES": "30",
+        "HISTORY_DETAIL_DIR": str(work / "history_detail"),
+        "WEATHER_API_URL": f"{base_url}/v1/archive",
+        "WEATHER_CACHE_DB": str(work / "weather_cache.sqlite3"),
+        "WEATHER_GRID_DECIMALS": "2",
+        "WEATHER_BATCH_DAYS": "366",
+        "WEATHER_CLUSTER_KM": "10",
+        "DEFAULT_LAT": "35.6812",
+        "DEFAULT_LON": "139.7671",
+        "PIPELINE_METRICS_PATH": str(work / "pipeline_metrics.jsonl"),
+        "DAILY_STORE_PATH": str(work / "daily_store.sqlite3"),
+        "DAILY_ARCHIVE_DIR": str(work / "archive"),
+        "DAILY_STORE_RETAIN_DAYS": "31",
+        "SEARCH_INDEX_PATH": str(work / "search_index.sqlite3"),
+        "NOTE_MAX_WORKERS": "8",
+    })
+    return env
+
+def run_scale(scale, day, data_dir, base_url):
+    """1 つの規模の全処理を初回・2 回目の順に計測する。戻り値は {処理名: {フェーズ: 計測値}}"""
+    inputs = prepare_inputs(scale, day, data_dir)
+    work = data_dir / scale / "work"
+    if work.exists():
+        shutil.rmtree(work)
+    work.mkdir(parents=True)
+    # 前回の計測で書き換えた対象日のデイリーノートを元に戻す
+    shutil.copy2(inputs / "daily_note.md", inputs / "vault" / DAILY_FOLDER / f"{day.isoformat()}.md")
+    env = bench_env(work, inputs, base_url)
+
+    results = {}
+    for name, (target, _) in CASES.items():
+        results[name] = {}
+        for phase in PHASES:
+            if name == "backup" and phase != PHASES[0]:
+                # バックアップの世代名は秒単位のため、前の世代と同じ名前にならないよう待つ
+                time.sleep(1 - time.time() % 1)
+            proc = subprocess.run(
+                [sys.executable, str(Path(__file__).resolve()), "--run-case", name,
+                 "--day", day.isoformat(), "--work", str(work), "--inputs", str(inputs)],
+                cwd=work, env=env, capture_output=True, text=True, encoding="utf-8",
+            )
+            lines = proc.stdout.strip().splitlines()
+            try:
+                values = json.loads(lines[-1])
+            except (IndexError, ValueError):
+                values = {"error": (proc.stderr.strip().splitlines() or ["結果を取得できませんでした"])[-1]}
+            results[name][phase] = values
+            status = f"エラー: {values['error']}" if values.get("error") else f"{values['wall_seconds']:.2f}s"
+            print(f"  {scale:<7} {target:<40} {phase:<5} {status}")
+    return results
+
+# --- 基準値との比較 ---
+
+def load_baseline(path=BASELINE_PATH):
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"警告: 基準値を読み込めません ({path}): {e}")
+        return None
+
+def save_baseline(results, path=BASELINE_PATH):
+    data = {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"\n基準値を保存しました: {path}")
+
+def compare(results, baseline, ratio=REGRESSION_RATIO, min_seconds=REGRESSION_MIN_SECONDS):
+    """
+    基準値と処理時間を比較して表示する。戻り値は悪化した項目のリスト [(規模, 処理名, フェーズ, 今回, 基準値)]
+    """
+    print(f"\n基準値との比較 ({baseline.get('created_at', '?')} / Python {baseline.get('python', '?')})")
+    regressions = []
+    for scale, cases in results.items():
+        base_cases = baseline.get("results", {}).get(scale)
+        if not base_cases:
+            print(f"  {scale}: 基準値がありません")
+            continue
+        for name, phases in cases.items():
+            for phase, values in phases.items():
+                base_values = base_cases.get(name, {}).get(phase, {})
+                if values.get("error") or base_values.get("error"):
+                    continue
+                current = values.get("wall_seconds")
+                base = base_values.get("wall_seconds")
+                if current is None or base is None:
+                    continue
+                change = (current - base) / base * 100 if base > 0 else 0.0
+                mark = ""
+                if current >= min_seconds and base > 0 and current > base * ratio:
+                    regressions.append((scale, name, phase, current, base))
+                    mark = "  ← 悪化"
+                print(f"  {scale:<7} {name:<9} {phase:<5} {base:>8.2f}s → {current:>8.2f}s ({change:+.0f}%){mark}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="合成データで各処理の所要時間を計測し、基準値と比較する")
+    parser.add_argument("--scale", nargs="+", choices=list(SCALES), default=["small"],
+                        help="計測する規模 (既定 small。複数指定可)")
+    parser.add_argument("--data-dir", default=str(BENCH_DATA_DIR), help="合成データと作業フォルダの保存先")
+    parser.add_argument("--latency", type=float, default=0.0, help="スタブサーバーの応答遅延 (ミリ秒)")
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果を基準値として保存する")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH), help="基準値のファイル")
+    parser.add_argument("--ratio", type=float, default=REGRESSION_RATIO, help=f"悪化とみなす倍率 (既定 {REGRESSION_RATIO})")
+    # 子プロセスで 1 つの処理を計測するための引数
+    parser.add_argument("--run-case", choices=list(CASES), help=argparse.SUPPRESS)
+    parser.add_argument("--day", help=argparse.SUPPRESS)
+    parser.add_argument("--work", help=argparse.SUPPRESS)
+    parser.add_argument("--inputs", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_case(args.run_case, args.day, args.work, args.inputs)
+        return
+
+    # 各スクリプトの既定の対象日 (前日) に合わせる
+    day = datetime.date.today() - datetime.timedelta(days=1)
+    data_dir = Path(args.data_dir)
+    server, base_url = start_stub_server(args.latency / 1000)
+    try:
+        results = {}
+        for scale in args.scale:
+            results[scale] = run_scale(scale, day, data_dir, base_url)
+    finally:
+        server.shutdown()
+
+    errors = [(s, n, p) for s, cases in results.items() for n, phases in cases.items()
+              for p, v in phases.items() if v.get("error")]
+    if errors:
+        print(f"\n警告: {len(errors)} 件の計測でエラーが発生しました。")
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        save_baseline(results, baseline_path)
+        return
+
+    baseline = load_baseline(baseline_path)
+    if baseline is None:
+        print("\n基準値がありません。--save-baseline で保存できます。")
+        return
+    regressions = compare(results, baseline, args.ratio)
+    if regressions:
+        print(f"\n警告: 基準値の {args.ratio} 倍を超えて遅くなった項目が {len(regressions)} 件あります。")
+        sys.exit(1)
+    print("\n悪化した項目はありません。")
+
+if __name__ == "__main__":
+    main()
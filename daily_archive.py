@@ -0,0 +1,386 @@
+"""
+処理済みの日ごとのデータ (位置情報・場所情報・閲覧履歴) を月ごとの圧縮ファイルにまとめて保存するアーカイブ。
+(日付, 取得元) ごとに個別に圧縮して追記し、末尾の索引から必要な日の分だけを展開して読み込む。
+以前の archive/ フォルダに 1 日 3 ファイルずつ移動していた JSON の代わりに使う。
+"""
+
+import os
+import re
+import json
+import zlib
+import struct
+import argparse
+import datetime
+from pathlib import Path
+from dotenv import load_dotenv
+
+import daily_store
+import metrics
+
+# --- 設定読み込み ---
+
+SCRIPT_DIR = Path(__file__).parent
+env_path = SCRIPT_DIR / ".env"
+load_dotenv(env_path)
+
+_archive_dir_raw = os.getenv("DAILY_ARCHIVE_DIR")
+ARCHIVE_DIR = Path(os.path.expandvars(_archive_dir_raw)) if _archive_dir_raw else SCRIPT_DIR / "archive"
+
+# ファイル形式: 圧縮したデータを追記していき、末尾に圧縮した索引 (JSON) とフッター (マジック, 索引の位置, 索引の長さ) を置く。
+# 追記時は既存のデータを書き換えず、新しいデータの後に索引とフッターを書き直す (古い索引は不要領域として残る)
+ARCHIVE_MAGIC = b"DAR1"
+ARCHIVE_FOOTER = struct.Struct("<4sQI")
+ARCHIVE_SUFFIX = ".dar"
+
+# 不要領域 (置き換えたデータ・古い索引) がファイルのこの割合を超えたら詰め直す
+COMPACT_RATIO = 0.5
+
+try:
+    # データストアに残す日数。これより前の日はアーカイブに保存したことを確認してからデータストアから削除する (0 で削除しない)
+    STORE_RETAIN_DAYS = max(0, int(os.getenv("DAILY_STORE_RETAIN_DAYS", "31")))
+except ValueError:
+    print("警告: DAILY_STORE_RETAIN_DAYS の設定が不正です。デフォルト値(31)を使用します。")
+    STORE_RETAIN_DAYS = 31
+
+# 移行する旧形式のファイル名と取得元
+LOOSE_FILE_PATTERNS = (
+    (re.compile(r"^filtered_(\d{4}-\d{2}-\d{2})\.json$"), daily_store.LOCATION),
+    (re.compile(r"^updated_(\d{4}-\d{2}-\d{2})\.json$"), daily_store.PLACES),
+    (re.compile(r"^(\d{4}-\d{2}-\d{2})_history_output\.json$"), daily_store.HISTORY),
+)
+
+# --- 関数定義 ---
+
+def month_path(month):
+    """月 (YYYY-MM) のアーカイブファイルのパス"""
+    return ARCHIVE_DIR / f"{month}{ARCHIVE_SUFFIX}"
+
+def empty_index():
+    return {"days": {}, "garbage": 0}
+
+def _parse_index(data, pos):
+    """data[pos:] にあるフッターとその索引を読む。正しくない場合は None"""
+    magic, offset, length = ARCHIVE_FOOTER.unpack_from(data, pos)
+    if magic != ARCHIVE_MAGIC or offset + length != pos:
+        return None
+    try:
+        return json.loads(zlib.decompress(data[offset:pos]))
+    except (zlib.error, ValueError):
+        return None
+
+def read_index(f):
+    """
+    アーカイブの索引と、有効なデータの終わりの位置を返す。
+    末尾のフッターが壊れている場合 (書き込み途中で終了した場合など) は、最後の正しいフッターまで遡る。
+    """
+    size = f.seek(0, os.SEEK_END)
+    if size == 0:
+        return empty_index(), 0
+
+    if size >= ARCHIVE_FOOTER.size:
+        f.seek(size - ARCHIVE_FOOTER.size)
+        magic, offset, length = ARCHIVE_FOOTER.unpack(f.read(ARCHIVE_FOOTER.size))
+        if magic == ARCHIVE_MAGIC and offset + length + ARCHIVE_FOOTER.size == size:
+            f.seek(offset)
+            try:
+                index = json.loads(zlib.decompress(f.read(length)))
+                metrics.count("bytes_read", length)
+                return index, size
+            except (zlib.error, ValueError):
+                pass
+
+    f.seek(0)
+    data = f.read()
+    metrics.count("bytes_read", len(data))
+    pos = data.rfind(ARCHIVE_MAGIC)
+    while pos >= 0:
+        if pos + ARCHIVE_FOOTER.size <= len(data):
+            index = _parse_index(data, pos)
+            if index is not None:
+                print(f"警告: アーカイブの末尾が壊れているため、{pos + ARCHIVE_FOOTER.size} バイト目までを使います: {f.name}")
+                return index, pos + ARCHIVE_FOOTER.size
+        pos = data.rfind(ARCHIVE_MAGIC, 0, pos)
+    raise ValueError(f"アーカイブの索引が見つかりません: {f.name}")
+
+def _write_index(f, index):
+    """現在の位置に索引とフッターを書き込み、ディスクに反映する"""
+    data = zlib.compress(json.dumps(index, separators=(",", ":")).encode("utf-8"), 9)
+    offset = f.tell()
+    f.write(data)
+    f.write(ARCHIVE_FOOTER.pack(ARCHIVE_MAGIC, offset, len(data)))
+    f.truncate()
+    f.flush()
+    os.fsync(f.fileno())
+    return len(data) + ARCHIVE_FOOTER.size
+
+def _fsync_dir(directory):
+    """フォルダのエントリ (新しいファイル・置き換え) をディスクに反映する。フォルダを開けない環境 (Windows) では何もしない"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def append_days(month, payloads, replace=True):
+    """
+    月のアーカイブに日ごとのデータ ({日付: {取得元: データ}}) を追記する。
+    既にある (日付, 取得元) は replace が True なら置き換え、False なら既存のものを残す。
+    戻り値は追記したデータの数
+    """
+    path = month_path(month)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    written = 0
+    added = 0
+    created = not path.exists()
+
+    with open(path, "w+b" if created else "r+b") as f:
+        index, end = read_index(f)
+        days = index["days"]
+        if end:
+            # 追記後は古い索引とフッターが不要領域になる
+            f.seek(end - ARCHIVE_FOOTER.size)
+            _, _, length = ARCHIVE_FOOTER.unpack(f.read(ARCHIVE_FOOTER.size))
+            index["garbage"] += length + ARCHIVE_FOOTER.size
+        f.seek(end)
+
+        for day, sources in sorted(payloads.items()):
+            entries = days.setdefault(day, {})
+            for source, data in sources.items():
+                if source in entries and not replace:
+                    continue
+                blob = zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 9)
+                if source in entries:
+                    index["garbage"] += entries[source][1]
+                entries[source] = [f.tell(), len(blob), len(data) if isinstance(data, list) else 1]
+                f.write(blob)
+                written += len(blob)
+                added += 1
+            if not entries:
+                del days[day]
+
+        written += _write_index(f, index)
+        size = f.tell()
+    if created:
+        _fsync_dir(path.parent)
+
+    metrics.count("bytes_written", written)
+    if index["garbage"] > size * COMPACT_RATIO:
+        compact(month)
+    return added
+
+def compact(month):
+    """
+    月のアーカイブから不要領域を除いて詰め直す (圧縮済みのデータはそのまま写す)。
+    一時ファイルをディスクに反映してから置き換え、置き換えもフォルダごと反映する (途中で止まっても元のファイルが残る)
+    """
+    path = month_path(month)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(path, "rb") as src:
+        index, _ = read_index(src)
+        new_index = empty_index()
+        with open(tmp_path, "w+b") as dst:
+            for day, entries in sorted(index["days"].items()):
+                for source, (offset, length, count) in entries.items():
+                    src.seek(offset)
+                    new_index["days"].setdefault(day, {})[source] = [dst.tell(), length, count]
+                    dst.write(src.read(length))
+            _write_index(dst, new_index)
+            dst.flush()
+            os.fsync(dst.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path.parent)
+
+def list_days(month):
+    """月のアーカイブにある日と取得元ごとの件数 ({日付: {取得元: 件数}})。ファイルがない場合は空"""
+    path = month_path(month)
+    if not path.exists():
+        return {}
+    with open(path, "rb") as f:
+        index, _ = read_index(f)
+    return {day: {source: entry[2] for source, entry in entries.items()}
+            for day, entries in sorted(index["days"].items())}
+
+def read_day(day, sources=None):
+    """
+    指定日のデータを {取得元: データ} で返す (sources で取得元を絞り込める)。
+    索引から該当する部分だけを読み込んで展開する。アーカイブにない場合は空の dict
+    """
+    path = month_path(day[:7])
+    if not path.exists():
+        return {}
+    result = {}
+    with open(path, "rb") as f:
+        index, _ = read_index(f)
+        for source, (offset, length, _) in index["days"].get(day, {}).items():
+            if sources and source not in sources:
+                continue
+            f.seek(offset)
+            result[source] = json.loads(zlib.decompress(f.read(length)))
+            metrics.count("bytes_read", length)
+    return result
+
+def archive_days(days, quiet=False):
+    """
+    データストアに保存されている指定日のデータを、月ごとのアーカイブに保存する。
+    失敗しても処理は続行するため、エラーを表示して False を返す
+    """
+    payloads = {}
+    conn = daily_store.open_store()
+    try:
+        for source in daily_store.SOURCES:
+            for day, items in daily_store.get_days(source, days, conn).items():
+                payloads.setdefault(day, {})[source] = items
+    finally:
+        conn.close()
+
+    by_month = {}
+    for day, sources in payloads.items():
+        by_month.setdefault(day[:7], {})[day] = sources
+
+    ok = True
+    for month, month_payloads in sorted(by_month.items()):
+        try:
+            append_days(month, month_payloads)
+            if not quiet:
+                print(f"アーカイブ完了: {month_path(month).name} ({len(month_payloads)} 日)")
+        except (OSError, ValueError) as e:
+            print(f"アーカイブ失敗 {month_path(month).name}: {e}")
+            ok = False
+    return ok
+
+def _archived_days(month_payloads):
+    """アーカイブを読み戻し、データストアの内容 ({日付: {取得元: データ}}) と一致する日を返す"""
+    matched = []
+    for day, sources in month_payloads.items():
+        try:
+            archived = read_day(day, list(sources))
+        except (OSError, ValueError, zlib.error) as e:
+            print(f"アーカイブを読み込めません {day}: {e}")
+            continue
+        if archived == sources:
+            matched.append(day)
+    return matched
+
+def prune_store(retain_days=STORE_RETAIN_DAYS, today=None):
+    """
+    データストアから保持期間 (retain_days 日) より前の日を削除する。
+    月ごとに、アーカイブを読み戻してデータストアと一致する日だけを削除する
+    (アーカイブにない・内容が古い日は先にアーカイブに保存し直す)。retain_days が 0 の場合は何もしない。
+    戻り値は削除した日数
+    """
+    if retain_days <= 0:
+        return 0
+    cutoff = ((today or datetime.date.today()) - datetime.timedelta(days=retain_days)).isoformat()
+
+    conn = daily_store.open_store()
+    try:
+        old = sorted({day for source in daily_store.SOURCES
+                      for day in daily_store.stored_days(source, conn) if day < cutoff})
+        by_month = {}
+        for day in old:
+            by_month.setdefault(day[:7], []).append(day)
+
+        pruned = []
+        for month, days in sorted(by_month.items()):
+            payloads = {}
+            for source in daily_store.SOURCES:
+                for day, items in daily_store.get_days(source, days, conn).items():
+                    payloads.setdefault(day, {})[source] = items
+            matched = _archived_days(payloads)
+            stale = [day for day in days if day not in matched]
+            if stale and archive_days(stale, quiet=True):
+                matched += _archived_days({day: payloads[day] for day in stale})
+            pruned += matched
+        daily_store.delete_days(pruned, conn)
+    finally:
+        conn.close()
+
+    if pruned:
+        print(f"データストアから {len(pruned)} 日分を削除しました (アーカイブに保存済み、{cutoff} より前)。")
+    return len(pruned)
+
+def migrate_loose_files(directory=None, keep=False):
+    """
+    旧形式のアーカイブ (filtered_*.json / updated_*.json / *_history_output.json) を月ごとのアーカイブに移す。
+    既にアーカイブにある (日付, 取得元) は上書きしない。移したファイルは keep が False なら削除する
+    """
+    directory = Path(directory) if directory else ARCHIVE_DIR
+    by_month = {}
+    for path in sorted(directory.iterdir()) if directory.is_dir() else []:
+        for pattern, source in LOOSE_FILE_PATTERNS:
+            m = pattern.match(path.name)
+            if m:
+                by_month.setdefault(m.group(1)[:7], []).append((m.group(1), source, path))
+                break
+
+    if not by_month:
+        print(f"移行するファイルはありません: {directory}")
+        return 0
+
+    moved = 0
+    for month, files in sorted(by_month.items()):
+        payloads = {}
+        loaded = []
+        for day, source, path in files:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    payloads.setdefault(day, {})[source] = json.load(f)
+                loaded.append(path)
+            except (OSError, ValueError) as e:
+                print(f"スキップ (読み込めません) {path.name}: {e}")
+        if not loaded:
+            continue
+        try:
+            append_days(month, payloads, replace=False)
+        except (OSError, ValueError) as e:
+            print(f"移行失敗 {month}: {e}")
+            continue
+        if not keep:
+            for path in loaded:
+                path.unlink()
+        moved += len(loaded)
+        print(f"移行完了: {month_path(month).name} ({len(loaded)} ファイル)")
+
+    print(f"合計 {moved} ファイルを移行しました。")
+    return moved
+
+def main():
+    parser = argparse.ArgumentParser(description="月ごとのアーカイブの確認・旧形式のファイルの移行")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_list = sub.add_parser("list", help="アーカイブにある日と取得元ごとの件数を表示する")
+    p_list.add_argument("month", nargs="?", help="月 (YYYY-MM、省略時はすべて)")
+
+    p_show = sub.add_parser("show", help="指定した日のデータを JSON で表示する")
+    p_show.add_argument("day", help="日付 (YYYY-MM-DD)")
+    p_show.add_argument("source", nargs="?", choices=daily_store.SOURCES, help="取得元 (省略時はすべて)")
+
+    p_migrate = sub.add_parser("migrate", help="旧形式の JSON ファイルを月ごとのアーカイブに移す")
+    p_migrate.add_argument("--dir", help=f"旧形式のファイルがあるフォルダ (既定: {ARCHIVE_DIR})")
+    p_migrate.add_argument("--keep", action="store_true", help="移したファイルを削除しない")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate_loose_files(args.dir, args.keep)
+        return
+
+    if args.command == "list":
+        months = [args.month] if args.month else sorted(p.stem for p in ARCHIVE_DIR.glob(f"*{ARCHIVE_SUFFIX}"))
+        for month in months:
+            for day, counts in list_days(month).items():
+                print(f"{day}  " + "  ".join(f"{source}: {count} 件" for source, count in sorted(counts.items())))
+        return
+
+    data = read_day(args.day, [args.source] if args.source else None)
+    if not data:
+        print(f"エラー: {args.day} のデータがアーカイブにありません。")
+        return
+    print(json.dumps(data[args.source] if args.source else data, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
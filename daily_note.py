@@ -0,0 +1,130 @@
+"""
+デイリーノートを 1 回の読み込み・1 回の書き込みで更新するためのモジュール。
+フロントマターのプロパティと、マーカーで囲んだセクションを追加・置き換えるため、
+何度実行しても内容が重複しない。内容が変わらない場合は書き込まない。
+"""
+
+import os
+import re
+from pathlib import Path
+
+import metrics
+
+FRONTMATTER_PATTERN = re.compile(r"\A---\n(.*?)\n?---(?=\n|\Z)", re.DOTALL)
+
+# セクションの開始・終了マーカー (Obsidian のプレビューには表示されない)
+SECTION_START = "<!-- daily:{name} -->"
+SECTION_END = "<!-- /daily:{name} -->"
+
+# マーカー導入前の exportDailyNote.py が見出しの後に出力していた行 (表の行・"- (...)" の行・空行)
+LEGACY_SECTION_LINES = r"(?:(?:\|[^\n]*|- \([^\n]*|[ \t]*)(?:\n|\Z))*"
+
+
+def upsert_properties(content, props):
+    """
+    フロントマターのプロパティを追加・更新する。
+    既にあるキーは値を置き換え (重複している場合は 1 つにまとめ)、ないキーは末尾に追加する。
+    値が None のキーは削除する (ない場合は追加しない)。
+    """
+    match = FRONTMATTER_PATTERN.search(content)
+    lines = match.group(1).split("\n") if match and match.group(1) else []
+    remaining = dict(props)
+    done = set()
+
+    result = []
+    for line in lines:
+        key = line.split(":", 1)[0].strip()
+        if ":" in line and key in props:
+            # 以前の実行で追記が重複したキーは最初の 1 行だけ残す
+            if key in done:
+                continue
+            done.add(key)
+            value = remaining.pop(key)
+            if value is not None:
+                result.append(f"{key}: {value}")
+        else:
+            result.append(line)
+    result.extend(f"{key}: {value}" for key, value in remaining.items() if value is not None)
+
+    fm = "---\n" + "\n".join(result) + "\n---"
+    if match:
+        return content[:match.start()] + fm + content[match.end():]
+    return f"{fm}\n\n{content}"
+
+
+def upsert_section(content, name, body, legacy_heading=None):
+    """
+    マーカーで囲んだセクションを追加・置き換える。
+    マーカーがなく legacy_heading (例: "## 訪れた場所") の見出しがある場合は、
+    マーカー導入前に追記されたものとみなして置き換える (重複していればまとめて削除)。
+    置き換えるのは見出しと、その直後に続く以前の出力の行 (表の行・"- (...)" の行・空行) だけで、
+    それ以外の行 (後から書き足した文章など) からは残す。
+    """
+    start = SECTION_START.format(name=name)
+    end = SECTION_END.format(name=name)
+    block = f"{start}\n{body.strip()}\n{end}"
+
+    pattern = re.compile(re.escape(start) + r".*?" + re.escape(end), re.DOTALL)
+    if pattern.search(content):
+        return pattern.sub(lambda _: block, content, count=1)
+
+    if legacy_heading:
+        legacy = re.compile(
+            r"^" + re.escape(legacy_heading) + r"[ \t]*(?:\n|\Z)" + LEGACY_SECTION_LINES, re.MULTILINE
+        )
+        matches = list(legacy.finditer(content))
+        if matches:
+            parts = []
+            pos = 0
+            for i, m in enumerate(matches):
+                parts.append(content[pos:m.start()])
+                if i == 0:
+                    parts.append(block + "\n\n")
+                pos = m.end()
+            parts.append(content[pos:])
+            return "".join(parts).rstrip("\n") + "\n"
+
+    return content.rstrip("\n") + "\n\n" + block + "\n"
+
+
+class DailyNote:
+    """
+    デイリーノートの更新をまとめて行う。
+    各処理は set_properties / set_section で変更を登録し、最後に save() で 1 回だけ書き込む。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "r", encoding="utf-8") as f:
+            self.original = f.read()
+        metrics.count("bytes_read", len(self.original.encode("utf-8")))
+        self.content = self.original
+
+    def set_properties(self, props):
+        self.content = upsert_properties(self.content, props)
+
+    def set_section(self, name, body, legacy_heading=None):
+        self.content = upsert_section(self.content, name, body, legacy_heading)
+
+    @property
+    def changed(self):
+        return self.content != self.original
+
+    def save(self):
+        """
+        変更がある場合だけ、一時ファイルに書き込んでから置き換える。
+        書き込んだ場合は True を返す。
+        """
+        if not self.changed:
+            return False
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.content)
+            os.replace(tmp_path, self.path)
+            metrics.count("bytes_written", len(self.content.encode("utf-8")))
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        self.original = self.content
+        return True
@@ -0,0 +1,193 @@
+"""
+各処理の間で受け渡す日ごとのデータ (位置情報・場所情報・閲覧履歴) を保存するローカルのデータストア。
+(取得元, 日付) ごとに 1 件 1 行の JSON で SQLite に保存し、必要な日の分だけを読み込む。
+以前の filtered_*.json / updated_*.json / *_history_output.json の代わりに使う。
+"""
+
+import os
+import json
+import sqlite3
+import argparse
+import datetime
+from pathlib import Path
+from dotenv import load_dotenv
+
+import metrics
+
+SCRIPT_DIR = Path(__file__).parent
+load_dotenv(SCRIPT_DIR / ".env")
+
+_store_raw = os.getenv("DAILY_STORE_PATH")
+DAILY_STORE_PATH = os.path.expandvars(_store_raw) if _store_raw else "daily_store.sqlite3"
+
+# 取得元
+LOCATION = "location"  # Timeline から抽出したその日のセグメント (exportDailyLocation.py)
+PLACES = "places"      # 場所の名前・住所を書き込んだセグメント (getLocationData.py)
+HISTORY = "history"    # Chrome の閲覧履歴 (getChromeHistory.py)
+SOURCES = (LOCATION, PLACES, HISTORY)
+
+
+def open_store(path=None):
+    """データストアを開く (なければ作成する)。複数のステージから同時に書き込めるよう WAL モードにする"""
+    conn = sqlite3.connect(path or DAILY_STORE_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS days (
+            source TEXT NOT NULL,
+            day TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (source, day)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS records (
+            source TEXT NOT NULL,
+            day TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (source, day, seq)
+        ) WITHOUT ROWID
+    """)
+    return conn
+
+
+def put_days(source, items_by_day, conn=None):
+    """
+    日ごとのデータ ({日付文字列: 要素のリスト}) を保存する。既にある日の分は置き換える。
+    0 件の日も「0 件だった」として記録する。
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = open_store()
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    written = 0
+    try:
+        with conn:
+            for day, items in items_by_day.items():
+                rows = [(source, day, i, json.dumps(item, ensure_ascii=False, separators=(",", ":")))
+                        for i, item in enumerate(items)]
+                conn.execute("DELETE FROM records WHERE source = ? AND day = ?", (source, day))
+                conn.executemany("INSERT INTO records VALUES (?, ?, ?, ?)", rows)
+                conn.execute("INSERT OR REPLACE INTO days VALUES (?, ?, ?, ?)", (source, day, len(rows), now))
+                written += sum(len(r[3]) for r in rows)
+    finally:
+        if own_conn:
+            conn.close()
+    metrics.count("bytes_written", written)
+
+
+def put_day(source, day, items, conn=None):
+    put_days(source, {day: items}, conn)
+
+
+def get_days(source, days, conn=None):
+    """
+    指定した日のデータを読み込む。戻り値は {日付文字列: 要素のリスト}。
+    保存されていない日は含まない (0 件で保存された日は空のリスト)。
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = open_store()
+    wanted = set(days)
+    days = sorted(wanted)
+    result = {}
+    read = 0
+    try:
+        if days:
+            for (day,) in conn.execute(
+                "SELECT day FROM days WHERE source = ? AND day BETWEEN ? AND ?",
+                (source, days[0], days[-1]),
+            ):
+                if day in wanted:
+                    result[day] = []
+            for day, data in conn.execute(
+                "SELECT day, data FROM records WHERE source = ? AND day BETWEEN ? AND ? ORDER BY day, seq",
+                (source, days[0], days[-1]),
+            ):
+                if day in result:
+                    result[day].append(json.loads(data))
+                    read += len(data)
+    finally:
+        if own_conn:
+            conn.close()
+    metrics.count("bytes_read", read)
+    return result
+
+
+def get_day(source, day, conn=None):
+    """指定した日のデータ (要素のリスト) を読み込む。保存されていない場合は None"""
+    return get_days(source, [day], conn).get(day)
+
+
+def stored_days(source, conn=None):
+    """保存されている日と最終更新日時 ({日付文字列: 更新日時})"""
+    own_conn = conn is None
+    if own_conn:
+        conn = open_store()
+    try:
+        return dict(conn.execute("SELECT day, updated_at FROM days WHERE source = ?", (source,)))
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def delete_days(days, conn=None):
+    """
+    指定した日のデータをすべての取得元から削除し、空いた領域を詰める (VACUUM)。
+    アーカイブに保存したことを確認した日にだけ使う (daily_archive.prune_store)。戻り値は削除した行数
+    """
+    days = sorted(set(days))
+    if not days:
+        return 0
+    own_conn = conn is None
+    if own_conn:
+        conn = open_store()
+    deleted = 0
+    try:
+        with conn:
+            for source in SOURCES:
+                for day in days:
+                    deleted += conn.execute("DELETE FROM records WHERE source = ? AND day = ?", (source, day)).rowcount
+                    conn.execute("DELETE FROM days WHERE source = ? AND day = ?", (source, day))
+        conn.execute("VACUUM")
+    finally:
+        if own_conn:
+            conn.close()
+    return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="日ごとのデータストアの内容を表示する")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_list = sub.add_parser("list", help="保存されている日と件数を表示する")
+    p_list.add_argument("source", nargs="?", choices=SOURCES, help="取得元 (省略時はすべて)")
+
+    p_show = sub.add_parser("show", help="指定した日のデータを JSON で表示する")
+    p_show.add_argument("source", choices=SOURCES, help="取得元")
+    p_show.add_argument("day", help="日付 (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    conn = open_store()
+    try:
+        if args.command == "list":
+            query = "SELECT source, day, count, updated_at FROM days"
+            params = ()
+            if args.source:
+                query += " WHERE source = ?"
+                params = (args.source,)
+            for source, day, count, updated_at in conn.execute(query + " ORDER BY source, day", params):
+                print(f"{source:<9} {day}  {count:>6} 件  ({updated_at})")
+        else:
+            items = get_day(args.source, args.day, conn)
+            if items is None:
+                print(f"エラー: {args.source} の {args.day} のデータがありません。")
+                return
+            print(json.dumps(items, ensure_ascii=False, indent=2))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
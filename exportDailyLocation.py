@@ -1,13 +1,149 @@
 import argparse
+import codecs
+import hashlib
 import json
 import os
 import shutil
+import sqlite3
 from datetime import datetime, time, timedelta, timezone
 from dotenv import load_dotenv
 
+import daily_store
+import metrics
+
 # 日本時間 (UTC+9) を定義
 JST = timezone(timedelta(hours=9), 'JST')
 
+# ストリーミング読み込み時に一度に読むバイト数
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# 日ごとのセグメント位置を保存するインデックスファイル
+INDEX_PATH = os.path.join(os.path.dirname(__file__), "location_index.json")
+INDEX_VERSION = 1
+
+# 追記のみで既存部分が変わっていないかを確認するために比較する範囲 (バイト)
+INDEX_CHECK_SIZE = 64 * 1024
+
+# 新形式のエクスポート ({"semanticSegments": [...], ...}) でセグメントが入っているキー
+SEGMENTS_KEY = "semanticSegments"
+
+class TimelineReader:
+    """
+    Timeline JSON をチャンク単位で読み込み、配列の要素を 1 件ずつ取り出すリーダー。
+    ファイル全体をメモリに載せず、各要素の開始バイト位置も返す。
+    """
+
+    def __init__(self, f, offset=0):
+        self.f = f
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.byte_pos = offset  # buf[pos] のファイル上のバイト位置
+        self.eof = False
+
+    def _fill(self):
+        """バッファに次のチャンクを追加する。読み終えている場合は False"""
+        if self.eof:
+            return False
+        chunk = self.f.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            self.buf = self.buf[self.pos:] + self.decoder.decode(b"", final=True)
+        else:
+            self.buf = self.buf[self.pos:] + self.decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def _advance(self, end):
+        """buf[pos:end] を読み進め、バイト位置を更新する"""
+        self.byte_pos += len(self.buf[self.pos:end].encode("utf-8"))
+        self.pos = end
+
+    def peek(self):
+        """空白を読み飛ばし、次の文字を返す。終端では None"""
+        while True:
+            buf = self.buf
+            end = len(buf)
+            i = self.pos
+            while i < end and buf[i] in " \t\r\n\ufeff":
+                i += 1
+            if i < end:
+                self._advance(i)
+                return buf[i]
+            self._advance(end)
+            if not self._fill():
+                return None
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise ValueError(f"JSON の形式が不正です ({self.byte_pos} バイト目で '{ch}' が必要です)")
+        self._advance(self.pos + 1)
+
+    def decode_value(self):
+        """次の値を 1 つデコードし、(開始バイト位置, 値) を返す"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buf, self.pos)
+                # バッファ末尾で終わる数値などは続きがある可能性があるため読み足す
+                if end < len(self.buf) or self.eof:
+                    start = self.byte_pos
+                    self._advance(end)
+                    return start, value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def iter_array(self):
+        """配列の要素を (開始バイト位置, 値) として 1 件ずつ返す"""
+        self.expect("[")
+        if self.peek() == "]":
+            self._advance(self.pos + 1)
+            return
+        yield self.decode_value()
+        yield from self.iter_array_rest()
+
+    def iter_array_rest(self):
+        """配列の要素の直後から、残りの要素を返す (インデックスの追記時に使用)"""
+        while True:
+            ch = self.peek()
+            self._advance(self.pos + 1)
+            if ch == "]":
+                return
+            if ch != ",":
+                raise ValueError(f"JSON の形式が不正です ({self.byte_pos} バイト目)")
+            yield self.decode_value()
+
+    def iter_segments(self, key=SEGMENTS_KEY):
+        """
+        ファイル先頭からセグメントを 1 件ずつ返す。
+        トップレベルが配列の形式と、key (既定は semanticSegments) の配列を持つオブジェクトの形式に対応する。
+        """
+        ch = self.peek()
+        if ch == "[":
+            yield from self.iter_array()
+            return
+        if ch != "{":
+            raise ValueError("JSON の形式が不正です (配列またはオブジェクトではありません)")
+
+        self.expect("{")
+        while self.peek() not in ("}", None):
+            _, name = self.decode_value()
+            self.expect(":")
+            if name == key:
+                yield from self.iter_array()
+                return
+            # 対象外のキーは要素ごとに読み捨てて、大きな配列でもメモリに載せない
+            if self.peek() == "[":
+                for _ in self.iter_array():
+                    pass
+            else:
+                self.decode_value()
+            if self.peek() == ",":
+                self._advance(self.pos + 1)
+
 def parse_dt(s: str) -> datetime:
     """ISO8601文字列を datetime(JST) に変換"""
     s = s.replace("Z", "+00:00")
@@ -18,103 +154,250 @@ def overlaps(start: datetime, end: datetime, win_start: datetime, win_end: datet
     """期間が重複しているか判定"""
     return start < win_end and end > win_start
 
-def main():
-    local_copy_path = None
+def open_source(input_path, local_copy_path):
+    """
+    元ファイルを読み取り専用で開く。
+    ロックされていて開けない場合のみローカルにコピーしてから開く。
+    """
     try:
-        # .env ファイルをロード
-        load_dotenv(dotenv_path=".env")
+        return open(input_path, "rb"), False
+    except PermissionError as e:
+        print(f"元ファイルを直接開けないため、ローカルにコピーします: {e}")
 
-        # 環境変数からファイルパスを取得
-        input_path = os.getenv("LOCATION_HISTORY_PATH")
+    shutil.copy(input_path, local_copy_path)
+    print(f"コピー完了: {local_copy_path}")
+    return open(local_copy_path, "rb"), True
 
-        # OS環境変数が設定されている場合は展開した値に上書きする。
-        if input_path:
-            input_path = os.path.expandvars(input_path)
+def segment_days(st: datetime, en: datetime):
+    """セグメントが含まれる日 (JST) を YYYY-MM-DD で返す"""
+    day = st.date()
+    last = max(en.date(), day)
+    while day <= last:
+        yield day.isoformat()
+        day += timedelta(days=1)
 
-        if not input_path:
-            print("エラー: 環境変数 'LOCATION_HISTORY_PATH' が設定されていません。")
-            print(".env ファイルを確認してください。")
-            return
+def _index_check_hash(f, end):
+    """ファイル先頭と end 直前の範囲のハッシュ (既存部分が書き換えられていないかの確認用)"""
+    h = hashlib.sha256()
+    f.seek(0)
+    h.update(f.read(min(INDEX_CHECK_SIZE, end)))
+    start = max(0, end - INDEX_CHECK_SIZE)
+    f.seek(start)
+    h.update(f.read(end - start))
+    return h.hexdigest()
 
-        # コマンドライン引数の設定 (日付は任意)
-        ap = argparse.ArgumentParser(description="Google Maps Timeline JSONから特定日(JST)を抽出 (.env対応版)")
-        ap.add_argument("day", nargs="?", help="抽出したい日 (YYYY-MM-DD)。指定しない場合は昨日が対象になります。")
-        ap.add_argument("-o", "--output", default=None, help="出力ファイル名 (省略可)")
+def load_index(index_path):
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if index.get("version") != INDEX_VERSION:
+        return None
+    return index
 
-        args = ap.parse_args()
+def save_index(index_path, index):
+    """インデックスを一時ファイル経由で保存する"""
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, index_path)
 
-        # 日付指定がない場合は昨日(JST)を対象にする
-        if args.day is None:
-            yesterday = datetime.now(JST) - timedelta(days=1)
-            args.day = yesterday.strftime("%Y-%m-%d")
-            print(f"日付が指定されなかったため、昨日 ({args.day}) を対象とします。")
+def update_index(f, source_path, source_stat, index_path, rebuild=False):
+    """
+    日付 (JST) ごとのセグメントのバイト範囲を記録したインデックスを返す。
+    元ファイルのサイズ・更新日時が変わっていなければそのまま使い、
+    末尾にセグメントが追記されただけなら前回の続きからのみ読み込む。
+    別のファイル (source_path が異なる) のインデックスは使わない。
+    """
+    source = os.path.abspath(source_path)
+    index = None if rebuild else load_index(index_path)
+    if index and index.get("source") != source:
+        print("インデックスが別のファイルのものです。作り直します。")
+        index = None
 
-        # 日付範囲の定義 (JST)
-        try:
-            target_date = datetime.strptime(args.day, "%Y-%m-%d").date()
-        except ValueError:
-            print("エラー: 日付の形式が正しくありません。YYYY-MM-DD で指定してください。")
-            return
+    if index and index["size"] == source_stat.st_size and index["mtime_ns"] == source_stat.st_mtime_ns:
+        print("インデックスを使用します (元ファイルに変更なし)。")
+        return index
 
-        day_start = datetime.combine(target_date, time.min).replace(tzinfo=JST)
-        day_end = day_start + timedelta(days=1)
+    resume = None
+    if index and index["resume_offset"] is not None and source_stat.st_size >= index["size"]:
+        if _index_check_hash(f, index["resume_offset"]) == index["check"]:
+            resume = index["resume_offset"]
 
-        print(f"元ファイル: {input_path}")
-        print(f"抽出対象日: {args.day} (JST)")
+    if resume is None:
+        print("インデックスを作成中 (全件読み込み)...")
+        index = {"version": INDEX_VERSION, "source": source, "segment_count": 0, "resume_offset": None, "days": {}}
+        f.seek(0)
+        reader = TimelineReader(f)
+        segments = reader.iter_segments()
+    else:
+        print(f"インデックスを更新中 ({resume:,} バイト目から読み込み)...")
+        f.seek(resume)
+        reader = TimelineReader(f, resume)
+        segments = reader.iter_array_rest()
 
-        # ファイルをローカルにコピー
-        local_copy_path = os.path.join(os.path.dirname(__file__), "local_location_history.json")
-        try:
-            shutil.copy(input_path, local_copy_path)
-            print(f"コピー完了: {local_copy_path}")
-        except IOError as e:
-            print(f"エラー: ファイルのコピーに失敗しました。\n{e}")
-            return
+    days = index["days"]
+    added = 0
+    metrics.count("bytes_read", source_stat.st_size - (resume or 0))
+    for offset, it in segments:
+        # ジェネレーターは要素をデコードした直後で止まるため、byte_pos が要素の終端になる
+        length = reader.byte_pos - offset
+        index["resume_offset"] = reader.byte_pos
+        index["segment_count"] += 1
+        added += 1
+        if not isinstance(it, dict) or "startTime" not in it or "endTime" not in it:
+            continue
+        for day in segment_days(parse_dt(it["startTime"]), parse_dt(it["endTime"])):
+            days.setdefault(day, []).append([offset, length])
 
-        # JSON読み込み
-        try:
-            with open(local_copy_path, "r", encoding="utf-8") as f:
-                items = json.load(f)
-        except FileNotFoundError:
-            print("エラー: コピーしたJSONファイルが見つかりません。")
-            return
-        except json.JSONDecodeError:
-            print("エラー: JSONファイルの形式が不正です。")
-            return
-
-        # 抽出処理
-        picked = []
-        for it in items:
-            if "startTime" not in it or "endTime" not in it:
-                continue
+    index["size"] = source_stat.st_size
+    index["mtime_ns"] = source_stat.st_mtime_ns
+    if index["resume_offset"] is not None:
+        index["check"] = _index_check_hash(f, index["resume_offset"])
 
-            st = parse_dt(it["startTime"])
-            en = parse_dt(it["endTime"])
+    try:
+        save_index(index_path, index)
+        print(f"インデックスを保存しました: {index_path} (追加 {added} 件)")
+    except OSError as e:
+        print(f"警告: インデックスの保存に失敗しました: {e}")
+    return index
 
-            if overlaps(st, en, day_start, day_end):
-                picked.append(it)
+def read_indexed_segments(f, index, day):
+    """
+    インデックスに記録された範囲だけを読み込み、指定日のセグメント候補を返す。
+    範囲がセグメントにならない場合 (インデックスが古い場合) は ValueError を送出する。
+    """
+    segments = []
+    for offset, length in index["days"].get(day, []):
+        f.seek(offset)
+        it = json.loads(f.read(length))
+        metrics.count("bytes_read", length)
+        if not isinstance(it, dict) or "startTime" not in it or "endTime" not in it:
+            raise ValueError(f"{offset} バイト目からの範囲がセグメントではありません")
+        segments.append(it)
+    return segments
 
-        # 保存処理
-        out_path = args.output or f"filtered_{args.day}.json"
+def read_days(f, source_path, source_stat, days, rebuild=False):
+    """
+    インデックスから各日 (YYYY-MM-DD, JST) のセグメント候補を読み込み、(インデックス, {日付: セグメント候補}) を返す。
+    インデックスが元ファイルと一致しない場合は、警告を表示してから 1 回だけ作り直して読み直す。
+    """
+    for attempt in ((True,) if rebuild else (False, True)):
         try:
-            with open(out_path, "w", encoding="utf-8") as f:
-                json.dump(picked, f, ensure_ascii=False, indent=2)
+            index = update_index(f, source_path, source_stat, INDEX_PATH, attempt)
+            return index, {day: read_indexed_segments(f, index, day) for day in days}
+        except ValueError as e:
+            if attempt:
+                raise
+            print(f"警告: インデックスが元ファイルと一致しないため作り直します: {e}")
 
-            print("-" * 30)
-            print(f"元データ件数: {len(items)}")
-            print(f"抽出件数: {len(picked)}")
-            print(f"保存完了: {out_path}")
-        except IOError as e:
-            print(f"エラー: ファイルの書き込みに失敗しました。\n{e}")
+def extract_days(input_path, days, rebuild_index=False):
+    """
+    Timeline JSON から複数の日 (YYYY-MM-DD, JST) に重なるセグメントを日ごとに抽出する。
+    ファイルは 1 回だけ開き、インデックスから各日の範囲だけを読み込む。
+    戻り値は ({日付: 抽出したセグメントのリスト}, 元データの件数)。
+    読み込みに失敗した場合は IOError / ValueError を送出する。
+    """
+    # ファイルを開く (ロックされている場合のみローカルにコピー)
+    local_copy_path = os.path.join(os.path.dirname(__file__), "local_location_history.json")
+    try:
+        source_stat = os.stat(input_path)
+        source, _ = open_source(input_path, local_copy_path)
 
+        # 抽出処理 (インデックスから対象日の範囲だけを読み込む)
+        picked = {}
+        with source:
+            index, candidates = read_days(source, input_path, source_stat, days, rebuild_index)
+            for day in days:
+                day_start = datetime.combine(datetime.strptime(day, "%Y-%m-%d").date(), time.min).replace(tzinfo=JST)
+                day_end = day_start + timedelta(days=1)
+                picked[day] = [
+                    it for it in candidates[day]
+                    if overlaps(parse_dt(it["startTime"]), parse_dt(it["endTime"]), day_start, day_end)
+                ]
+        return picked, index["segment_count"]
     finally:
         # コピーしたファイルを削除
-        if local_copy_path and os.path.exists(local_copy_path):
+        if os.path.exists(local_copy_path):
             try:
                 os.remove(local_copy_path)
                 print(f"コピーしたファイルを削除しました: {local_copy_path}")
             except OSError:
                 pass  # 削除に失敗しても無視
 
+def extract_day(input_path, day, rebuild_index=False):
+    """
+    Timeline JSON から指定日 (YYYY-MM-DD, JST) に重なるセグメントを抽出する。
+    戻り値は (抽出したセグメントのリスト, 元データの件数)。
+    """
+    picked, total = extract_days(input_path, [day], rebuild_index)
+    return picked[day], total
+
+def main():
+    # .env ファイルをロード
+    load_dotenv(dotenv_path=".env")
+
+    # 環境変数からファイルパスを取得
+    input_path = os.getenv("LOCATION_HISTORY_PATH")
+
+    # OS環境変数が設定されている場合は展開した値に上書きする。
+    if input_path:
+        input_path = os.path.expandvars(input_path)
+
+    if not input_path:
+        print("エラー: 環境変数 'LOCATION_HISTORY_PATH' が設定されていません。")
+        print(".env ファイルを確認してください。")
+        return
+
+    # コマンドライン引数の設定 (日付は任意)
+    ap = argparse.ArgumentParser(description="Google Maps Timeline JSONから特定日(JST)を抽出 (.env対応版)")
+    ap.add_argument("day", nargs="?", help="抽出したい日 (YYYY-MM-DD)。指定しない場合は昨日が対象になります。")
+    ap.add_argument("-o", "--output", default=None, help="JSON ファイルにも出力する場合のファイル名 (省略可)")
+    ap.add_argument("--rebuild-index", action="store_true", help="日付インデックスを作り直す")
+
+    args = ap.parse_args()
+
+    # 日付指定がない場合は昨日(JST)を対象にする
+    if args.day is None:
+        yesterday = datetime.now(JST) - timedelta(days=1)
+        args.day = yesterday.strftime("%Y-%m-%d")
+        print(f"日付が指定されなかったため、昨日 ({args.day}) を対象とします。")
+
+    # 日付範囲の定義 (JST)
+    try:
+        datetime.strptime(args.day, "%Y-%m-%d")
+    except ValueError:
+        print("エラー: 日付の形式が正しくありません。YYYY-MM-DD で指定してください。")
+        return
+
+    print(f"元ファイル: {input_path}")
+    print(f"抽出対象日: {args.day} (JST)")
+
+    try:
+        picked, total = extract_day(input_path, args.day, args.rebuild_index)
+    except ValueError:  # JSONDecodeError, UnicodeDecodeError を含む
+        print("エラー: JSONファイルの形式が不正です。")
+        return
+    except IOError as e:
+        print(f"エラー: ファイルの読み込みに失敗しました。\n{e}")
+        return
+
+    # 保存処理 (データストアに保存し、指定された場合のみ JSON ファイルにも書き出す)
+    try:
+        daily_store.put_day(daily_store.LOCATION, args.day, picked)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(picked, f, ensure_ascii=False, indent=2)
+
+        print("-" * 30)
+        print(f"元データ件数: {total}")
+        print(f"抽出件数: {len(picked)}")
+        print(f"保存完了: {daily_store.DAILY_STORE_PATH} ({daily_store.LOCATION})")
+        if args.output:
+            print(f"保存完了: {args.output}")
+    except (IOError, sqlite3.Error) as e:
+        print(f"エラー: 抽出結果の保存に失敗しました。\n{e}")
+
 if __name__ == "__main__":
     main()
@@ -1,17 +1,23 @@
 """
-指定日のデイリーノートに訪問場所、閲覧履歴を追記
-使用後のJSONファイルをアーカイブフォルダに移動
+指定日のデイリーノートに天気、訪問場所、閲覧履歴を書き込む
+データは各処理が保存したデータストア (daily_store.py) から読み込み、更新後に月ごとのアーカイブ (daily_archive.py) に保存する
+(保持期間を過ぎた日はアーカイブに保存したことを確認してデータストアから削除する)
 """
 
 
 import os
-import json
-import shutil
 import datetime
-import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
 
+import daily_store
+import daily_archive
+import metrics
+from daily_note import DailyNote
+from update_weather import resolve_day_weather, weather_properties
+from history_summary import summarize_history, summary_to_markdown, save_detail
+
 # --- 設定読み込み ---
 
 SCRIPT_DIR = Path(__file__).parent
@@ -34,7 +40,12 @@ VAULT_PATH: Path = _vault_path_raw
 daily_folder_raw = os.getenv("DAILY_NOTE_FOLDER", "")
 DAILY_NOTE_FOLDER_STR = os.path.expandvars(daily_folder_raw)
 
-ARCHIVE_DIR = SCRIPT_DIR / "archive"
+# 期間をまとめて処理する場合に、同時に更新するノートの数
+try:
+    NOTE_MAX_WORKERS = max(1, int(os.getenv("NOTE_MAX_WORKERS", "8")))
+except ValueError:
+    NOTE_MAX_WORKERS = 8
+    print("警告: NOTE_MAX_WORKERS の設定が不正です。デフォルト値(8)を使用します。")
 
 
 # --- 関数定義 ---
@@ -46,143 +57,160 @@ def format_time(iso_str):
     except:
         return "??"
 
-# --- メイン処理 ---
-
-def main():
-    today = datetime.date.today()
-    target_date = today - datetime.timedelta(days=1)
-    target_date_str = target_date.strftime("%Y-%m-%d")
-    print(f"処理対象日: {target_date_str}")
-
-    updated_json_name = f"updated_{target_date_str}.json"
-    filtered_json_name = f"filtered_{target_date_str}.json"
-    history_json_name = f"{target_date_str}_history_output.json"
-
-    updated_json_path = SCRIPT_DIR / updated_json_name
-    history_json_path = SCRIPT_DIR / history_json_name
-    filtered_json_path = SCRIPT_DIR / filtered_json_name
-
+def build_location_section(loc_data, weather=None):
+    """
+    訪れた場所のセクション (テーブル形式・不明な場所を除外)。データがない場合は None
+    weather には visit_weather で求めた訪問ごとの気温・天気を渡す。
+    """
+    if not loc_data or not isinstance(loc_data, list):
+        return None
+    weather = weather or {}
+
+    # ヘッダー作成
+    table_lines = ["## 訪れた場所\n"]
+    table_lines.append("| 時間 | 場所 | 住所 | 天気 |")
+    table_lines.append("| :--- | :--- | :--- | :--- |")
+
+    has_valid_entry = False
+    for i, entry in enumerate(loc_data):
+        visit = entry.get("visit", {})
+        candidate = visit.get("topCandidate", {})
+        name = candidate.get("name", "不明な場所")
+
+        if name == "不明な場所":
+            continue
+
+        has_valid_entry = True
+        address = candidate.get("formatted_address", "")
+        start_time = format_time(entry.get("startTime", ""))
+        end_time = format_time(entry.get("endTime", ""))
+
+        # パイプをエスケープ
+        safe_name = name.replace("|", "\\|")
+        safe_address = address.replace("|", "\\|")
+
+        w = weather.get(i)
+        weather_text = f"{w['weather']} {w['temperature']}℃" if w else ""
+
+        table_lines.append(f"| {start_time} - {end_time} | **{safe_name}** | {safe_address} | {weather_text} |")
+
+    if has_valid_entry:
+        return "\n".join(table_lines)
+    return "## 訪れた場所\n- (有効な移動履歴はありません)"
+
+def build_history_section(hist_data, target_date_str, quiet=False):
+    """
+    閲覧履歴のセクション (上位 N 件の表とドメインごとの件数)。
+    すべての訪問は history_summary.save_detail で別ファイルに保存する。
+    """
+    items = [item for item in hist_data if item.get("visit_time", "").startswith(target_date_str)]
+    if not items:
+        return "## 閲覧履歴\n- (昨日の履歴はありません)"
+
+    summary = summarize_history(items)
+    detail = save_detail(summary, target_date_str)
+    if not quiet:
+        print(f"閲覧履歴の詳細を保存しました: {detail}")
+    return summary_to_markdown(summary)
+
+def update_daily_note(target_date_str, loc_data=None, hist_data=None, weather=None, properties=None, quiet=False):
+    """
+    デイリーノートに天気・訪れた場所・閲覧履歴を書き込む。
+    変更をまとめて登録し、最後に 1 回だけ書き込む。データが None の項目は変更しない。
+    weather には resolve_day_weather の結果を渡す (None の場合はここで取得する)。
+    properties には他のステージが計算したプロパティ (移動統計など) を渡す。
+    quiet=True の場合はエラー以外を表示しない。成功した場合は True
+    """
     daily_note_path = VAULT_PATH / DAILY_NOTE_FOLDER_STR / f"{target_date_str}.md"
 
-    # --- ノート更新処理 ---
-
     if not daily_note_path.exists():
         print(f"エラー: デイリーノートが見つかりません -> {daily_note_path}")
-        return
+        return False
 
     try:
-        with open(daily_note_path, "r", encoding="utf-8") as f:
-            content = f.read()
+        note = DailyNote(daily_note_path)
     except Exception as e:
         print(f"エラー: デイリーノートの読み込みに失敗しました: {e}")
-        return
-
-    # --- 場所データの追記（テーブル形式・不明な場所を除外） ---
-    location_text = ""
-    if updated_json_path.exists():
-        try:
-            with open(updated_json_path, 'r', encoding='utf-8') as f:
-                loc_data = json.load(f)
-
-            if loc_data and isinstance(loc_data, list):
-                # ヘッダー作成
-                table_lines = ["\n## 訪れた場所\n"]
-                table_lines.append("| 時間 | 場所 | 住所 |")
-                table_lines.append("| :--- | :--- | :--- |")
-
-                has_valid_entry = False
-                for entry in loc_data:
-                    visit = entry.get("visit", {})
-                    candidate = visit.get("topCandidate", {})
-                    name = candidate.get("name", "不明な場所")
+        return False
 
-                    if name == "不明な場所":
-                        continue
+    # --- 天気情報 (プロパティ) ---
+    if weather is None:
+        weather = resolve_day_weather(target_date_str, loc_data)
+    if weather["daily"]:
+        note.set_properties(weather_properties(weather["daily"]))
+    if properties:
+        note.set_properties(properties)
 
-                    has_valid_entry = True
-                    address = candidate.get("formatted_address", "")
-                    start_time = format_time(entry.get("startTime", ""))
-                    end_time = format_time(entry.get("endTime", ""))
-
-                    # パイプをエスケープ
-                    safe_name = name.replace("|", "\\|")
-                    safe_address = address.replace("|", "\\|")
-
-                    table_lines.append(f"| {start_time} - {end_time} | **{safe_name}** | {safe_address} |")
-
-                if has_valid_entry:
-                    location_text = "\n".join(table_lines) + "\n"
-                else:
-                    location_text = "\n## 訪れた場所\n- (有効な移動履歴はありません)\n"
-
-        except Exception as e:
-            print(f"位置情報JSONの読み込みエラー: {e}")
+    # --- 場所データ ---
+    try:
+        location_text = build_location_section(loc_data, weather["visits"])
+        if location_text:
+            note.set_section("訪れた場所", location_text, legacy_heading="## 訪れた場所")
+    except Exception as e:
+        print(f"場所データの書き込みエラー: {e}")
 
-    # --- 閲覧履歴の追記（3列テーブル形式） ---
-    history_text = ""
-    if history_json_path.exists():
+    # --- 閲覧履歴 ---
+    if hist_data is not None:
         try:
-            with open(history_json_path, 'r', encoding='utf-8') as f:
-                hist_data = json.load(f)
-
-            # ヘッダー作成: | 時間 | タイトル | URL |
-            table_lines = ["\n## 閲覧履歴\n"]
-            table_lines.append("| 時間 | タイトル | URL |")
-            table_lines.append("| :--- | :--- | :--- |")
-
-            count = 0
-            for item in hist_data:
-                visit_time_str = item.get("visit_time", "")
-                if visit_time_str.startswith(target_date_str):
-                    time_part = visit_time_str.split(" ")[1][:5] if " " in visit_time_str else "??"
-                    title = item.get("title", "No Title")
-                    url = item.get("url", "#")
-
-                    # Markdownテーブル用にパイプをエスケープ
-                    safe_title = title.replace("|", "\\|")
-                    # URL自体にパイプが含まれることは稀ですが、一応エスケープ
-                    safe_url = url.replace("|", "\\|")
-
-                    table_lines.append(f"| {time_part} | {safe_title} | {safe_url} |")
-                    count += 1
-
-            if count > 0:
-                history_text = "\n".join(table_lines) + "\n"
-            else:
-                history_text = "\n## 閲覧履歴\n- (昨日の履歴はありません)\n"
-
+            history_text = build_history_section(hist_data, target_date_str, quiet)
+            note.set_section("閲覧履歴", history_text, legacy_heading="## 閲覧履歴")
         except Exception as e:
-            print(f"履歴JSONの読み込みエラー: {e}")
+            print(f"閲覧履歴の書き込みエラー: {e}")
 
-    # 保存
+    # 保存 (内容が変わらない場合は書き込まない)
     try:
-        new_content = content + location_text + history_text
-        with open(daily_note_path, "w", encoding="utf-8") as f:
-            f.write(new_content)
-        print("デイリーノートを更新しました。")
+        saved = note.save()
+        if not quiet:
+            print("デイリーノートを更新しました。" if saved else "デイリーノートに変更はありません。")
     except Exception as e:
         print(f"エラー: デイリーノートの書き込みに失敗しました: {e}")
+        return False
+    return True
+
+def update_daily_notes(loc_by_day, hist_by_day, weather_by_day, props_by_day=None, max_workers=NOTE_MAX_WORKERS):
+    """
+    複数日のデイリーノートを並列に更新する。
+    各引数は {日付文字列: その日のデータ} (props_by_day はその日のプロパティ)。ノートのない日はスキップする。
+    並列に実行するため、各日の表示はエラーのみとし、最後に件数をまとめて表示する。
+    戻り値は (更新に成功した日数, 失敗した日数, ノートのない日数)
+    """
+    props_by_day = props_by_day or {}
+    days = sorted(set(loc_by_day) | set(hist_by_day) | set(weather_by_day) | set(props_by_day))
+    targets = [d for d in days if (VAULT_PATH / DAILY_NOTE_FOLDER_STR / f"{d}.md").exists()]
+    missing = len(days) - len(targets)
+
+    def update(day):
+        return update_daily_note(day, loc_by_day.get(day), hist_by_day.get(day), weather_by_day.get(day),
+                                 props_by_day.get(day), quiet=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(metrics.bind(update), targets))
+    succeeded = sum(results)
+    print(f"デイリーノート: 更新 {succeeded} 件 / 失敗 {len(results) - succeeded} 件 / ノートなし {missing} 件")
+
+    # 同じ月のファイルに追記するため、アーカイブはノートの更新後にまとめて行う
+    daily_archive.archive_days([day for day, ok in zip(targets, results) if ok])
+    # 保持期間より前の日は、アーカイブに保存したことを確認してからデータストアから削除する
+    daily_archive.prune_store()
+    return succeeded, len(results) - succeeded, missing
+
+# --- メイン処理 ---
+
+def main():
+    today = datetime.date.today()
+    target_date = today - datetime.timedelta(days=1)
+    target_date_str = target_date.strftime("%Y-%m-%d")
+    print(f"処理対象日: {target_date_str}")
+
+    # getLocationData.py / getChromeHistory.py が保存したその日のデータ (ない場合はその項目を変更しない)
+    loc_data = daily_store.get_day(daily_store.PLACES, target_date_str)
+    hist_data = daily_store.get_day(daily_store.HISTORY, target_date_str)
+    if not update_daily_note(target_date_str, loc_data, hist_data):
         return
 
-    # --- ファイルアーカイブ ---
-    if not ARCHIVE_DIR.exists():
-        try:
-            ARCHIVE_DIR.mkdir()
-        except Exception as e:
-             print(f"アーカイブフォルダの作成に失敗したため、ファイル移動をスキップします: {e}")
-             return
-
-    files_to_archive = [updated_json_path, history_json_path, filtered_json_path]
-    print("ファイルをアーカイブ中...")
-    for file_path in files_to_archive:
-        if file_path.exists():
-            try:
-                shutil.move(str(file_path), str(ARCHIVE_DIR / file_path.name))
-                print(f"アーカイブ完了: {file_path.name}")
-            except Exception as e:
-                print(f"アーカイブ失敗 {file_path.name}: {e}")
-        else:
-            print(f"ファイルが見つからないためスキップ: {file_path.name}")
+    # --- アーカイブ ---
+    daily_archive.archive_days([target_date_str])
+    daily_archive.prune_store()
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,21 @@
 import os
+import sys
+import argparse
 import time
+import select
 import shutil
+import queue
 import sqlite3
-import json
+import threading
 import subprocess
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from dotenv import load_dotenv
 
+import daily_store
+import metrics
+
 # .env ファイルをロード
 load_dotenv()
 
@@ -27,145 +36,560 @@ CHROME_EXE_PATH = os.path.expandvars(raw_exe_path) if raw_exe_path else None
 if CHROME_HISTORY_PATH:
     print(f"History Path: {CHROME_HISTORY_PATH}")
 
-# 作業用の一時ファイル名
-TEMP_HISTORY_PATH = "History_temp_copy"
+# 追加のプロファイル。"名前=パス" または "パス" を ; 区切りで指定する
+CHROME_HISTORY_PATHS = os.path.expandvars(os.getenv("CHROME_HISTORY_PATHS", ""))
+# Chrome / Edge など Chromium 系ブラウザのユーザーデータフォルダ (; 区切り)。配下の */History を自動で探す
+CHROME_PROFILE_ROOTS = os.path.expandvars(os.getenv("CHROME_PROFILE_ROOTS", ""))
+
+try:
+    CHROME_MAX_WORKERS = max(1, int(os.getenv("CHROME_MAX_WORKERS", "4")))
+except ValueError:
+    CHROME_MAX_WORKERS = 4
+    print("警告: CHROME_MAX_WORKERS の設定が不正です。デフォルト値(4)を使用します。")
+
+# 閲覧履歴を 1 訪問 1 行で蓄積するローカルの保存先 (追記のみ)
+_warehouse_raw = os.getenv("CHROME_WAREHOUSE_PATH")
+CHROME_WAREHOUSE_PATH = os.path.expandvars(_warehouse_raw) if _warehouse_raw else "chrome_history.sqlite3"
+INGEST_BATCH_SIZE = 5000
+# ワーカーがキューの空きを待つ間、中止されていないかを確認する間隔 (秒)
+QUEUE_PUT_TIMEOUT = 0.1
+
+# 1601年1月1日と1970年1月1日の差分（秒）
+WEBKIT_EPOCH_DIFF = 11644473600
+
+# 遷移種別 (transition の下位 8 ビット)
+TRANSITION_TYPES = {
+    0: "link", 1: "typed", 2: "auto_bookmark", 3: "auto_subframe", 4: "manual_subframe",
+    5: "generated", 6: "auto_toplevel", 7: "form_submit", 8: "reload", 9: "keyword",
+    10: "keyword_generated",
+}
+# 閲覧履歴の画面と同様に、フレーム内の読み込みは日次の出力に含めない
+SUBFRAME_TRANSITIONS = (3, 4)
+
+# ロックされていて直接読めない場合に使う、ローカルの複製 (変更されたブロックのみ更新する)
+REPLICA_HISTORY_PATH = "History_replica"
+REPLICA_CHUNK_SIZE = 1024 * 1024
+
+# auto: 読み取り専用で直接読む (不可ならロックを無視して読み、最後に複製) / copy: 常に複製から読む
+CHROME_SNAPSHOT_MODE = os.getenv("CHROME_SNAPSHOT_MODE", "auto").lower()
+
+# Chrome 起動後に History の更新を待つ最大時間 (秒) と、通知が使えない場合の確認間隔 (秒)
+try:
+    CHROME_WAIT_TIMEOUT = float(os.getenv("CHROME_WAIT_TIMEOUT", "600"))
+except ValueError:
+    CHROME_WAIT_TIMEOUT = 600.0
+    print("警告: CHROME_WAIT_TIMEOUT の設定が不正です。デフォルト値(600)を使用します。")
+CHROME_POLL_INTERVAL = 0.5
+
+# inotify のイベント種別 (linux/inotify.h)
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
 
 # ==========================================
 # メインロジック
 # ==========================================
 
-def get_webkit_timestamp_24h_ago():
-    """現在時刻から24時間前を WebKit Timestamp (マイクロ秒) で計算"""
-    # 1601年1月1日と1970年1月1日の差分（秒）
-    WEBKIT_EPOCH_DIFF = 11644473600
-    
-    # 現在のUnixタイムスタンプ
-    now_unix = time.time()
-    
-    # 24時間前 (秒)
-    one_day_ago_unix = now_unix - (24 * 60 * 60)
-    
-    # WebKitタイムスタンプ（マイクロ秒）に変換
-    webkit_timestamp = int((one_day_ago_unix + WEBKIT_EPOCH_DIFF) * 1000000)
-    
-    return webkit_timestamp
+def unix_to_webkit(unix_time):
+    """UNIX 時刻 (秒) を WebKit Timestamp (マイクロ秒) に変換"""
+    return int((unix_time + WEBKIT_EPOCH_DIFF) * 1000000)
 
-def main():
-    # 環境変数の設定チェック
-    if not CHROME_HISTORY_PATH or not CHROME_EXE_PATH:
-        print("エラー: .env ファイルに CHROME_HISTORY_PATH または CHROME_EXE_PATH が設定されていません。")
-        return
+def webkit_to_datetime(webkit_time):
+    """WebKit Timestamp (マイクロ秒) をローカル時刻の datetime に変換"""
+    return datetime.datetime.fromtimestamp((webkit_time / 1000000) - WEBKIT_EPOCH_DIFF)
 
-    # 1. History ファイルの更新日時（タイムスタンプ）を取得
-    if not os.path.exists(CHROME_HISTORY_PATH):
-        print(f"エラー: Historyファイルが見つかりません: {CHROME_HISTORY_PATH}")
+def history_files(history_path):
+    """History 本体と、書き込み中に更新されるジャーナル / WAL ファイル"""
+    return [history_path, history_path + "-journal", history_path + "-wal"]
+
+def latest_mtime(paths):
+    """存在するファイルのうち最も新しい更新日時を返す"""
+    mtimes = []
+    for p in paths:
+        try:
+            mtimes.append(os.path.getmtime(p))
+        except OSError:
+            pass
+    return max(mtimes, default=0.0)
+
+def _open_inotify(directory):
+    """Linux の inotify でフォルダの変更通知を受け取る。使えない環境では None を返す"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+def wait_for_history_update(history_path, since, timeout=CHROME_WAIT_TIMEOUT, poll_interval=CHROME_POLL_INTERVAL):
+    """
+    History (またはジャーナル / WAL) の更新日時が since より新しくなるまで待つ。
+    Linux では inotify の通知で、それ以外では短い間隔の確認で更新を検知する。
+    戻り値は (更新されたか, 待機した秒数)
+    """
+    paths = history_files(history_path)
+    start = time.monotonic()
+    deadline = start + timeout
+    fd = _open_inotify(os.path.dirname(os.path.abspath(history_path)))
+    try:
+        while True:
+            if latest_mtime(paths) > since:
+                return True, time.monotonic() - start
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False, time.monotonic() - start
+
+            if fd is None:
+                time.sleep(min(remaining, poll_interval))
+                continue
+
+            # 通知を取りこぼした場合に備え、一定時間ごとに更新日時も確認する
+            ready, _, _ = select.select([fd], [], [], min(remaining, 5.0))
+            if ready:
+                try:
+                    while os.read(fd, 65536):
+                        pass
+                except BlockingIOError:
+                    pass
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+def _sqlite_uri(path, **params):
+    query = "&".join(f"{k}={v}" for k, v in params.items())
+    return f"{Path(path).resolve().as_uri()}?{query}"
+
+def update_replica(src, dst, chunk_size=REPLICA_CHUNK_SIZE):
+    """
+    src の内容を dst に反映する。変更のあったブロックだけを書き込み、dst を使い回す。
+    戻り値は書き込んだバイト数。
+    """
+    written = 0
+    mode = "r+b" if os.path.exists(dst) else "w+b"
+    with open(src, "rb") as fs, open(dst, mode) as fd:
+        offset = 0
+        while chunk := fs.read(chunk_size):
+            fd.seek(offset)
+            if fd.read(len(chunk)) != chunk:
+                fd.seek(offset)
+                fd.write(chunk)
+                written += len(chunk)
+            offset += len(chunk)
+        fd.truncate(offset)
+    shutil.copystat(src, dst)
+    return written
+
+# 書き込み途中のロールバックジャーナルの先頭に書かれるマジックナンバー
+JOURNAL_MAGIC = bytes.fromhex("d9d505f920a163d7")
+
+def journal_in_progress(history_path):
+    """
+    ロールバックジャーナルが書き込み途中かどうか。
+    排他モードではコミット後もジャーナルが残るが、先頭が消去されるため区別できる。
+    """
+    try:
+        with open(history_path + "-journal", "rb") as f:
+            return f.read(len(JOURNAL_MAGIC)) == JOURNAL_MAGIC
+    except OSError:
+        return False
+
+def open_history_snapshot(history_path, mode=CHROME_SNAPSHOT_MODE, replica_path=REPLICA_HISTORY_PATH):
+    """
+    History を丸ごとコピーせずに読むための接続を返す。戻り値は (接続, 方式)
+    1. 読み取り専用 (mode=ro) で直接開く。読み取りトランザクション内で一貫した内容が読める。
+    2. Chrome がロックしている場合は immutable=1 でロックを無視して読む。
+       書き込み途中 (ジャーナルが残っている) の場合は少し待ってから再試行する。
+    3. それでも読めない場合は、ローカルの複製を差分更新して読む。
+    """
+    if mode != "copy":
+        # 接続自体に失敗した場合は conn が None のまま次の方法に進む
+        conn = None
+        try:
+            conn = sqlite3.connect(_sqlite_uri(history_path, mode="ro"), uri=True)
+            conn.execute("BEGIN")
+            conn.execute("SELECT count(*) FROM meta").fetchone()
+            return conn, "読み取り専用"
+        except sqlite3.OperationalError as e:
+            print(f"History を直接開けません ({e})。ロックを無視して読み込みます。")
+            if conn is not None:
+                conn.close()
+
+        for _ in range(3):
+            if not journal_in_progress(history_path):
+                conn = None
+                try:
+                    conn = sqlite3.connect(_sqlite_uri(history_path, mode="ro", immutable=1), uri=True)
+                    conn.execute("SELECT count(*) FROM meta").fetchone()
+                    return conn, "ロック無視 (immutable)"
+                except sqlite3.DatabaseError as e:
+                    print(f"ロックを無視した読み込みに失敗しました: {e}")
+                    if conn is not None:
+                        conn.close()
+                    break
+            time.sleep(1)
+
+    written = update_replica(history_path, replica_path)
+    print(f"ローカルの複製を更新しました ({written:,} バイト書き込み): {replica_path}")
+    return sqlite3.connect(_sqlite_uri(replica_path, mode="ro"), uri=True), "ローカル複製"
+
+# 蓄積先の訪問テーブル。取得元の visits.id は履歴の削除で巻き戻ることがあるため、
+# 巻き戻りを検出するたびに世代 (generation) を進め、(取得元, 世代, visits.id) を主キーにする
+WAREHOUSE_VISITS_DDL = """
+    CREATE TABLE IF NOT EXISTS visits (
+        source TEXT NOT NULL,          -- 取得元のプロファイル
+        generation INTEGER NOT NULL,   -- 取得元の visits.id の世代 (巻き戻るたびに 1 増やす)
+        visit_id INTEGER NOT NULL,     -- 取得元の visits.id
+        visit_time INTEGER NOT NULL,   -- WebKit Timestamp (マイクロ秒)
+        url TEXT NOT NULL,
+        title TEXT,
+        transition INTEGER,
+        duration INTEGER,              -- 滞在時間 (マイクロ秒)
+        PRIMARY KEY (source, generation, visit_id)
+    )
+"""
+
+def _migrate_warehouse(conn):
+    """世代の列がない以前の蓄積先を、既存の訪問を世代 0 として新しい形式に移す"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(visits)")]
+    if not columns or "generation" in columns:
         return
+    print("閲覧履歴の蓄積先を新しい形式に移行しています...")
+    with conn:
+        conn.execute("DROP INDEX IF EXISTS visits_time")
+        conn.execute("ALTER TABLE visits RENAME TO visits_old")
+        conn.execute(WAREHOUSE_VISITS_DDL)
+        conn.execute("""
+            INSERT INTO visits
+            SELECT source, 0, visit_id, visit_time, url, title, transition, duration FROM visits_old
+        """)
+        conn.execute("DROP TABLE visits_old")
+        conn.execute("ALTER TABLE sources ADD COLUMN generation INTEGER NOT NULL DEFAULT 0")
+        conn.execute("ALTER TABLE sources ADD COLUMN last_visit_time INTEGER")
+
+def open_warehouse(path=CHROME_WAREHOUSE_PATH):
+    """閲覧履歴の蓄積先 (SQLite) を開く"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    _migrate_warehouse(conn)
+    conn.execute(WAREHOUSE_VISITS_DDL)
+    conn.executescript("""
+        CREATE INDEX IF NOT EXISTS visits_time ON visits (visit_time);
+        CREATE TABLE IF NOT EXISTS sources (
+            source TEXT PRIMARY KEY,
+            path TEXT,
+            last_visit_id INTEGER NOT NULL, -- 取り込み済みの最大 visits.id
+            updated_at TEXT,
+            generation INTEGER NOT NULL DEFAULT 0,  -- 現在の visits.id の世代
+            last_visit_time INTEGER                 -- 取り込み済みの最大 visits.id の訪問日時 (ID の再利用の検出用)
+        );
+    """)
+    return conn
+
+def discover_profiles():
+    """
+    取得対象のプロファイルを (名前, History のパス) のリストで返す。
+    CHROME_HISTORY_PATH は "default"、CHROME_HISTORY_PATHS は指定した名前、
+    CHROME_PROFILE_ROOTS 配下で見つかったものは "ブラウザ名/プロファイル名" とする。
+    """
+    candidates = []
+    if CHROME_HISTORY_PATH:
+        candidates.append(("default", CHROME_HISTORY_PATH))
+
+    for item in filter(None, (x.strip() for x in CHROME_HISTORY_PATHS.split(";"))):
+        name, sep, path = item.partition("=")
+        if not sep or os.sep in name or "/" in name:
+            name, path = Path(item).parent.name, item
+        candidates.append((name, path))
+
+    for root in filter(None, (x.strip() for x in CHROME_PROFILE_ROOTS.split(";"))):
+        root = Path(root)
+        # ".../Google/Chrome/User Data" の場合は "Chrome" をブラウザ名とする
+        browser = root.parent.name if root.name.lower() == "user data" else root.name
+        for history in sorted(root.glob("*/History")):
+            candidates.append((f"{browser}/{history.parent.name}", str(history)))
+
+    profiles = []
+    seen_paths = set()
+    seen_names = set()
+    for name, path in candidates:
+        real = os.path.realpath(path)
+        if real in seen_paths:
+            continue
+        if not os.path.exists(path):
+            print(f"警告: Historyファイルが見つかりません ({name}): {path}")
+            continue
+        while name in seen_names:
+            name += "_"
+        seen_paths.add(real)
+        seen_names.add(name)
+        profiles.append((name, path))
+    return profiles
+
+def _replica_path_for(source):
+    if source == "default":
+        return REPLICA_HISTORY_PATH
+    safe = "".join(c if c.isalnum() else "_" for c in source)
+    return f"{REPLICA_HISTORY_PATH}_{safe}"
+
+def _put(out, item, cancel):
+    """キューに入れる。一杯の間は待ち、cancel が設定された場合は入れずに False を返す"""
+    while not (cancel and cancel.is_set()):
+        try:
+            out.put(item, timeout=QUEUE_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def read_new_visits(source, history_path, last_id, generation=0, last_time=None, out=None, cancel=None):
+    """
+    取得元の visits から、visits.id が last_id より新しい訪問を読み込む (ワーカースレッドで実行)。
+    last_time は前回取り込んだ last_id の訪問日時。
+    訪問は INGEST_BATCH_SIZE 件ずつ読み込み、out (キュー) に ("rows", source, 世代, reset, 訪問のリスト) として渡す。
+    最後に ("done", 結果) を渡す。cancel (threading.Event) が設定された場合は読み込みをやめて何も渡さない。結果は {"source", "path", "count", "last_id", "last_time", "generation", "reset",
+    "mode", "seconds", "error"}
+    """
+    started = time.monotonic()
+    result = {"source": source, "path": history_path, "count": 0, "last_id": last_id, "last_time": last_time,
+              "generation": generation, "reset": False, "mode": None, "error": None}
+    conn = None
+    try:
+        conn, result["mode"] = open_history_snapshot(history_path, replica_path=_replica_path_for(source))
 
-    mtime = os.path.getmtime(CHROME_HISTORY_PATH)
+        # 履歴の削除などで前回取り込んだ訪問がなくなった (または ID が別の訪問に再利用された) 場合は、
+        # 世代を進めて最初から読み込む (既に取り込んだ訪問は書き込み時に日時と URL で除く)
+        if last_id:
+            row = conn.execute("SELECT visit_time FROM visits WHERE id = ?", (last_id,)).fetchone()
+            if row is None or (last_time is not None and row[0] != last_time):
+                print(f"警告: {source} の visits.id が巻き戻っています (前回の最大 {last_id} の訪問が変わりました)。"
+                      f"世代 {generation + 1} として取り込み直します。")
+                result.update(last_id=0, last_time=None, generation=generation + 1, reset=True)
+
+        # 全件をメモリに載せず、一定件数ずつ書き込み側に渡す (キューが一杯の間は読み込みを待つ)
+        cursor = conn.execute("""
+            SELECT v.id, v.visit_time, u.url, u.title, v.transition, v.visit_duration
+            FROM visits v JOIN urls u ON u.id = v.url
+            WHERE v.id > ?
+            ORDER BY v.id
+        """, (result["last_id"],))
+        while True:
+            rows = cursor.fetchmany(INGEST_BATCH_SIZE)
+            if not rows:
+                break
+            if not _put(out, ("rows", source, result["generation"], result["reset"], rows), cancel):
+                break
+            result["count"] += len(rows)
+            result["last_id"], result["last_time"] = rows[-1][0], rows[-1][1]
+    except (sqlite3.Error, OSError) as e:
+        result["error"] = str(e)
+    finally:
+        if conn:
+            conn.close()
+        result["seconds"] = time.monotonic() - started
+        _put(out, ("done", result), cancel)
+
+def store_visits(warehouse, source, rows, generation=0, reset=False):
+    """
+    読み込んだ訪問 (1 バッチ分) を蓄積先に追加する。
+    reset の場合 (ID の巻き戻り後) は、同じ日時・URL の訪問が既にあれば追加しない。
+    """
+    if reset:
+        sql = """
+            INSERT OR IGNORE INTO visits
+            SELECT ?, ?, ?, ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (SELECT 1 FROM visits WHERE source = ?1 AND visit_time = ?4 AND url = ?5)
+        """
+    else:
+        sql = "INSERT OR IGNORE INTO visits VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    with warehouse:
+        warehouse.executemany(sql, [(source, generation, *r) for r in rows])
+
+def update_source(warehouse, result):
+    """
+    取り込み済みの visits.id (とその訪問日時) と世代を記録する。すべてのバッチを書き込んだ後に呼ぶ。
+    実行しなかった日があっても、次回の実行で取りこぼしなく取り込まれる。
+    """
+    with warehouse:
+        warehouse.execute(
+            "INSERT OR REPLACE INTO sources (source, path, last_visit_id, updated_at, generation, last_visit_time)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (result["source"], result["path"], result["last_id"], datetime.datetime.now().isoformat(timespec="seconds"),
+             result["generation"], result["last_time"]),
+        )
+
+def _store_batches(warehouse, batches, remaining):
+    """ワーカーから受け取ったバッチを蓄積先に書き込む。remaining 個のプロファイルが終わるまで続ける"""
+    while remaining:
+        item = batches.get()
+        if item[0] == "rows":
+            _, source, generation, reset, rows = item
+            store_visits(warehouse, source, rows, generation, reset)
+            metrics.count("records_in", len(rows))
+            continue
+        remaining -= 1
+        r = item[1]
+        if r["error"]:
+            print(f"  {r['source']}: 読み込みに失敗しました ({r['error']})")
+            continue
+        update_source(warehouse, r)
+        print(f"  {r['source']}: {r['count']} 件取り込み ({r['mode']}, {r['seconds']:.2f} 秒)")
+
+def ingest_profiles(warehouse, profiles, max_workers=CHROME_MAX_WORKERS):
+    """
+    複数のプロファイルを並列に読み込み、新しい訪問を蓄積先に追加する。
+    読み込みはワーカーで並列に行い、バッチごとに上限付きのキューでメインスレッドに渡して書き込む。
+    途中で失敗したプロファイルは取り込み済みの位置を進めず、次回に読み直す (書き込み済みの訪問は重複しない)。
+    書き込みで例外が発生した場合は、キューで待っているワーカーを止めてから例外を送出する。
+    """
+    state = {row[0]: row[1:] for row in warehouse.execute(
+        "SELECT source, last_visit_id, generation, last_visit_time FROM sources"
+    )}
+    batches = queue.Queue(maxsize=max_workers * 2)
+    cancel = threading.Event()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for name, path in profiles:
+            pool.submit(metrics.bind(read_new_visits), name, path, *state.get(name, (0, 0, None)),
+                        out=batches, cancel=cancel)
+        try:
+            _store_batches(warehouse, batches, len(profiles))
+        except BaseException:
+            # 書き込みをやめるとキューが空かなくなるため、ワーカーを止めてからプールを閉じる
+            cancel.set()
+            raise
+
+def export_range(warehouse, first, last):
+    """蓄積先から first〜last (ローカル時刻) の訪問を取り出し、日ごとに時刻順で返す ({日付: 訪問のリスト})"""
+    range_start = datetime.datetime.combine(first, datetime.time.min)
+    range_end = datetime.datetime.combine(last + datetime.timedelta(days=1), datetime.time.min)
+    rows = warehouse.execute(f"""
+        SELECT url, title, visit_time, transition, duration, source
+        FROM visits
+        WHERE visit_time >= ? AND visit_time < ?
+          AND (transition & 255) NOT IN ({','.join('?' * len(SUBFRAME_TRANSITIONS))})
+        ORDER BY visit_time DESC
+    """, (unix_to_webkit(range_start.timestamp()), unix_to_webkit(range_end.timestamp()), *SUBFRAME_TRANSITIONS)).fetchall()
+
+    days = {}
+    for url, title, visit_time, transition, duration, source in rows:
+        visited = webkit_to_datetime(visit_time)
+        days.setdefault(visited.date(), []).append({
+            "url": url,
+            "title": title,
+            "visit_time": visited.strftime('%Y-%m-%d %H:%M:%S'),
+            "transition": TRANSITION_TYPES.get((transition or 0) & 0xFF, "other"),
+            "duration_seconds": round((duration or 0) / 1000000, 1),
+            "source": source,
+        })
+    return days
+
+def export_day(warehouse, day):
+    """蓄積先から指定日 (ローカル時刻) の訪問を時刻順に取り出す"""
+    return export_range(warehouse, day, day).get(day, [])
+
+def ensure_history_fresh(history_path, exe_path):
+    """History が 3 分以上更新されていない場合は Chrome を起動し、更新されるまで待つ"""
+    # 1. History ファイルの更新日時（タイムスタンプ）を取得
+    mtime = os.path.getmtime(history_path)
     current_time = time.time()
     time_diff_seconds = current_time - mtime
-    
+
     print(f"最終更新からの経過時間: {time_diff_seconds:.1f} 秒")
 
     # 2-1. タイムスタンプの時刻が3分(180秒)以上離れている時
     if time_diff_seconds >= 180:
         print("3分以上更新されていないため、Google Chrome を起動します...")
-        
+
+        # 起動前の更新日時 (ジャーナル / WAL を含む) を基準にする
+        baseline = latest_mtime(history_files(history_path))
+
         # Chromeを起動（非同期で実行し、Pythonスクリプトは待機しない）
         try:
-            subprocess.Popen([CHROME_EXE_PATH])
+            subprocess.Popen([exe_path])
         except Exception as e:
             print(f"Chromeの起動に失敗しました: {e}")
             return
 
-        # 2-3 のループ処理
-        while True:
-            # 2-2. 2分間待機する
-            print("2分間待機します...")
-            time.sleep(120) 
-
-            # 再度タイムスタンプを確認
-            mtime = os.path.getmtime(CHROME_HISTORY_PATH)
-            current_time = time.time()
-            new_diff = current_time - mtime
-            
-            print(f"再チェック: 経過時間 {new_diff:.1f} 秒")
-
-            # タイムスタンプが2分(120秒)以内になればループを抜けて 3 へ
-            if new_diff <= 120:
-                print("Historyファイルが更新されました。処理を続行します。")
-                break
-            else:
-                print("まだ更新されていません。再度待機ループに入ります。")
-                # ループ継続 (2-2に戻る)
+        # 2-2. History が更新されるまで待機 (最大 CHROME_WAIT_TIMEOUT 秒)
+        print(f"Historyファイルの更新を待機します (最大 {CHROME_WAIT_TIMEOUT:.0f} 秒)...")
+        updated, waited = wait_for_history_update(history_path, baseline)
+        if updated:
+            print(f"Historyファイルが更新されました ({waited:.1f} 秒待機)。処理を続行します。")
+        else:
+            print(f"警告: {waited:.1f} 秒待機しましたが更新されませんでした。現在の履歴で続行します。")
     else:
         print("Historyファイルは最近(3分以内)更新されています。そのまま続行します。")
 
-    # 3-1. History に対して Select 文を実行
-    # ロック回避のためコピーを作成
-    try:
-        shutil.copy2(CHROME_HISTORY_PATH, TEMP_HISTORY_PATH)
-    except IOError as e:
-        print(f"ファイルのコピーに失敗しました: {e}")
-        return
+def collect_history_range(first, last):
+    """
+    各プロファイルの新しい訪問を蓄積先に取り込み、first〜last の訪問を日ごとに返す ({日付: 訪問のリスト})。
+    訪問のない日は含まない。取得対象のプロファイルがない場合は None
+    """
+    profiles = discover_profiles()
+    if not profiles:
+        print("エラー: .env ファイルに CHROME_HISTORY_PATH / CHROME_HISTORY_PATHS / CHROME_PROFILE_ROOTS のいずれも設定されていないか、Historyファイルが見つかりません。")
+        return None
 
-    results = []
-    
-    try:
-        conn = sqlite3.connect(TEMP_HISTORY_PATH)
-        cursor = conn.cursor()
+    # 1-2. メインのプロファイルが古い場合は Chrome を起動して更新を待つ
+    if CHROME_HISTORY_PATH and os.path.exists(CHROME_HISTORY_PATH):
+        if CHROME_EXE_PATH:
+            ensure_history_fresh(CHROME_HISTORY_PATH, CHROME_EXE_PATH)
+        else:
+            print("CHROME_EXE_PATH が設定されていないため、Chrome の起動はスキップします。")
 
-        # 24時間前のタイムスタンプ取得
-        cutoff_time = get_webkit_timestamp_24h_ago()
+    # 3-1. 各プロファイルの新しい訪問だけを並列に読み込み、蓄積先に取り込む
+    # ファイル全体はコピーせず、読み取り専用の接続で必要な行だけを読む
+    print(f"{len(profiles)} 個のプロファイルから取り込みます (並列 {min(CHROME_MAX_WORKERS, len(profiles))})...")
+    warehouse = open_warehouse()
+    ingest_profiles(warehouse, profiles)
 
-        # 1日以内の URL と タイトルを取得するSQL
-        # last_visit_time は WebKit Timestamp 形式
-        sql = """
-        SELECT url, title, last_visit_time
-        FROM urls
-        WHERE last_visit_time > ?
-        ORDER BY last_visit_time DESC
-        """
-        
-        cursor.execute(sql, (cutoff_time,))
-        rows = cursor.fetchall()
-
-        for row in rows:
-            # WebKit Timestamp を読みやすい形式に変換
-            webkit_time = row[2]
-            unix_time = (webkit_time / 1000000) - 11644473600
-            dt_obj = datetime.datetime.fromtimestamp(unix_time)
-            
-            results.append({
-                "url": row[0],
-                "title": row[1],
-                "visit_time": dt_obj.strftime('%Y-%m-%d %H:%M:%S')
-            })
-
-    except sqlite3.Error as e:
-        print(f"SQLite エラー: {e}")
-    finally:
-        if conn:
-            conn.close()
-        # 一時ファイルの削除
-        if os.path.exists(TEMP_HISTORY_PATH):
-            os.remove(TEMP_HISTORY_PATH)
-
-    # 4. JSON で出力する
-    json_output = json.dumps(results, indent=2, ensure_ascii=False)
-    
-    # --- 変更箇所 ---
-    # 前日の日付を取得してファイル名を生成
-    date_str = datetime.datetime.now()
-    date_str = date_str - datetime.timedelta(days=1)
-    date_str = date_str.strftime('%Y-%m-%d')
-    output_filename = f"{date_str}_history_output.json"
-    
-    # ファイルに保存
-    with open(output_filename, "w", encoding="utf-8") as f:
-        f.write(json_output)
-    print(f"{output_filename} に保存しました。")
-    # ----------------
+    # 3-2. 蓄積先から期間内の訪問を 1 回の検索で取り出し、日ごとに分ける (全プロファイル分を結合し、取得元を付ける)
+    # 取り込みに失敗したプロファイルも蓄積済みの分は出力する
+    days = export_range(warehouse, first, last)
+    warehouse.close()
+
+    return days
+
+def collect_history(target_day):
+    """
+    各プロファイルの新しい訪問を蓄積先に取り込み、指定日の訪問を時刻順に返す。
+    取得対象のプロファイルがない場合は None
+    """
+    days = collect_history_range(target_day, target_day)
+    return None if days is None else days.get(target_day, [])
+
+def main():
+    parser = argparse.ArgumentParser(description="Chrome の閲覧履歴を蓄積し、指定日の履歴を JSON で出力")
+    parser.add_argument("date", nargs="?", help="出力する日付 (YYYY-MM-DD)。指定しない場合は昨日が対象になります。")
+    args = parser.parse_args()
+
+    if args.date:
+        try:
+            target_day = datetime.datetime.strptime(args.date, "%Y-%m-%d").date()
+        except ValueError:
+            print("エラー: 日付の形式が正しくありません。YYYY-MM-DD で指定してください。")
+            return
+    else:
+        target_day = datetime.date.today() - datetime.timedelta(days=1)
+
+    results = collect_history(target_day)
+    if results is None:
+        return
+
+    # 4. データストアに保存する
+    daily_store.put_day(daily_store.HISTORY, target_day.isoformat(), results)
+    print(f"{daily_store.DAILY_STORE_PATH} ({daily_store.HISTORY}) に保存しました ({len(results)} 件)。")
 
 if __name__ == "__main__":
     main()
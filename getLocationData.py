@@ -1,23 +1,159 @@
 """
 Google Maps Places API (New) を使用して、指定された日のタイムラインJSON内の訪問場所情報を更新するスクリプト。
-キャッシュ機能を備えており、既に取得した場所情報はCSVファイルに保存され、再利用されます。
+キャッシュ機能を備えており、既に取得した場所情報は SQLite ファイルに 1 件ずつ保存され、再利用されます。
 """
 
-import json
 import csv
 import os
+import math
+import time
+import sqlite3
+import random
+import threading
 import requests
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+import daily_store
+import metrics
+
 # --- 設定 ---
 load_dotenv()
 API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
-CACHE_CSV = "placeLocation.csv"
+CACHE_CSV = "placeLocation.csv"  # 旧形式のキャッシュ (初回のみ SQLite に取り込む)
+CACHE_DB = "placeLocation.sqlite3"
+
+# Places API の接続設定 (PLACES_API_BASE_URL はテスト用のスタブサーバーに向ける場合に使用)
+PLACES_API_BASE_URL = os.getenv("PLACES_API_BASE_URL", "https://places.googleapis.com/v1").rstrip("/")
+
+def _env_number(name, default, cast):
+    try:
+        return cast(os.getenv(name, str(default)))
+    except ValueError:
+        print(f"警告: {name} の設定が不正です。デフォルト値({default})を使用します。")
+        return default
+
+PLACES_QPS = _env_number("PLACES_QPS", 5.0, float)              # 1 秒あたりの最大リクエスト数
+PLACES_MAX_WORKERS = max(1, _env_number("PLACES_MAX_WORKERS", 8, int))  # 同時に照会する件数 (1 以上)
+PLACES_TIMEOUT = _env_number("PLACES_TIMEOUT", 10.0, float)     # 1 リクエストのタイムアウト (秒)
+PLACES_MAX_RETRIES = _env_number("PLACES_MAX_RETRIES", 4, int)  # 429 / 5xx / 通信エラー時の再試行回数
+PLACES_BACKOFF_BASE = 0.5                                       # 再試行間隔の基準 (秒)、試行ごとに 2 倍
+
+# キャッシュの有効期限 (日)。0 の場合は期限なし
+PLACE_CACHE_TTL_DAYS = _env_number("PLACE_CACHE_TTL_DAYS", 0.0, float)
+# 取得できなかった placeID を再照会しない期間 (日)。0 の場合は記録せず、次回も照会する
+PLACE_NEGATIVE_TTL_DAYS = max(0.0, _env_number("PLACE_NEGATIVE_TTL_DAYS", 7.0, float))
+
+# placeID のない訪問を、この距離 (m) 以内で最も近いキャッシュ済みの場所に割り当てる
+PLACE_MATCH_RADIUS_M = _env_number("PLACE_MATCH_RADIUS_M", 100.0, float)
+
+# 再試行の対象とする HTTP ステータス
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class RateLimiter:
+    """複数スレッドから呼ばれても、リクエストの間隔が 1/qps 秒以上になるよう待機させる"""
+
+    def __init__(self, qps):
+        self.interval = 1.0 / qps if qps > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_until = max(self.next_time, now)
+            self.next_time = wait_until + self.interval
+        delay = wait_until - now
+        if delay > 0:
+            time.sleep(delay)
+
+EARTH_RADIUS_M = 6_371_008.8
+METERS_PER_DEG = math.pi * EARTH_RADIUS_M / 180
+
+def parse_geo(value):
+    """"geo:35.68,139.76" / "35.68°, 139.76°" / {"latLng": ...} を (緯度, 経度) に変換。不正な場合は None"""
+    if isinstance(value, dict):
+        value = value.get("latLng")
+    if not value or not isinstance(value, str):
+        return None
+    s = value.strip()
+    if s.startswith("geo:"):
+        s = s[4:]
+    try:
+        lat, lon = s.replace("°", "").split(",")
+        return float(lat), float(lon)
+    except ValueError:
+        return None
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """2 点間の距離 (m, ハバーサイン)"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    h = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(h)))
+
+class PlaceGrid:
+    """
+    キャッシュ済みの場所を緯度経度のグリッドに登録し、近い場所を探す空間インデックス。
+    検索は周囲のセルだけを調べるため、登録件数が増えても一定時間で終わる。
+    """
+
+    def __init__(self, cell_m=PLACE_MATCH_RADIUS_M):
+        self.cell_deg = max(cell_m, 1.0) / METERS_PER_DEG
+        self.cells = {}
+        self.places = {}
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def add(self, place_id, info):
+        """場所を登録する (座標のない場所は無視)"""
+        loc = parse_geo(info.get("placeLocation"))
+        if loc is None:
+            return
+        if place_id not in self.places:
+            self.cells.setdefault(self._cell(*loc), []).append((loc[0], loc[1], place_id))
+        self.places[place_id] = info
+
+    def nearest(self, lat, lon, radius_m=PLACE_MATCH_RADIUS_M):
+        """radius_m 以内で最も近い場所を (placeID, 情報, 距離) で返す。見つからない場合は None"""
+        ci, cj = self._cell(lat, lon)
+        cell_m = self.cell_deg * METERS_PER_DEG
+        di = math.ceil(radius_m / cell_m)
+        # 経度方向のセルは高緯度ほど狭くなるため、調べる範囲を広げる
+        dj = math.ceil(radius_m / (cell_m * max(math.cos(math.radians(lat)), 0.01)))
+
+        best = None
+        for i in range(ci - di, ci + di + 1):
+            for j in range(cj - dj, cj + dj + 1):
+                for plat, plon, pid in self.cells.get((i, j), ()):
+                    d = distance_m(lat, lon, plat, plon)
+                    if d <= radius_m and (best is None or d < best[2]):
+                        best = (pid, self.places[pid], d)
+        return best
+
+def build_place_grid(conn):
+    """キャッシュ済みの全ての場所からグリッドを作成する"""
+    grid = PlaceGrid()
+    rows = conn.execute(
+        "SELECT place_id, name, address, place_location FROM places WHERE status = 'ok' AND place_location != ''"
+    )
+    for row in rows:
+        grid.add(row["place_id"], {"name": row["name"], "address": row["address"], "placeLocation": row["place_location"]})
+    return grid
+
+def create_session(pool_size=PLACES_MAX_WORKERS):
+    """接続を使い回すためのセッションを作成する"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 def load_cache(file_path):
-    """CSVから場所情報を読み込み辞書形式で返す"""
+    """CSVから場所情報を読み込み辞書形式で返す (旧形式キャッシュの取り込み用)"""
     cache = {}
     if os.path.exists(file_path):
         with open(file_path, mode='r', encoding='utf-8') as f:
@@ -30,111 +166,253 @@ def load_cache(file_path):
                 }
     return cache
 
-def save_cache(file_path, cache):
-    """辞書形式の場所情報をCSVに保存する"""
-    with open(file_path, mode='w', encoding='utf-8', newline='') as f:
-        fieldnames = ['placeID', 'name', 'address', 'placeLocation']
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for pid, info in cache.items():
-            writer.writerow({
-                'placeID': pid,
-                'name': info['name'],
-                'address': info['address'],
-                'placeLocation': info['placeLocation']
-            })
-
-def get_place_details_from_api(place_id, api_key):
+def open_cache(db_path=None, csv_path=None):
+    """
+    場所情報キャッシュ (SQLite) を開く。省略したパスは CACHE_DB / CACHE_CSV。
+    初回のみ旧形式の CSV を取り込む。
+    """
+    csv_path = csv_path or CACHE_CSV
+    conn = sqlite3.connect(db_path or CACHE_DB)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS places (
+            place_id TEXT PRIMARY KEY,
+            name TEXT,
+            address TEXT,
+            place_location TEXT,
+            status TEXT NOT NULL,        -- ok: 取得済み / failed: 取得できなかった
+            fetched_at REAL NOT NULL,
+            expires_at REAL              -- NULL の場合は期限なし
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """)
+
+    imported = conn.execute("SELECT value FROM meta WHERE key = 'csv_imported'").fetchone()
+    if imported is None:
+        legacy = load_cache(csv_path)
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO places VALUES (?, ?, ?, ?, 'ok', ?, NULL)",
+                [(pid, i["name"], i["address"], i["placeLocation"], now) for pid, i in legacy.items()],
+            )
+            conn.execute("INSERT INTO meta VALUES ('csv_imported', ?)", (datetime.now().isoformat(),))
+        if legacy:
+            print(f"旧キャッシュ {csv_path} から {len(legacy)} 件を取り込みました。")
+    return conn
+
+def _expires_at(now, ttl_days):
+    return now + ttl_days * 86400 if ttl_days > 0 else None
+
+def get_cached_places(conn, place_ids):
+    """
+    placeID の一覧に対応するキャッシュを返す。
+    戻り値は {placeID: {"info": 情報 または None, "expired": bool}}
+    """
+    now = time.time()
+    result = {}
+    ids = list(dict.fromkeys(place_ids))
+    # SQLite の変数上限を超えないよう分割して問い合わせる
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        rows = conn.execute(
+            f"SELECT * FROM places WHERE place_id IN ({','.join('?' * len(chunk))})", chunk
+        ).fetchall()
+        for row in rows:
+            info = None
+            if row["status"] == "ok":
+                info = {"name": row["name"], "address": row["address"], "placeLocation": row["place_location"]}
+            expired = row["expires_at"] is not None and row["expires_at"] <= now
+            result[row["place_id"]] = {"info": info, "expired": expired}
+    return result
+
+def store_place(conn, place_id, info, ttl_days=PLACE_CACHE_TTL_DAYS):
+    """取得した場所情報を 1 件保存する"""
+    now = time.time()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO places VALUES (?, ?, ?, ?, 'ok', ?, ?)",
+            (place_id, info["name"], info["address"], info["placeLocation"], now, _expires_at(now, ttl_days)),
+        )
+
+def store_failure(conn, place_id, ttl_days=PLACE_NEGATIVE_TTL_DAYS):
+    """
+    取得できなかった placeID を記録し、期限まで再照会しないようにする。
+    以前に取得できていた場所の情報は上書きしない。ttl_days が 0 以下の場合は記録しない (期限なしにはしない)
+    """
+    if ttl_days <= 0:
+        return
+    now = time.time()
+    expires_at = _expires_at(now, ttl_days)
+    with conn:
+        updated = conn.execute(
+            "UPDATE places SET fetched_at = ?, expires_at = ? WHERE place_id = ? AND status = 'ok'",
+            (now, expires_at, place_id),
+        ).rowcount
+        if not updated:
+            conn.execute(
+                "INSERT OR REPLACE INTO places VALUES (?, NULL, NULL, NULL, 'failed', ?, ?)",
+                (place_id, now, expires_at),
+            )
+
+def _retry_delay(response, attempt):
+    """再試行までの待機時間。Retry-After ヘッダーがあれば優先する"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+    return PLACES_BACKOFF_BASE * (2 ** attempt) * (0.5 + random.random())
+
+def get_place_details_from_api(place_id, api_key, session=None, limiter=None):
     """Places API (New) を叩いて情報を取得する。取得できない場合はNoneを返す"""
     if not api_key:
         print("エラー: APIキーが設定されていません。")
         return None
+    info, _ = fetch_place_details(place_id, api_key, session, limiter)
+    return info
 
-    url = f"https://places.googleapis.com/v1/places/{place_id}"
+def fetch_place_details(place_id, api_key, session=None, limiter=None):
+    """
+    Places API (New) を叩いて情報を取得する。
+    戻り値は (情報 または None, 再試行しても取得できない失敗か)
+    """
+    url = f"{PLACES_API_BASE_URL}/places/{place_id}"
     headers = {
         "Content-Type": "application/json",
         "X-Goog-Api-Key": api_key,
         "X-Goog-FieldMask": "displayName,formattedAddress,location"
     }
     params = {"languageCode": "ja"}
+    http = session or requests
+
+    for attempt in range(PLACES_MAX_RETRIES + 1):
+        if limiter:
+            limiter.wait()
+
+        response = None
+        # 再試行を含め、HTTP リクエストごとに数える
+        metrics.count("api_calls")
+        try:
+            response = http.get(url, headers=headers, params=params, timeout=PLACES_TIMEOUT)
+        except requests.RequestException as e:
+            error = str(e)
+        else:
+            if response.status_code == 200:
+                break
+            if response.status_code not in RETRY_STATUS:
+                return None, True
+            error = f"HTTP {response.status_code}"
+
+        if attempt == PLACES_MAX_RETRIES:
+            print(f"照会に失敗しました ({error}): {place_id}")
+            return None, False
+        time.sleep(_retry_delay(response, attempt))
 
     try:
-        response = requests.get(url, headers=headers, params=params)
-        if response.status_code != 200:
-            return None
-        
         data = response.json()
-        loc = data.get("location", {})
-        lat = loc.get("latitude")
-        lng = loc.get("longitude")
-        location_str = f"geo:{lat},{lng}" if lat and lng else ""
-
-        return {
-            "name": data.get("displayName", {}).get("text", "Unknown Name"),
-            "address": data.get("formattedAddress", "Unknown Address"),
-            "placeLocation": location_str
-        }
-    except:
-        return None
-
-def main():
-    # 1. コマンドライン引数の解析
-    parser = argparse.ArgumentParser(description="Google Map タイムラインJSON更新スクリプト")
-    parser.add_argument("date", nargs="?", help="対象日付 (YYYY-MM-DD)。指定しない場合は昨日が対象になります。")
-    args = parser.parse_args()
+    except ValueError:
+        return None, True
 
-    # 日付指定がない場合は昨日を対象にする
-    if args.date is None:
-        target_date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-        print(f"日付が指定されなかったため、昨日 ({target_date}) を対象とします。")
-    else:
-        target_date = args.date
+    loc = data.get("location", {})
+    lat = loc.get("latitude")
+    lng = loc.get("longitude")
+    location_str = f"geo:{lat},{lng}" if lat is not None and lng is not None else ""
 
-    input_json = f"filtered_{target_date}.json"
-    output_json = f"updated_{target_date}.json"
+    return {
+        "name": data.get("displayName", {}).get("text", "Unknown Name"),
+        "address": data.get("formattedAddress", "Unknown Address"),
+        "placeLocation": location_str
+    }, False
 
-    if not os.path.exists(input_json):
-        print(f"エラー: {input_json} が存在しません。")
-        return
+def resolve_places(place_ids, api_key, on_result=None, max_workers=PLACES_MAX_WORKERS, qps=PLACES_QPS):
+    """
+    重複を除いた placeID をまとめて並列に照会する。
+    1 つのセッションを共有し、全スレッド合計で qps を超えないようにする。
+    on_result(placeID, 情報 または None, 恒久的な失敗か) は取得できた順にメインスレッドで呼ばれる。
+    戻り値は {placeID: 情報 または None}
+    """
+    unique_ids = list(dict.fromkeys(place_ids))
+    if not unique_ids:
+        return {}
+    if not api_key:
+        print("エラー: APIキーが設定されていません。")
+        return {}
 
-    # 2. キャッシュとJSONの読み込み
-    cache = load_cache(CACHE_CSV)
-    
-    with open(input_json, 'r', encoding='utf-8') as f:
-        timeline_data = json.load(f)
+    max_workers = max(1, max_workers)
+    print(f"新規PlaceIDを照会中: {len(unique_ids)} 件 (並列 {max_workers}, 最大 {qps} 件/秒)")
+    limiter = RateLimiter(qps)
+    results = {}
+    with create_session(max_workers) as session, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        fetch = metrics.bind(fetch_place_details)
+        futures = {pool.submit(fetch, pid, api_key, session, limiter): pid for pid in unique_ids}
+        for future in as_completed(futures):
+            pid = futures[future]
+            info, permanent = future.result()
+            results[pid] = info
+            if on_result:
+                on_result(pid, info, permanent)
+    return results
 
+def enrich_timeline(timeline_data, refresh=False):
+    """
+    タイムラインの訪問 (visit) に場所の名前・住所・座標を書き込む (timeline_data を直接更新する)。
+    戻り値は {"updated", "matched", "skipped"} の件数。
+    """
+    conn = open_cache()
     updated_count = 0
     skipped_count = 0
 
-    # 3. データの処理
-    for entry in timeline_data:
-        # 訪問(visit)データ以外はスキップ
-        if "visit" not in entry:
-            continue
-        
-        visit_info = entry["visit"]
+    # 未取得・期限切れの placeID をまとめて照会し、取得できた順に保存する
+    visits = [entry["visit"] for entry in timeline_data if "visit" in entry]
+    place_ids = [v.get("topCandidate", {}).get("placeID") for v in visits]
+    place_ids = [pid for pid in place_ids if pid]
+    cached = get_cached_places(conn, place_ids)
+    new_ids = [pid for pid in place_ids if refresh or pid not in cached or cached[pid]["expired"]]
+    metrics.count("records_in", len(visits))
+    metrics.count("cache_hits", len(set(place_ids)) - len(set(new_ids)))
+    metrics.count("cache_misses", len(set(new_ids)))
+
+    # 空間インデックスは一度だけ作成し、新しく取得した場所を追加していく
+    grid = build_place_grid(conn)
+
+    def on_result(pid, info, permanent):
+        if info:
+            store_place(conn, pid, info)
+            grid.add(pid, info)
+        elif permanent:
+            store_failure(conn, pid)
+
+    resolve_places(new_ids, API_KEY, on_result)
+    cache = {pid: entry["info"] for pid, entry in get_cached_places(conn, place_ids).items()}
+    conn.close()
+
+    # データの処理
+    matched_count = 0
+    for visit_info in visits:
         top_candidate = visit_info.get("topCandidate", {})
         place_id = top_candidate.get("placeID")
+        info = cache.get(place_id) if place_id else None
 
-        # placeIDがない場合は不明な場所としてスキップ
-        if not place_id:
-            skipped_count += 1
-            continue
+        # placeID がない・取得できなかった場合は、近くのキャッシュ済みの場所に割り当てる
+        if not info:
+            loc = parse_geo(top_candidate.get("placeLocation"))
+            match = grid.nearest(*loc) if loc else None
+            if match:
+                matched_pid, info, dist = match
+                top_candidate["matchedPlaceID"] = matched_pid
+                top_candidate["matchDistanceMeters"] = round(dist, 1)
+                matched_count += 1
 
-        # キャッシュ確認またはAPI取得
-        if place_id in cache:
-            info = cache[place_id]
-        else:
-            print(f"新規PlaceIDを照会中: {place_id}")
-            info = get_place_details_from_api(place_id, API_KEY)
-            
-            if info:
-                cache[place_id] = info
-            else:
-                # APIでも取得できなかった場合はスキップ
+        if not info:
+            # 不明な場所としてスキップ
+            if place_id:
                 print(f"場所を特定できませんでした。スキップします: {place_id}")
-                skipped_count += 1
-                continue
+            skipped_count += 1
+            continue
 
         # JSON情報を更新
         top_candidate["name"] = info["name"]
@@ -142,15 +420,39 @@ def main():
         top_candidate["placeLocation"] = info["placeLocation"]
         updated_count += 1
 
+    metrics.count("records_out", updated_count)
+    print(f"成功: {updated_count} 件 (うち近くの場所から推定: {matched_count} 件)")
+    print(f"スキップ（不明な場所）: {skipped_count} 件")
+    return {"updated": updated_count, "matched": matched_count, "skipped": skipped_count}
+
+def main():
+    # 1. コマンドライン引数の解析
+    parser = argparse.ArgumentParser(description="Google Map タイムラインJSON更新スクリプト")
+    parser.add_argument("date", nargs="?", help="対象日付 (YYYY-MM-DD)。指定しない場合は昨日が対象になります。")
+    parser.add_argument("--refresh", action="store_true", help="キャッシュ済みの場所も再照会する")
+    args = parser.parse_args()
+
+    # 日付指定がない場合は昨日を対象にする
+    if args.date is None:
+        target_date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        print(f"日付が指定されなかったため、昨日 ({target_date}) を対象とします。")
+    else:
+        target_date = args.date
+
+    # 2. exportDailyLocation.py で抽出したその日のセグメントをデータストアから読み込む
+    timeline_data = daily_store.get_day(daily_store.LOCATION, target_date)
+    if timeline_data is None:
+        print(f"エラー: {target_date} の位置情報がデータストアにありません。先に exportDailyLocation.py を実行してください。")
+        return
+
+    # 3. 場所情報の照会と書き込み
+    enrich_timeline(timeline_data, args.refresh)
+
     # 4. 保存
-    save_cache(CACHE_CSV, cache)
-    
-    with open(output_json, 'w', encoding='utf-8') as f:
-        json.dump(timeline_data, f, ensure_ascii=False, indent=2)
+    daily_store.put_day(daily_store.PLACES, target_date, timeline_data)
 
     print(f"\n--- 完了 ({target_date}) ---")
-    print(f"成功: {updated_count} 件")
-    print(f"スキップ（不明な場所）: {skipped_count} 件")
+    print(f"保存完了: {daily_store.DAILY_STORE_PATH} ({daily_store.PLACES})")
 
 if __name__ == "__main__":
     main()
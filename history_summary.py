@@ -0,0 +1,232 @@
+"""
+閲覧履歴 (getChromeHistory.py の出力) をドメイン・セッション単位に集計するスクリプト。
+デイリーノートには上位 N 件の表とドメインごとの件数だけを書き、
+すべての訪問は URL ごとにまとめて (各訪問の日時・滞在時間・遷移種別とともに) 別の圧縮ファイルに保存する。
+"""
+
+import os
+import json
+import gzip
+import heapq
+import argparse
+import datetime
+from pathlib import Path
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+
+import daily_store
+import metrics
+
+# --- 設定読み込み ---
+
+SCRIPT_DIR = Path(__file__).parent
+env_path = SCRIPT_DIR / ".env"
+load_dotenv(env_path)
+
+try:
+    HISTORY_TOP_N = max(1, int(os.getenv("HISTORY_TOP_N", "20")))
+except ValueError:
+    HISTORY_TOP_N = 20
+    print("警告: HISTORY_TOP_N の設定が不正です。デフォルト値(20)を使用します。")
+
+try:
+    # 訪問の間隔がこの分数を超えたら別のセッションとみなす
+    HISTORY_SESSION_GAP_MINUTES = float(os.getenv("HISTORY_SESSION_GAP_MINUTES", "30"))
+except ValueError:
+    HISTORY_SESSION_GAP_MINUTES = 30.0
+    print("警告: HISTORY_SESSION_GAP_MINUTES の設定が不正です。デフォルト値(30)を使用します。")
+
+_detail_dir_raw = os.getenv("HISTORY_DETAIL_DIR")
+HISTORY_DETAIL_DIR = Path(os.path.expandvars(_detail_dir_raw)) if _detail_dir_raw else SCRIPT_DIR / "history_detail"
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 詳細ファイルに訪問ごとに残す項目 (getChromeHistory.py の出力のうち URL ごとに共通でないもの)
+DETAIL_VISIT_KEYS = ("visit_time", "duration_seconds", "transition", "source", "title")
+
+# --- 関数定義 ---
+
+def domain_of(url):
+    """URL のドメイン (先頭の www. は除く)。ホストのない URL はスキーム名 (chrome: など)"""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return "(不明)"
+    host = parts.hostname
+    if not host:
+        return f"{parts.scheme}:" if parts.scheme else "(不明)"
+    return host[4:] if host.startswith("www.") else host
+
+def summarize_history(items, top_n=HISTORY_TOP_N, session_gap_minutes=HISTORY_SESSION_GAP_MINUTES):
+    """
+    訪問のリストをドメイン・URL ごとに集計する。
+    セッションは訪問の間隔が session_gap_minutes を超えたところで区切り、ドメインごとに訪れたセッション数を数える。
+    集計は 1 回の走査で行い、上位の抽出だけ heapq で行う (訪問数に対して線形)。
+    """
+    # export は新しい順なので、時刻順に並べ直す (ほぼ整列済みのため線形時間で終わる)
+    visits = []
+    for item in items:
+        try:
+            # "YYYY-MM-DD HH:MM:SS" は ISO 形式として高速に読み込める
+            ts = datetime.datetime.fromisoformat(item.get("visit_time", ""))
+        except (TypeError, ValueError):
+            continue
+        visits.append((ts, item))
+    visits.sort(key=lambda v: v[0])
+
+    gap = datetime.timedelta(minutes=session_gap_minutes)
+    session = 0
+    prev_ts = None
+    domains = {}
+    pages = {}
+
+    for ts, item in visits:
+        if prev_ts is not None and ts - prev_ts > gap:
+            session += 1
+        prev_ts = ts
+
+        url = item.get("url") or "#"
+        seconds = item.get("duration_seconds") or 0
+
+        # 同じ URL への繰り返しの訪問は 1 件にまとめる (ドメインの解析も URL ごとに 1 回)
+        p = pages.get(url)
+        if p is None:
+            p = pages[url] = {
+                "url": url, "title": item.get("title") or "", "domain": domain_of(url),
+                "visits": 0, "seconds": 0.0, "first": ts, "last": ts, "sources": set(), "rows": [],
+            }
+        p["visits"] += 1
+        p["seconds"] += seconds
+        p["last"] = ts
+        if item.get("title"):
+            p["title"] = item["title"]
+        if item.get("source"):
+            p["sources"].add(item["source"])
+        p["rows"].append(item)
+
+        domain = p["domain"]
+        d = domains.get(domain)
+        if d is None:
+            d = domains[domain] = {"domain": domain, "visits": 0, "seconds": 0.0, "sessions": 0, "_last_session": -1}
+        d["visits"] += 1
+        d["seconds"] += seconds
+        if d["_last_session"] != session:
+            d["sessions"] += 1
+            d["_last_session"] = session
+
+    for d in domains.values():
+        del d["_last_session"]
+
+    # 滞在時間、同じなら訪問回数の多い順
+    rank = lambda x: (x["seconds"], x["visits"])
+    return {
+        "visits": len(visits),
+        "sessions": session + 1 if visits else 0,
+        "domains": sorted(domains.values(), key=lambda d: (-d["visits"], d["domain"])),
+        "top_domains": heapq.nlargest(top_n, domains.values(), key=rank),
+        "top_pages": heapq.nlargest(top_n, pages.values(), key=rank),
+        "pages": pages,
+    }
+
+def format_duration(seconds):
+    minutes = round(seconds / 60)
+    if minutes >= 60:
+        return f"{minutes // 60}時間{minutes % 60}分"
+    return f"{minutes}分"
+
+def _escape(text):
+    return text.replace("|", "\\|")
+
+def summary_to_markdown(summary, heading="## 閲覧履歴"):
+    """集計結果をデイリーノート用の Markdown (上位 N 件の表とドメインごとの件数) に変換する"""
+    lines = [f"{heading}\n"]
+    lines.append(
+        f"{summary['visits']} 件の訪問 / {len(summary['pages'])} ページ / "
+        f"{len(summary['domains'])} ドメイン / {summary['sessions']} セッション\n"
+    )
+
+    lines.append("| ページ | ドメイン | 訪問 | 時間 | 最終 |")
+    lines.append("| :--- | :--- | ---: | ---: | :--- |")
+    for p in summary["top_pages"]:
+        title = _escape(p["title"] or p["url"]).replace("[", "\\[").replace("]", "\\]")
+        url = p["url"].replace(" ", "%20").replace(")", "%29").replace("|", "%7C")
+        lines.append(
+            f"| [{title}]({url}) | {_escape(p['domain'])} | {p['visits']} | "
+            f"{format_duration(p['seconds'])} | {p['last'].strftime('%H:%M')} |"
+        )
+
+    lines.append("\n### ドメイン別\n")
+    lines.append("| ドメイン | 訪問 | 時間 | セッション |")
+    lines.append("| :--- | ---: | ---: | ---: |")
+    top = {d["domain"] for d in summary["top_domains"]}
+    others = [d for d in summary["domains"] if d["domain"] not in top]
+    for d in sorted(summary["top_domains"], key=lambda d: (-d["visits"], d["domain"])):
+        lines.append(f"| {_escape(d['domain'])} | {d['visits']} | {format_duration(d['seconds'])} | {d['sessions']} |")
+    if others:
+        lines.append(
+            f"| ほか {len(others)} ドメイン | {sum(d['visits'] for d in others)} | "
+            f"{format_duration(sum(d['seconds'] for d in others))} | - |"
+        )
+    return "\n".join(lines)
+
+def detail_path(date_str):
+    return HISTORY_DETAIL_DIR / date_str[:7] / f"{date_str}.jsonl.gz"
+
+def save_detail(summary, date_str):
+    """
+    URL ごとにまとめたすべての訪問を 1 行 1 件の圧縮ファイルに保存する (一時ファイル経由で置き換え)。
+    各行の "visit_rows" に訪問ごとの日時・滞在時間・遷移種別・取得元を残すため、load_detail で元の訪問に戻せる
+    """
+    path = detail_path(date_str)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        for p in sorted(summary["pages"].values(), key=lambda p: p["first"]):
+            record = {
+                "url": p["url"],
+                "title": p["title"],
+                "domain": p["domain"],
+                "visits": p["visits"],
+                "seconds": round(p["seconds"], 1),
+                "first": p["first"].strftime(TIME_FORMAT),
+                "last": p["last"].strftime(TIME_FORMAT),
+                "sources": sorted(p["sources"]),
+                "visit_rows": [
+                    {k: item[k] for k in DETAIL_VISIT_KEYS if k in item and not (k == "title" and item[k] == p["title"])}
+                    for item in p["rows"]
+                ],
+            }
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+    os.replace(tmp_path, path)
+    metrics.count("bytes_written", path.stat().st_size)
+    return path
+
+def load_detail(date_str):
+    """save_detail で保存した詳細から、その日の訪問 (getChromeHistory.py の出力と同じ形式) を時刻順に返す"""
+    items = []
+    with gzip.open(detail_path(date_str), "rt", encoding="utf-8") as f:
+        for line in f:
+            page = json.loads(line)
+            for row in page.get("visit_rows", []):
+                items.append({"url": page["url"], "title": page["title"], **row})
+    items.sort(key=lambda item: item.get("visit_time", ""))
+    return items
+
+def main():
+    parser = argparse.ArgumentParser(description="閲覧履歴をドメイン・セッション単位に集計する")
+    parser.add_argument("date", nargs="?", help="対象日 (YYYY-MM-DD)。指定しない場合は昨日が対象になります。")
+    parser.add_argument("--top", type=int, default=HISTORY_TOP_N, help=f"表示する件数 (既定 {HISTORY_TOP_N})")
+    args = parser.parse_args()
+
+    date_str = args.date or (datetime.date.today() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+    items = daily_store.get_day(daily_store.HISTORY, date_str)
+    if items is None:
+        print(f"エラー: {date_str} の閲覧履歴がデータストアにありません。")
+        return
+
+    summary = summarize_history(items, top_n=args.top)
+    print(summary_to_markdown(summary))
+    print(f"\n詳細を保存しました: {save_detail(summary, date_str)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+位置情報の生データ (Records.json の locations / Timeline の timelinePath) を
+日付ごとの列指向バイナリファイルに保存・検索するスクリプト。
+1 点ごとにオブジェクトを作らず、型付き配列 (array) のまま保存・読み込みする。
+"""
+
+import os
+import sys
+import struct
+import argparse
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from pathlib import Path
+from dotenv import load_dotenv
+
+from exportDailyLocation import JST, TimelineReader, parse_dt
+
+# --- 設定読み込み ---
+
+SCRIPT_DIR = Path(__file__).parent
+env_path = SCRIPT_DIR / ".env"
+load_dotenv(env_path)
+
+_points_dir_raw = os.getenv("LOCATION_POINTS_DIR")
+POINTS_DIR = Path(os.path.expandvars(_points_dir_raw)) if _points_dir_raw else SCRIPT_DIR / "location_points"
+
+# ファイル形式: ヘッダー (マジック, 件数) の後に各列をリトルエンディアンで連続して格納する
+POINTS_MAGIC = b"LPT1"
+POINTS_HEADER = struct.Struct("<4sI")
+POINTS_SUFFIX = ".pts"
+
+# 列名と型 (timestamp: UNIX ミリ秒, lat/lon: 度 × 1e7, accuracy: メートル・不明は -1)
+COLUMNS = (("timestamp", "q"), ("lat", "i"), ("lon", "i"), ("accuracy", "i"))
+
+E7 = 10_000_000
+
+# --- 関数定義 ---
+
+def empty_columns():
+    return {name: array(code) for name, code in COLUMNS}
+
+def day_path(day):
+    """日付 (YYYY-MM-DD) のファイルパス。月ごとのフォルダに分ける"""
+    return POINTS_DIR / day[:7] / f"{day}{POINTS_SUFFIX}"
+
+def load_day(day):
+    """指定日の点を列ごとの配列で返す。ファイルがない場合は空の配列"""
+    columns = empty_columns()
+    path = day_path(day)
+    if not path.exists():
+        return columns
+
+    with open(path, "rb") as f:
+        magic, count = POINTS_HEADER.unpack(f.read(POINTS_HEADER.size))
+        if magic != POINTS_MAGIC:
+            raise ValueError(f"位置情報ファイルの形式が不正です: {path}")
+        for name, _ in COLUMNS:
+            columns[name].fromfile(f, count)
+            if sys.byteorder == "big":
+                columns[name].byteswap()
+    return columns
+
+def save_day(day, columns):
+    """指定日の点を保存する (一時ファイル経由で置き換え)"""
+    path = day_path(day)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(POINTS_SUFFIX + ".tmp")
+    count = len(columns["timestamp"])
+
+    with open(tmp_path, "wb") as f:
+        f.write(POINTS_HEADER.pack(POINTS_MAGIC, count))
+        for name, _ in COLUMNS:
+            col = columns[name]
+            if sys.byteorder == "big":
+                col = array(col.typecode, col)
+                col.byteswap()
+            col.tofile(f)
+    os.replace(tmp_path, path)
+
+def merge_columns(a, b):
+    """2 つの列データを時刻順に結合し、同じ時刻の点は後者を優先して 1 件にまとめる"""
+    ts = a["timestamp"] + b["timestamp"]
+    count_a = len(a["timestamp"])
+    # 同じ時刻では b を後ろに並べ、最後の 1 件を残す
+    order = sorted(range(len(ts)), key=lambda i: (ts[i], i >= count_a))
+
+    merged = empty_columns()
+    for name, _ in COLUMNS:
+        combined = a[name] + b[name]
+        col = merged[name]
+        prev = None
+        for i in order:
+            t = ts[i]
+            if t == prev:
+                col[-1] = combined[i]
+            else:
+                col.append(combined[i])
+            prev = t
+    return merged
+
+def parse_point(s):
+    """"geo:35.68,139.76" / "35.68°, 139.76°" 形式の座標を (緯度, 経度) に変換"""
+    s = s.strip()
+    if s.startswith("geo:"):
+        s = s[4:]
+    lat, lon = s.replace("°", "").split(",")
+    return float(lat), float(lon)
+
+def to_unix_ms(dt):
+    return round(dt.timestamp() * 1000)
+
+def iter_record_points(item):
+    """Records.json の locations 要素から (UNIX ミリ秒, 緯度E7, 経度E7, 精度) を返す"""
+    if "latitudeE7" not in item or "longitudeE7" not in item:
+        return
+    if "timestampMs" in item:
+        ts = int(item["timestampMs"])
+    elif "timestamp" in item:
+        ts = to_unix_ms(parse_dt(item["timestamp"]))
+    else:
+        return
+    yield ts, int(item["latitudeE7"]), int(item["longitudeE7"]), int(item.get("accuracy", -1))
+
+def iter_timeline_path_points(segment):
+    """Timeline セグメントの timelinePath から (UNIX ミリ秒, 緯度E7, 経度E7, 精度) を返す"""
+    path = segment.get("timelinePath")
+    if not isinstance(path, list):
+        return
+
+    # 端末エクスポート形式は開始時刻からの経過分数、新形式は各点の時刻を持つ
+    start = parse_dt(segment["startTime"]) if "startTime" in segment else None
+    for p in path:
+        if "point" not in p:
+            continue
+        if "time" in p:
+            dt = parse_dt(p["time"])
+        elif start is not None and "durationMinutesOffsetFromStartTime" in p:
+            dt = start + timedelta(minutes=float(p["durationMinutesOffsetFromStartTime"]))
+        else:
+            continue
+        lat, lon = parse_point(p["point"])
+        yield to_unix_ms(dt), round(lat * E7), round(lon * E7), -1
+
+def day_of(ts_ms):
+    return datetime.fromtimestamp(ts_ms / 1000, JST).strftime("%Y-%m-%d")
+
+def import_points(input_path):
+    """
+    Records.json または Timeline JSON を 1 件ずつ読み込み、日付ごとのファイルに点を追加する。
+    既存の点とは時刻で重複を除いて結合する。
+    """
+    by_day = {}
+    total = 0
+
+    with open(input_path, "rb") as f:
+        # Records.json は {"locations": [...]} 、Timeline は配列または {"semanticSegments": [...]}
+        head = f.read(4096).decode("utf-8", errors="ignore")
+        f.seek(0)
+        reader = TimelineReader(f)
+        if '"locations"' in head:
+            items = reader.iter_segments(key="locations")
+            extract = iter_record_points
+        else:
+            items = reader.iter_segments()
+            extract = iter_timeline_path_points
+
+        for _, item in items:
+            if not isinstance(item, dict):
+                continue
+            total += _add_points(by_day, extract(item))
+
+    _save_points(by_day)
+    print(f"取り込み完了: {total:,} 件 ({len(by_day)} 日分) -> {POINTS_DIR}")
+    return total
+
+def import_segments(segments):
+    """
+    読み込み済みの Timeline セグメントの timelinePath の点を日付ごとのファイルに追加する (パイプライン用)。
+    セグメントの時間内に保存済みの点があるものは取り込み済みとみなし、点を読み込まない。
+    戻り値は追加した点の数
+    """
+    by_day = {}
+    stored = {}
+    total = 0
+    for seg in segments:
+        if not isinstance(seg, dict) or not seg.get("timelinePath") or "startTime" not in seg or "endTime" not in seg:
+            continue
+        if not _has_stored_points(stored, to_unix_ms(parse_dt(seg["startTime"])), to_unix_ms(parse_dt(seg["endTime"]))):
+            total += _add_points(by_day, iter_timeline_path_points(seg))
+    _save_points(by_day)
+    return total
+
+def _has_stored_points(stored, start_ms, end_ms):
+    """[start_ms, end_ms] に保存済みの点があるか。stored には日ごとの時刻の列を読み込んでおく"""
+    day = datetime.fromtimestamp(start_ms / 1000, JST).date()
+    last = datetime.fromtimestamp(end_ms / 1000, JST).date()
+    while day <= last:
+        key = day.isoformat()
+        if key not in stored:
+            stored[key] = load_day(key)["timestamp"]
+        ts = stored[key]
+        i = bisect_left(ts, start_ms)
+        if i < len(ts) and ts[i] <= end_ms:
+            return True
+        day += timedelta(days=1)
+    return False
+
+def _add_points(by_day, points):
+    """(UNIX ミリ秒, 緯度E7, 経度E7, 精度) を日付ごとの列に追加し、追加した数を返す"""
+    added = 0
+    for ts, lat, lon, acc in points:
+        day = day_of(ts)
+        columns = by_day.get(day)
+        if columns is None:
+            columns = by_day[day] = empty_columns()
+        columns["timestamp"].append(ts)
+        columns["lat"].append(lat)
+        columns["lon"].append(lon)
+        columns["accuracy"].append(acc)
+        added += 1
+    return added
+
+def _save_points(by_day):
+    """日付ごとの列を既存の点と時刻で重複を除いて結合し、保存する"""
+    for day, columns in sorted(by_day.items()):
+        save_day(day, merge_columns(load_day(day), columns))
+
+def query_range(start, end):
+    """
+    [start, end) の点を列ごとの配列で返す (start, end は timezone 付き datetime)。
+    日付ファイルごとに時刻の二分探索で範囲を求め、配列のスライスを結合する。
+    """
+    start_ms = to_unix_ms(start)
+    end_ms = to_unix_ms(end)
+    result = empty_columns()
+
+    day = start.astimezone(JST).date()
+    # end は含まないため、翌日の 0 時までの範囲では翌日のファイルを読まない
+    last = (end - timedelta(milliseconds=1)).astimezone(JST).date()
+    while day <= last:
+        columns = load_day(day.isoformat())
+        ts = columns["timestamp"]
+        lo = bisect_left(ts, start_ms)
+        hi = bisect_left(ts, end_ms)
+        if lo < hi:
+            for name, _ in COLUMNS:
+                result[name] += columns[name][lo:hi]
+        day += timedelta(days=1)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="位置情報の生データを日付ごとのバイナリファイルに保存・検索")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="Records.json / Timeline JSON から点を取り込む")
+    p_import.add_argument("path", help="取り込むファイルのパス")
+
+    p_query = sub.add_parser("query", help="期間内の点の件数と範囲を表示")
+    p_query.add_argument("start", help="開始日 (YYYY-MM-DD)")
+    p_query.add_argument("end", nargs="?", help="終了日 (YYYY-MM-DD, この日を含む。省略時は開始日のみ)")
+
+    args = parser.parse_args()
+
+    if args.command == "import":
+        import_points(os.path.expandvars(args.path))
+        return
+
+    try:
+        start = datetime.strptime(args.start, "%Y-%m-%d").replace(tzinfo=JST)
+        end = datetime.strptime(args.end or args.start, "%Y-%m-%d").replace(tzinfo=JST) + timedelta(days=1)
+    except ValueError:
+        print("エラー: 日付の形式が正しくありません。YYYY-MM-DD で指定してください。")
+        return
+
+    columns = query_range(start, end)
+    count = len(columns["timestamp"])
+    print(f"件数: {count:,}")
+    if count:
+        print(f"期間: {datetime.fromtimestamp(columns['timestamp'][0] / 1000, JST)} - "
+              f"{datetime.fromtimestamp(columns['timestamp'][-1] / 1000, JST)}")
+        print(f"緯度: {min(columns['lat']) / E7} - {max(columns['lat']) / E7}")
+        print(f"経度: {min(columns['lon']) / E7} - {max(columns['lon']) / E7}")
+
+if __name__ == "__main__":
+    main()
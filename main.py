@@ -1,6 +1,15 @@
-import subprocess
+import os
 import sys
 import logging
+import argparse
+import datetime
+from pathlib import Path
+from dotenv import load_dotenv
+
+from pipeline import Stage, run_stages
+import daily_store
+import metrics
+from metrics import RunMetrics
 
 # ログ設定
 logging.basicConfig(filename='script_execution.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', encoding='utf-8')
@@ -9,32 +18,146 @@ logging.basicConfig(filename='script_execution.log', level=logging.INFO, format=
 print(sys.executable)
 logging.info(f"Python executable: {sys.executable}")
 
-scripts = [
-    "backup_vault.py", # バックアップスクリプトのため最初に実行すること
-    "exportDailyLocation.py",
-    "getLocationData.py",
-    "getChromeHistory.py",
-    "update_weather.py",
-    "exportDailyNote.py", # デイリーノート追加用スクリプトのため最後に実行すること
-]
-
-for script in scripts:
-    print(f"Running {script}...")
-    logging.info(f"Running {script}...")
-    result = subprocess.run(
-        [sys.executable, script],
-        capture_output=True,
-        text=True,
+SCRIPT_DIR = Path(__file__).parent
+load_dotenv(SCRIPT_DIR / ".env")
+
+# 各ステージのモジュールは実行時に読み込む (設定の不備などで 1 つの読み込みに失敗しても、他の処理は続行する)
+# 各ステージは first〜last の期間をまとめて処理し、日ごとの結果を {日付文字列: データ} で次のステージに渡す
+# (日次の実行は 1 日だけの期間として扱う)。日ごとの結果はデータストア (daily_store.py) にも保存する
+
+def daterange(first, last):
+    day = first
+    while day <= last:
+        yield day
+        day += datetime.timedelta(days=1)
+
+def run_backup(first, last, results):
+    from backup_vault import create_backup
+    return create_backup()
+
+def run_chrome(first, last, results):
+    from getChromeHistory import collect_history_range
+    history = collect_history_range(first, last)
+    if history is None:
+        return False
+    metrics.count("records_out", sum(len(v) for v in history.values()))
+    days = {day.isoformat(): history.get(day, []) for day in daterange(first, last)}
+    daily_store.put_days(daily_store.HISTORY, days)
+    return days
+
+def run_location(first, last, results):
+    from exportDailyLocation import extract_days
+    input_path = os.getenv("LOCATION_HISTORY_PATH")
+    if not input_path:
+        print("エラー: 環境変数 'LOCATION_HISTORY_PATH' が設定されていません。")
+        return False
+    days = [day.isoformat() for day in daterange(first, last)]
+    picked, total = extract_days(os.path.expandvars(input_path), days)
+    count = sum(len(v) for v in picked.values())
+    print(f"元データ件数: {total} / 抽出件数: {count} ({len(days)} 日)")
+    metrics.count("records_in", total)
+    metrics.count("records_out", count)
+    daily_store.put_days(daily_store.LOCATION, picked)
+    return picked
+
+def run_places(first, last, results):
+    from getLocationData import enrich_timeline
+    timeline = results["location"]
+    # 全日の訪問をまとめて照会する (各日のリストの要素を直接更新する)
+    enrich_timeline([entry for entries in timeline.values() for entry in entries])
+    daily_store.put_days(daily_store.PLACES, timeline)
+    return timeline
+
+def run_movement(first, last, results):
+    from movement_stats import movement_properties
+    # 位置情報のステージが読み込んだセグメントから計算する (ノートへの書き込みはデイリーノートのステージで行う)
+    props = movement_properties(results["location"])
+    print(f"移動統計: {len(props)} 日分")
+    return props
+
+def run_weather(first, last, results):
+    from update_weather import resolve_range_weather
+    places = results.get("places") or {}
+    return resolve_range_weather({day.isoformat(): places.get(day.isoformat()) for day in daterange(first, last)})
+
+def run_note(first, last, results):
+    from exportDailyNote import update_daily_notes
+    succeeded, failed, missing = update_daily_notes(
+        results.get("places") or {}, results.get("chrome") or {}, results.get("weather") or {},
+        results.get("movement") or {},
     )
-    print(result.stdout)
-    logging.info(result.stdout.strip())
-    if result.returncode != 0:
-        print(f"Error in {script}: {result.stderr}")
-        logging.error(f"Error in {script}: {result.stderr}")
-        break
+    if failed:
+        return False
+    # 日次の実行でノートがない場合は失敗とする (期間の場合はノートのない日があってもよい)
+    return succeeded > 0 or first != last
+
+def run_index(first, last, results):
+    from search_index import update_index
+    # データストアで更新された日の分だけを登録する (前回までに失敗した日の分もここで追いつく)
+    print(f"検索索引に登録: {update_index()} 件")
+    return True
+
+def build_stages(first, last):
+    """
+    処理のステージと依存関係。
+    バックアップ・Chrome 履歴・位置情報 (→ 場所情報) は互いに独立しているため並列に実行し、
+    デイリーノートを書き換えるステージはバックアップの後に実行する (移動統計・天気も計算だけを行い、
+    デイリーノートのステージで各日のノートを 1 回だけ書き込む)。
+    検索索引は Chrome 履歴・場所情報の保存後に更新する。デイリーノートのステージは保持期間を過ぎた日を
+    データストアから削除するため、検索索引の更新後に実行する。
+    """
+    def bind(func):
+        return lambda results: func(first, last, results)
+
+    return [
+        Stage("backup", bind(run_backup)),
+        Stage("chrome", bind(run_chrome)),
+        Stage("location", bind(run_location)),
+        Stage("places", bind(run_places), requires=["location"]),
+        Stage("movement", bind(run_movement), requires=["location"]),
+        Stage("weather", bind(run_weather), after=["places"]),
+        Stage("note", bind(run_note), after=["backup", "chrome", "places", "movement", "weather", "index"]),
+        Stage("index", bind(run_index), after=["chrome", "places"]),
+    ]
+
+def main():
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    parser = argparse.ArgumentParser(description="日次処理を実行する (--from / --to で期間をまとめて処理する)")
+    parser.add_argument("--from", dest="date_from", help="バックフィルの開始日 (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", help="バックフィルの終了日 (YYYY-MM-DD、省略時は昨日)")
+    args = parser.parse_args()
+
+    try:
+        first = datetime.date.fromisoformat(args.date_from) if args.date_from else yesterday
+        last = datetime.date.fromisoformat(args.date_to) if args.date_to else yesterday
+    except ValueError:
+        print("エラー: 日付の形式が正しくありません。YYYY-MM-DD で指定してください。")
+        sys.exit(2)
+    if first > last:
+        print("エラー: 開始日が終了日より後になっています。")
+        sys.exit(2)
+
+    if first == last:
+        print(f"処理対象日: {first}")
+        logging.info(f"Target day: {first}")
     else:
-        print(f"Completed {script}")
-        logging.info(f"Completed {script}")
+        print(f"処理対象期間: {first} - {last} ({(last - first).days + 1} 日)")
+        logging.info(f"Target range: {first} - {last}")
+
+    run_metrics = RunMetrics(first if first == last else f"{first}..{last}")
+    status, _ = run_stages(build_stages(first, last), run_metrics=run_metrics)
+    try:
+        run_metrics.save()
+    except OSError as e:
+        print(f"警告: 計測結果の保存に失敗しました: {e}")
+
+    failed = [name for name, s in status.items() if s != "ok"]
+    if failed:
+        print(f"Completed with errors: {', '.join(failed)}")
+        logging.error(f"Completed with errors: {', '.join(failed)}")
+        sys.exit(1)
+    print("All scripts completed.")
+    logging.info("All scripts completed.")
 
-print("All scripts completed.")
-logging.info("All scripts completed.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+パイプラインのステージごとの計測値 (処理時間・CPU 時間・メモリ・件数・API 呼び出し・キャッシュ・読み書き量) を記録するモジュール。
+実行ごとに 1 行の JSON を pipeline_metrics.jsonl に追記し、`uv run metrics.py` で推移と悪化を表示する。
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import statistics
+from collections import Counter
+
+METRICS_PATH = os.getenv("PIPELINE_METRICS_PATH", "pipeline_metrics.jsonl")
+
+# 悪化とみなす倍率 (直近の実行が過去の中央値の何倍を超えたら警告するか)
+REGRESSION_RATIO = 1.5
+# 短い処理のぶれを警告しないための下限 (秒)
+REGRESSION_MIN_SECONDS = 1.0
+
+_local = threading.local()
+
+# --- ステージ内からの記録 ---
+
+def count(name, n=1):
+    """
+    実行中のステージのカウンター (api_calls, cache_hits など) を加算する。
+    ステージ内で起動したワーカースレッドからは、bind で包んだ関数の中で呼んだ場合に記録される。
+    パイプラインの外 (スクリプト単体の実行) から呼んだ場合は何もしない。
+    """
+    meter = getattr(_local, "meter", None)
+    if meter is not None:
+        with meter.lock:
+            meter.counters[name] += n
+
+def bind(func):
+    """
+    ワーカースレッドで実行する関数を、呼び出し元のステージのカウンターに記録するよう包む。
+    ステージの外で呼んだ場合は func をそのまま返す。
+    """
+    meter = getattr(_local, "meter", None)
+    if meter is None:
+        return func
+
+    def run(*args, **kwargs):
+        previous = getattr(_local, "meter", None)
+        _local.meter = meter
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.meter = previous
+    return run
+
+def peak_rss_bytes():
+    """プロセス全体の最大メモリ使用量 (バイト)。取得できない場合は None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux は KB、macOS はバイト単位
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except (AttributeError, OSError):
+        pass
+    return None
+
+class StageMeter:
+    """
+    ステージ 1 回分の計測。ステージを実行するスレッドで with 文として使う。
+    カウンターはステージごとに 1 つで、ワーカースレッドからの加算はロックで保護する (bind を参照)。
+    cpu_seconds はステージのスレッドの CPU 時間 (ステージ内で起動したワーカースレッドの分は含まない)。
+    最大メモリはプロセス全体で増える一方の値で、並列に実行している他のステージの分も含むため、
+    ステージごとには記録せず実行全体 (RunMetrics) でのみ記録する。
+    入れ子にした場合は、内側の計測が終わると外側の計測に戻る。
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.result = {}
+
+    def __enter__(self):
+        self._wall = time.monotonic()
+        self._cpu = time.thread_time()
+        self._previous = getattr(_local, "meter", None)
+        _local.meter = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.meter = self._previous
+        self.result.update({
+            "wall_seconds": round(time.monotonic() - self._wall, 3),
+            "cpu_seconds": round(time.thread_time() - self._cpu, 3),
+        })
+        with self.lock:
+            self.result.update(self.counters)
+        return False
+
+class RunMetrics:
+    """パイプライン 1 回分の計測値をまとめ、JSON Lines に追記する"""
+
+    def __init__(self, day=None):
+        self.started = time.time()
+        self._wall = time.monotonic()
+        self._cpu = time.process_time()
+        self.day = str(day) if day else None
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, status, values):
+        with self._lock:
+            self.stages[name] = {"status": status, **values}
+
+    def to_dict(self):
+        return {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "day": self.day,
+            "wall_seconds": round(time.monotonic() - self._wall, 3),
+            "cpu_seconds": round(time.process_time() - self._cpu, 3),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "stages": self.stages,
+        }
+
+    def save(self, path=METRICS_PATH):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":")) + "\n")
+
+# --- レポート ---
+
+def load_runs(path=METRICS_PATH):
+    runs = []
+    if not os.path.exists(path):
+        return runs
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                runs.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return runs
+
+def find_regressions(runs, ratio=REGRESSION_RATIO, min_seconds=REGRESSION_MIN_SECONDS):
+    """
+    直近の実行と、それ以前の実行の中央値を比べ、悪化したステージの計測値を返す。
+    最大メモリはプロセス全体の値のため、ステージごとではなく実行全体 (ステージ名 "run") で比べる。
+    戻り値は [(ステージ名, 項目, 直近の値, 過去の中央値)]
+    """
+    if len(runs) < 2:
+        return []
+    latest, history = runs[-1], runs[:-1]
+    found = []
+    current = latest.get("peak_rss_bytes")
+    past = [r["peak_rss_bytes"] for r in history if r.get("peak_rss_bytes") is not None]
+    if current is not None and past:
+        median = statistics.median(past)
+        if median > 0 and current > median * ratio:
+            found.append(("run", "peak_rss_bytes", current, median))
+    for name, values in latest.get("stages", {}).items():
+        if values.get("status") != "ok":
+            continue
+        for key in ("wall_seconds", "cpu_seconds"):
+            current = values.get(key)
+            past = [r["stages"][name][key] for r in history
+                    if r.get("stages", {}).get(name, {}).get("status") == "ok"
+                    and r["stages"][name].get(key) is not None]
+            if current is None or not past:
+                continue
+            median = statistics.median(past)
+            if key.endswith("_seconds") and current < min_seconds:
+                continue
+            if median > 0 and current > median * ratio:
+                found.append((name, key, current, median))
+    return found
+
+def _format(key, value):
+    if value is None:
+        return "-"
+    if key.endswith("_bytes"):
+        return f"{value / 1024 / 1024:.1f}MB"
+    if key.endswith("_seconds"):
+        return f"{value:.2f}s"
+    return str(value)
+
+def print_report(runs, last=10, ratio=REGRESSION_RATIO, path=METRICS_PATH):
+    """ステージごとの直近の推移と、悪化したステージを表示する"""
+    if not runs:
+        print(f"計測結果がありません: {path}")
+        return
+    recent = runs[-last:]
+    print(f"直近 {len(recent)} 回の実行 (全 {len(runs)} 回)")
+    print(f"{'実行日時':<20} {'対象日':<11} {'時間':>8} {'CPU':>8} {'メモリ':>9}  失敗")
+    for r in recent:
+        failed = [n for n, v in r.get("stages", {}).items() if v.get("status") != "ok"]
+        print(f"{r.get('started_at', ''):<20} {r.get('day') or '':<11} "
+              f"{_format('wall_seconds', r.get('wall_seconds')):>8} {_format('cpu_seconds', r.get('cpu_seconds')):>8} "
+              f"{_format('peak_rss_bytes', r.get('peak_rss_bytes')):>9}  {', '.join(failed)}")
+
+    names = list(dict.fromkeys(n for r in recent for n in r.get("stages", {})))
+    print("\nステージごとの処理時間 (古い順)")
+    for name in names:
+        values = [r.get("stages", {}).get(name, {}) for r in recent]
+        times = " ".join(_format("wall_seconds", v.get("wall_seconds")) if v.get("status") == "ok" else "×" for v in values)
+        latest = values[-1]
+        extra = ", ".join(
+            f"{k}={v}" for k, v in latest.items()
+            if k not in ("status", "wall_seconds", "cpu_seconds", "peak_rss_bytes")
+        )
+        print(f"  {name:<10} {times}")
+        if extra:
+            print(f"  {'':<10} 直近: {extra}")
+
+    regressions = find_regressions(runs, ratio)
+    if regressions:
+        print(f"\n警告: 過去の中央値の {ratio} 倍を超えた項目があります")
+        for name, key, current, median in regressions:
+            print(f"  {name}.{key}: {_format(key, current)} (中央値 {_format(key, median)})")
+    else:
+        print("\n悪化した項目はありません。")
+
+def main():
+    parser = argparse.ArgumentParser(description="パイプラインの計測結果の推移と悪化を表示する")
+    parser.add_argument("--last", type=int, default=10, help="表示する実行回数 (既定 10)")
+    parser.add_argument("--ratio", type=float, default=REGRESSION_RATIO, help=f"悪化とみなす倍率 (既定 {REGRESSION_RATIO})")
+    parser.add_argument("--path", default=METRICS_PATH, help="計測結果のファイル")
+    args = parser.parse_args()
+
+    runs = load_runs(args.path)
+    print_report(runs, args.last, args.ratio, args.path)
+    if find_regressions(runs, args.ratio):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+タイムラインの移動 (activity) と経路 (timelinePath) から 1 日の移動統計を計算し、
+デイリーノートのプロパティに書き込むスクリプト。
+期間を指定すると、既存のデイリーノートにまとめて書き込む (バックフィル)。
+パイプライン (main.py) では movement_properties で計算だけを行い、書き込みはデイリーノートのステージで行う。
+"""
+
+import os
+import math
+import argparse
+from array import array
+from itertools import accumulate, repeat
+from operator import add, mul, sub, truediv
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from dotenv import load_dotenv
+
+from exportDailyLocation import JST, parse_dt, open_source, read_days
+from location_points import E7, parse_point, to_unix_ms, import_segments, query_range
+from daily_note import DailyNote
+
+# --- 設定読み込み ---
+
+SCRIPT_DIR = Path(__file__).parent
+env_path = SCRIPT_DIR / ".env"
+load_dotenv(env_path)
+
+# 環境変数を展開する関数
+def expand_env_path(path_str):
+    if not path_str:
+        return None
+    expanded = os.path.expandvars(path_str)
+    return Path(expanded)
+
+# 設定の取得と展開
+_vault_path_raw = expand_env_path(os.getenv("VAULT_PATH"))
+if not _vault_path_raw:
+    raise ValueError("エラー: .envファイルに 'VAULT_PATH' が設定されていません。")
+VAULT_PATH: Path = _vault_path_raw
+
+daily_folder_raw = os.getenv("DAILY_NOTE_FOLDER", "")
+DAILY_NOTE_FOLDER_STR = os.path.expandvars(daily_folder_raw)
+
+EARTH_RADIUS_M = 6_371_008.8
+
+# 移動手段の表示名 (タイムラインの種別を小文字・空白区切りにしたもの)
+TRANSPORT_LABELS = {
+    "walking": "徒歩",
+    "on foot": "徒歩",
+    "running": "ランニング",
+    "cycling": "自転車",
+    "in passenger vehicle": "車",
+    "driving": "車",
+    "in taxi": "車",
+    "motorcycling": "バイク",
+    "in bus": "バス",
+    "in train": "電車",
+    "in subway": "電車",
+    "in tram": "電車",
+    "in ferry": "船",
+    "flying": "飛行機",
+}
+
+# 移動手段ごとの時間のプロパティ名の接頭辞と、取りうる移動手段の表示名 (transport_label の戻り値)
+MODE_PROPERTY_PREFIX = "移動時間_"
+MODE_LABELS = tuple(dict.fromkeys([*TRANSPORT_LABELS.values(), "その他"]))
+
+# --- 関数定義 ---
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """
+    緯度経度の列同士の距離 (m) をまとめて計算し、array('d') で返す (列は配列・イテレーターのどちらでもよい)。
+    numpy は依存に含めていないため、math と operator の組み込み関数を map で連結して列全体に適用する。
+    点ごとの Python のループ (バイトコードの実行) はなく、反復は C の中で行われる。
+    各要素の計算は Python の浮動小数点数で行うため numpy のベクトル演算の数十倍の時間がかかる (100 万点で約 1.5 秒) が、
+    1 日分 (数千点) なら数ミリ秒で終わり、依存を増やさずに済む。
+    """
+    phi1 = array("d", map(math.radians, lat1))
+    phi2 = array("d", map(math.radians, lat2))
+    lam1 = map(math.radians, lon1)
+    lam2 = map(math.radians, lon2)
+    sin_dphi = map(math.sin, map(mul, map(sub, phi2, phi1), repeat(0.5)))
+    sin_dlam = map(math.sin, map(mul, map(sub, lam2, lam1), repeat(0.5)))
+    cos_cos = map(mul, map(math.cos, phi1), map(math.cos, phi2))
+    h = map(add, map(pow, sin_dphi, repeat(2)), map(mul, cos_cos, map(pow, sin_dlam, repeat(2))))
+    return array("d", map(mul, map(math.asin, map(math.sqrt, map(min, h, repeat(1.0)))), repeat(2 * EARTH_RADIUS_M)))
+
+def _lat_lng(value):
+    """"geo:..." 文字列または {"latLng": "..."} から座標を取り出す"""
+    if isinstance(value, dict):
+        value = value.get("latLng")
+    if not value:
+        return None
+    try:
+        return parse_point(value)
+    except ValueError:
+        return None
+
+def transport_label(activity):
+    kind = activity.get("topCandidate", {}).get("type", "")
+    kind = kind.lower().replace("_", " ")
+    return TRANSPORT_LABELS.get(kind, "その他")
+
+def build_track(segments, day_start, day_end):
+    """
+    対象日の点列 (時刻ミリ秒, 緯度, 経度) を時刻順に作成する。
+    timelinePath の点は列指向の保存先 (location_points.py) から query_range で配列のまま読み込み、
+    visit の場所と activity の始点・終点 (1 セグメントに数点) だけをセグメントから加える。
+    """
+    lo = to_unix_ms(day_start)
+    hi = to_unix_ms(day_end)
+    anchors = []
+    for seg in segments:
+        if "startTime" not in seg or "endTime" not in seg:
+            continue
+        start_ms = to_unix_ms(parse_dt(seg["startTime"]))
+        end_ms = to_unix_ms(parse_dt(seg["endTime"]))
+
+        if "visit" in seg:
+            loc = _lat_lng(seg["visit"].get("topCandidate", {}).get("placeLocation"))
+            if loc:
+                anchors.append((start_ms, *loc))
+                anchors.append((end_ms, *loc))
+        if "activity" in seg:
+            for key, ts in (("start", start_ms), ("end", end_ms)):
+                loc = _lat_lng(seg["activity"].get(key))
+                if loc:
+                    anchors.append((ts, *loc))
+    anchors = [p for p in anchors if lo <= p[0] < hi]
+
+    # 距離の計算は列単位で行うため、保存先の列 (緯度・経度は度 × 1e7 の整数) を度の型付き配列に変換して使う
+    columns = query_range(day_start, day_end)
+    ts = columns["timestamp"] + array("q", (p[0] for p in anchors))
+    lat = array("d", map(truediv, columns["lat"], repeat(E7))) + array("d", (p[1] for p in anchors))
+    lon = array("d", map(truediv, columns["lon"], repeat(E7))) + array("d", (p[2] for p in anchors))
+    if anchors:
+        # 保存先の点は時刻順のため、セグメントの点を加えた場合だけ並べ替える
+        order = sorted(range(len(ts)), key=ts.__getitem__)
+        ts = array("q", map(ts.__getitem__, order))
+        lat = array("d", map(lat.__getitem__, order))
+        lon = array("d", map(lon.__getitem__, order))
+    return ts, lat, lon
+
+def compute_movement_stats(segments, day_start, day_end):
+    """
+    1 日分のセグメントから移動統計を計算する。
+    総移動距離・移動手段ごとの時間・最長の移動・行動半径 (重心から最も遠い点までの距離) を返す。
+    """
+    ts, lat, lon = build_track(segments, day_start, day_end)
+
+    # 点列全体の距離を一括計算し、累積距離から各移動区間の距離を求める
+    steps = haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:]) if len(lat) > 1 else []
+    cumulative = list(accumulate(steps, initial=0.0))
+    total_m = cumulative[-1]
+
+    mode_minutes = {}
+    longest = None
+    for seg in segments:
+        if "activity" not in seg or "startTime" not in seg or "endTime" not in seg:
+            continue
+        st = max(parse_dt(seg["startTime"]), day_start)
+        en = min(parse_dt(seg["endTime"]), day_end)
+        if en <= st:
+            continue
+
+        label = transport_label(seg["activity"])
+        mode_minutes[label] = mode_minutes.get(label, 0.0) + (en - st).total_seconds() / 60
+
+        i = bisect_left(ts, to_unix_ms(st))
+        j = bisect_right(ts, to_unix_ms(en)) - 1
+        distance = cumulative[j] - cumulative[i] if j > i else 0.0
+        if longest is None or distance > longest["distance_m"]:
+            longest = {"distance_m": distance, "start": st, "end": en, "mode": label}
+
+    radius_m = 0.0
+    if lat:
+        c_lat = math.fsum(lat) / len(lat)
+        c_lon = math.fsum(lon) / len(lon)
+        radius_m = max(haversine_m(repeat(c_lat, len(lat)), repeat(c_lon, len(lon)), lat, lon))
+
+    return {
+        "points": len(ts),
+        "total_m": total_m,
+        "mode_minutes": mode_minutes,
+        "longest": longest,
+        "radius_m": radius_m,
+    }
+
+def stats_to_properties(stats):
+    """移動統計をデイリーノートのプロパティ (順序付き) に変換する"""
+    props = {
+        "移動距離": round(stats["total_m"] / 1000, 2),
+        "行動半径": round(stats["radius_m"] / 1000, 2),
+    }
+    longest = stats["longest"]
+    if longest:
+        props["最長移動"] = round(longest["distance_m"] / 1000, 2)
+        props["最長移動区間"] = f"{longest['start'].strftime('%H:%M')} - {longest['end'].strftime('%H:%M')} ({longest['mode']})"
+    for label, minutes in sorted(stats["mode_minutes"].items(), key=lambda x: -x[1]):
+        props[f"{MODE_PROPERTY_PREFIX}{label}"] = round(minutes)
+    # 以前の実行で書き込んだ、今回の結果にない移動手段のプロパティは削除する (値が None のキーは削除される)
+    for label in MODE_LABELS:
+        props.setdefault(f"{MODE_PROPERTY_PREFIX}{label}", None)
+    return props
+
+def day_properties(day_str, segments):
+    """1 日分のセグメントから移動統計を計算し、(統計, プロパティ) を返す。点がない日は (統計, None)"""
+    day_start = datetime.combine(date.fromisoformat(day_str), time.min).replace(tzinfo=JST)
+    stats = compute_movement_stats(segments, day_start, day_start + timedelta(days=1))
+    if stats["points"] == 0:
+        return stats, None
+    return stats, stats_to_properties(stats)
+
+def movement_properties(segments_by_day):
+    """
+    日ごとのセグメント ({日付文字列: セグメントのリスト}) から、各日のプロパティ ({日付文字列: プロパティ}) を返す。
+    パイプラインでは位置情報のステージが読み込んだセグメントを受け取り、結果はデイリーノートのステージで書き込む。
+    経路の点は先に列指向の保存先に取り込み (既存の点とは時刻で重複を除く)、各日の計算ではそこから読み込む。
+    """
+    import_segments(seg for segments in segments_by_day.values() for seg in segments)
+    props_by_day = {}
+    for day_str, segments in segments_by_day.items():
+        _, props = day_properties(day_str, segments)
+        if props:
+            props_by_day[day_str] = props
+    return props_by_day
+
+def write_note_properties(note_path, props):
+    """ノートのプロパティを更新する。内容が変わらない場合は書き込まない"""
+    note = DailyNote(note_path)
+    note.set_properties(props)
+    return note.save()
+
+def daterange(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+def write_movement_stats(first, last):
+    """
+    first〜last の各日の移動統計を計算し、既存のデイリーノートに書き込む (単体で実行する場合)。成功した場合は True
+    """
+    input_path = os.getenv("LOCATION_HISTORY_PATH")
+    if not input_path:
+        print("エラー: 環境変数 'LOCATION_HISTORY_PATH' が設定されていません。")
+        return False
+    input_path = os.path.expandvars(input_path)
+
+    print(f"移動統計を計算中: {first} - {last}")
+    local_copy_path = os.path.join(os.path.dirname(__file__), "local_location_history.json")
+    written = 0
+    skipped = 0
+    copied = False
+    try:
+        note_paths = {}
+        for day in daterange(first, last):
+            note_path = VAULT_PATH / DAILY_NOTE_FOLDER_STR / f"{day.isoformat()}.md"
+            if note_path.exists():
+                note_paths[day.isoformat()] = note_path
+            else:
+                skipped += 1
+        source_stat = os.stat(input_path)
+        source, copied = open_source(input_path, local_copy_path)
+        with source:
+            # 日付インデックスを使い、ノートのある日のセグメントだけを読み込む
+            _, segments_by_day = read_days(source, input_path, source_stat, list(note_paths))
+            import_segments(seg for segments in segments_by_day.values() for seg in segments)
+            for day_str, note_path in note_paths.items():
+                stats, props = day_properties(day_str, segments_by_day[day_str])
+                if not props:
+                    skipped += 1
+                    continue
+
+                if write_note_properties(note_path, props):
+                    written += 1
+                if first == last:
+                    print(f"移動距離: {stats['total_m'] / 1000:.2f} km / 行動半径: {stats['radius_m'] / 1000:.2f} km")
+    except (IOError, ValueError) as e:
+        print(f"エラー: 移動統計の計算に失敗しました: {e}")
+        return False
+    finally:
+        if copied and os.path.exists(local_copy_path):
+            os.remove(local_copy_path)
+
+    print(f"完了: 更新 {written} 件 / スキップ (ノートまたはデータなし) {skipped} 件")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="タイムラインから移動統計を計算し、デイリーノートのプロパティに書き込む")
+    parser.add_argument("day", nargs="?", help="対象日 (YYYY-MM-DD)。指定しない場合は昨日が対象になります。")
+    parser.add_argument("--from", dest="date_from", help="バックフィルの開始日 (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", help="バックフィルの終了日 (YYYY-MM-DD、省略時は昨日)")
+    args = parser.parse_args()
+
+    yesterday = (datetime.now(JST) - timedelta(days=1)).date()
+    try:
+        if args.date_from:
+            first = datetime.strptime(args.date_from, "%Y-%m-%d").date()
+            last = datetime.strptime(args.date_to, "%Y-%m-%d").date() if args.date_to else yesterday
+        else:
+            first = last = datetime.strptime(args.day, "%Y-%m-%d").date() if args.day else yesterday
+    except ValueError:
+        print("エラー: 日付の形式が正しくありません。YYYY-MM-DD で指定してください。")
+        return
+
+    write_movement_stats(first, last)
+
+if __name__ == "__main__":
+    main()
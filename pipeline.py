@@ -0,0 +1,128 @@
+"""
+処理 (ステージ) の依存関係を宣言し、1 つのプロセス内で実行するモジュール。
+依存関係のないステージは並列に実行し、失敗したステージに依存するステージだけをスキップする。
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from metrics import StageMeter
+
+
+class Stage:
+    """
+    パイプラインの 1 ステージ。
+    func は依存先の結果 ({ステージ名: 結果}) を受け取り、次のステージに渡す結果を返す。
+    例外を送出するか False を返した場合は失敗とみなす。
+
+    requires: 結果が必要なステージ。失敗・スキップした場合はこのステージもスキップする
+    after: 完了を待つだけのステージ。失敗していても実行する (成功した場合のみ結果を受け取る)
+    """
+
+    def __init__(self, name, func, requires=(), after=()):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.after = tuple(after)
+
+    @property
+    def depends_on(self):
+        return self.requires + self.after
+
+
+def _check_stages(stages):
+    """未定義のステージへの依存・循環依存がないか確認する"""
+    by_name = {s.name: s for s in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("ステージ名が重複しています。")
+    for s in stages:
+        unknown = [d for d in s.depends_on if d not in by_name]
+        if unknown:
+            raise ValueError(f"ステージ {s.name} の依存先が見つかりません: {', '.join(unknown)}")
+
+    visiting, done = set(), set()
+
+    def visit(name, path):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"ステージの依存関係が循環しています: {' -> '.join(path + [name])}")
+        visiting.add(name)
+        for dep in by_name[name].depends_on:
+            visit(dep, path + [name])
+        visiting.discard(name)
+        done.add(name)
+
+    for s in stages:
+        visit(s.name, [])
+
+
+def run_stages(stages, max_workers=None, run_metrics=None):
+    """
+    ステージを依存関係の順に実行する。実行可能になったステージから並列に実行する。
+    run_metrics (metrics.RunMetrics) を渡すと、ステージごとの計測値を記録する。
+    戻り値は ({ステージ名: "ok" / "failed" / "skipped"}, {ステージ名: 結果})
+    """
+    _check_stages(stages)
+    pending = {s.name: s for s in stages}
+    status = {}
+    results = {}
+    running = {}
+
+    def execute(stage, inputs):
+        logging.info(f"Running {stage.name}...")
+        print(f"Running {stage.name}...")
+        error = None
+        result = None
+        with StageMeter(stage.name) as meter:
+            try:
+                result = stage.func(inputs)
+            except Exception as e:
+                error = e
+        return result, error, meter.result
+
+    def finish(name, state, values):
+        status[name] = state
+        if run_metrics is not None:
+            run_metrics.add_stage(name, state, values)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages)) as pool:
+        while pending or running:
+            # 依存先がすべて終わったステージを開始する
+            for name, stage in list(pending.items()):
+                if not all(d in status for d in stage.depends_on):
+                    continue
+                del pending[name]
+                failed = [d for d in stage.requires if status[d] != "ok"]
+                if failed:
+                    finish(name, "skipped", {})
+                    print(f"Skipped {name} ({', '.join(failed)} が完了しなかったため)")
+                    logging.warning(f"Skipped {name}: {', '.join(failed)} did not complete")
+                    continue
+                inputs = {d: results[d] for d in stage.depends_on if status[d] == "ok"}
+                running[pool.submit(execute, stage, inputs)] = name
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                result, error, values = future.result()
+                elapsed = values["wall_seconds"]
+                if error is not None:
+                    finish(name, "failed", values)
+                    print(f"Error in {name}: {error!r}")
+                    logging.error(f"Error in {name}", exc_info=error)
+                    continue
+                if result is False:
+                    finish(name, "failed", values)
+                    print(f"Error in {name}")
+                    logging.error(f"Error in {name}")
+                    continue
+                finish(name, "ok", values)
+                results[name] = result
+                print(f"Completed {name} ({elapsed:.1f} 秒)")
+                logging.info(f"Completed {name} ({elapsed:.1f}s)")
+
+    return status, results
@@ -0,0 +1,257 @@
+"""
+閲覧履歴 (タイトル・URL) と訪れた場所 (名前・住所) を訪問日時とともに全文検索するための索引。
+SQLite の FTS5 (trigram) で索引を作り、キーワードと期間で検索する。
+索引はデータストア (daily_store.py) で更新された日の分だけを差分で更新する。
+"""
+
+import os
+import sqlite3
+import argparse
+import datetime
+from pathlib import Path
+from dotenv import load_dotenv
+
+import daily_store
+import metrics
+
+# --- 設定読み込み ---
+
+SCRIPT_DIR = Path(__file__).parent
+env_path = SCRIPT_DIR / ".env"
+load_dotenv(env_path)
+
+_index_raw = os.getenv("SEARCH_INDEX_PATH")
+SEARCH_INDEX_PATH = os.path.expandvars(_index_raw) if _index_raw else "search_index.sqlite3"
+
+# 索引の対象とする取得元と表示名
+KINDS = {daily_store.HISTORY: "閲覧", daily_store.PLACES: "場所"}
+
+# trigram は 3 文字以上の語だけを索引で検索できる (短い語は LIKE で絞り込む)
+TRIGRAM_MIN_LENGTH = 3
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# --- 関数定義 ---
+
+def open_index(path=None):
+    """索引を開く (なければ作成する)"""
+    conn = sqlite3.connect(path or SEARCH_INDEX_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            day TEXT NOT NULL,
+            time TEXT NOT NULL,      -- 訪問 (滞在) の開始日時 (YYYY-MM-DD HH:MM:SS)
+            end_time TEXT,           -- 滞在の終了日時 (場所のみ)
+            title TEXT NOT NULL,     -- ページのタイトル / 場所の名前
+            detail TEXT NOT NULL,    -- URL / 住所
+            extra TEXT               -- 取得元のプロファイル / placeID
+        );
+        CREATE INDEX IF NOT EXISTS entries_kind_day ON entries (kind, day);
+        CREATE INDEX IF NOT EXISTS entries_time ON entries (time);
+        CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+            title, detail, content='entries', content_rowid='id', tokenize='trigram'
+        );
+        CREATE TABLE IF NOT EXISTS indexed_days (
+            kind TEXT NOT NULL,
+            day TEXT NOT NULL,
+            updated_at TEXT NOT NULL,  -- 索引に取り込んだ時点のデータストアの更新日時 (アーカイブから取り込んだ場合は "archive")
+            PRIMARY KEY (kind, day)
+        );
+    """)
+    return conn
+
+def _local_time(iso_str):
+    """ISO 形式の日時を、その地域の時刻の "YYYY-MM-DD HH:MM:SS" に変換する。変換できない場合は None"""
+    try:
+        return datetime.datetime.fromisoformat(iso_str).strftime(TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+def history_rows(items):
+    """閲覧履歴 (getChromeHistory.py の出力) から (日時, 終了日時, タイトル, URL, 取得元) を返す"""
+    for item in items:
+        url = item.get("url")
+        visit_time = item.get("visit_time")
+        if not url or not visit_time:
+            continue
+        yield visit_time, None, item.get("title") or url, url, item.get("source")
+
+def place_rows(items):
+    """場所情報 (getLocationData.py の出力) から名前の分かった訪問の (日時, 終了日時, 名前, 住所, placeID) を返す"""
+    for entry in items:
+        candidate = entry.get("visit", {}).get("topCandidate", {})
+        name = candidate.get("name")
+        start = _local_time(entry.get("startTime"))
+        if not name or name == "不明な場所" or not start:
+            continue
+        yield (start, _local_time(entry.get("endTime")), name, candidate.get("formatted_address", ""),
+               candidate.get("placeID") or candidate.get("matchedPlaceID"))
+
+ROW_BUILDERS = {daily_store.HISTORY: history_rows, daily_store.PLACES: place_rows}
+
+def index_days(conn, kind, items_by_day, updated_at):
+    """日ごとのデータ ({日付文字列: 要素のリスト}) を索引に登録する。既にある日の分は置き換える"""
+    added = 0
+    with conn:
+        for day, items in items_by_day.items():
+            # 外部コンテンツの FTS は、削除する行の内容を指定して索引から取り除く
+            conn.execute("""
+                INSERT INTO entries_fts (entries_fts, rowid, title, detail)
+                SELECT 'delete', id, title, detail FROM entries WHERE kind = ? AND day = ?
+            """, (kind, day))
+            conn.execute("DELETE FROM entries WHERE kind = ? AND day = ?", (kind, day))
+            rows = [(kind, day, *row) for row in ROW_BUILDERS[kind](items)]
+            conn.executemany(
+                "INSERT INTO entries (kind, day, time, end_time, title, detail, extra) VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            conn.execute("""
+                INSERT INTO entries_fts (rowid, title, detail)
+                SELECT id, title, detail FROM entries WHERE kind = ? AND day = ?
+            """, (kind, day))
+            added += len(rows)
+            conn.execute("INSERT OR REPLACE INTO indexed_days VALUES (?, ?, ?)", (kind, day, updated_at))
+    return added
+
+def update_index(conn=None):
+    """
+    データストアで前回から追加・更新された日の分だけを索引に登録する。
+    戻り値は登録した件数
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = open_index()
+    total = 0
+    store = daily_store.open_store()
+    try:
+        for kind in KINDS:
+            indexed = dict(conn.execute("SELECT day, updated_at FROM indexed_days WHERE kind = ?", (kind,)))
+            changed = {}
+            for day, updated_at in daily_store.stored_days(kind, store).items():
+                if indexed.get(day) != updated_at:
+                    changed.setdefault(updated_at, []).append(day)
+            for updated_at, days in changed.items():
+                total += index_days(conn, kind, daily_store.get_days(kind, days, store), updated_at)
+    finally:
+        store.close()
+        if own_conn:
+            conn.close()
+    metrics.count("records_out", total)
+    return total
+
+def import_archive(conn=None):
+    """
+    月ごとのアーカイブ (daily_archive.py) にあり、索引にまだない日を登録する。
+    データストアより前の履歴を検索できるようにするためのもの。戻り値は登録した件数
+    """
+    import daily_archive
+
+    own_conn = conn is None
+    if own_conn:
+        conn = open_index()
+    total = 0
+    try:
+        indexed = set(conn.execute("SELECT kind, day FROM indexed_days"))
+        for path in sorted(daily_archive.ARCHIVE_DIR.glob(f"*{daily_archive.ARCHIVE_SUFFIX}")):
+            for day, counts in daily_archive.list_days(path.stem).items():
+                kinds = [k for k in KINDS if k in counts and (k, day) not in indexed]
+                if not kinds:
+                    continue
+                data = daily_archive.read_day(day, kinds)
+                for kind in kinds:
+                    total += index_days(conn, kind, {day: data[kind]}, "archive")
+            print(f"アーカイブを索引に登録しました: {path.name}")
+    finally:
+        if own_conn:
+            conn.close()
+    return total
+
+def _fts_phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+def search(conn, terms, kinds=None, first=None, last=None, limit=50):
+    """
+    キーワード (すべてを含むもの) と期間で検索し、(一致した件数, 最初の日時, 最後の日時, 新しい順の結果) を返す。
+    結果は (種別, 日時, 終了日時, タイトル, URL/住所) のリスト
+    """
+    long_terms = [t for t in terms if len(t) >= TRIGRAM_MIN_LENGTH]
+    short_terms = [t for t in terms if len(t) < TRIGRAM_MIN_LENGTH]
+
+    where, params = [], []
+    if long_terms:
+        where.append("e.id IN (SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?)")
+        params.append(" AND ".join(_fts_phrase(t) for t in long_terms))
+    for t in short_terms:
+        where.append("(e.title LIKE ? ESCAPE '\\' OR e.detail LIKE ? ESCAPE '\\')")
+        pattern = "%" + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        params += [pattern, pattern]
+    if kinds:
+        where.append(f"e.kind IN ({', '.join('?' * len(kinds))})")
+        params += kinds
+    # 期間は日時の索引で絞り込む (終了日はその日の終わりまで含める)
+    if first:
+        where.append("e.time >= ?")
+        params.append(first)
+    if last:
+        where.append("e.time < ?")
+        params.append((datetime.date.fromisoformat(last) + datetime.timedelta(days=1)).isoformat())
+    clause = (" WHERE " + " AND ".join(where)) if where else ""
+
+    count, oldest, newest = conn.execute(
+        f"SELECT COUNT(*), MIN(e.time), MAX(e.time) FROM entries e{clause}", params
+    ).fetchone()
+    rows = conn.execute(
+        f"SELECT e.kind, e.time, e.end_time, e.title, e.detail FROM entries e{clause} ORDER BY e.time DESC LIMIT ?",
+        params + [limit],
+    ).fetchall()
+    return count, oldest, newest, rows
+
+def main():
+    parser = argparse.ArgumentParser(description="閲覧履歴と訪れた場所の検索索引の更新・検索")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_update = sub.add_parser("update", help="データストアで更新された日の分を索引に登録する")
+    p_update.add_argument("--archive", action="store_true", help="月ごとのアーカイブにある過去の日も登録する")
+
+    p_search = sub.add_parser("search", help="キーワードと期間で検索する (新しい順)")
+    p_search.add_argument("terms", nargs="*", help="キーワード (複数指定した場合はすべてを含むもの)")
+    p_search.add_argument("--from", dest="date_from", help="開始日 (YYYY-MM-DD)")
+    p_search.add_argument("--to", dest="date_to", help="終了日 (YYYY-MM-DD、この日を含む)")
+    p_search.add_argument("--kind", choices=list(KINDS), action="append", help="種別 (history / places)")
+    p_search.add_argument("--limit", type=int, default=20, help="表示する件数 (既定 20)")
+    args = parser.parse_args()
+
+    conn = open_index()
+    try:
+        if args.command == "update":
+            total = update_index(conn)
+            if args.archive:
+                total += import_archive(conn)
+            print(f"索引を更新しました: {total} 件")
+            return
+
+        for value in (args.date_from, args.date_to):
+            if value:
+                try:
+                    datetime.date.fromisoformat(value)
+                except ValueError:
+                    print("エラー: 日付の形式が正しくありません。YYYY-MM-DD で指定してください。")
+                    return
+
+        started = datetime.datetime.now()
+        count, oldest, newest, rows = search(conn, args.terms, args.kind, args.date_from, args.date_to, args.limit)
+        elapsed = (datetime.datetime.now() - started).total_seconds() * 1000
+
+        for kind, time, end_time, title, detail in rows:
+            span = f"{time[:16]} - {end_time[11:16]}" if end_time else time[:16]
+            print(f"{span:<24} [{KINDS[kind]}] {title}  {detail}")
+        if count:
+            print(f"\n{count:,} 件 (最初: {oldest} / 最後: {newest}) {elapsed:.1f} ms")
+        else:
+            print(f"該当なし ({elapsed:.1f} ms)")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
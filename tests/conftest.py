@@ -0,0 +1,123 @@
+"""
+テスト共通の設定。リポジトリ直下のスクリプトを読み込めるようにし、
+Places API / Open-Meteo の代わりにローカルのスタブサーバー (benchmark.py の StubHandler) を用意する。
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# 各スクリプトは読み込み時に設定を確認するため、先にテスト用の値を入れておく (.env より優先される)
+os.environ.setdefault("VAULT_PATH", tempfile.mkdtemp(prefix="vault_"))
+os.environ.setdefault("DAILY_NOTE_FOLDER", "")
+os.environ.setdefault("DEFAULT_LAT", "35.6812")
+os.environ.setdefault("DEFAULT_LON", "139.7671")
+
+import benchmark  # noqa: E402
+
+
+class RecordingStubHandler(benchmark.StubHandler):
+    """
+    受け取ったリクエストを記録し、failures に登録したステータスを先に返すスタブ。
+    failures: {パス: [ステータス, ...]} 。先頭から 1 つずつ返し、空になったら通常の応答を返す
+    """
+
+    failures = {}
+    requests = []
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        path = urlsplit(self.path).path
+        with cls.lock:
+            cls.requests.append((time.monotonic(), path, self.path))
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+            plan = cls.failures.get(path)
+            status = plan.pop(0) if plan else None
+        try:
+            if status is None:
+                super().do_GET()
+            else:
+                if self.latency:
+                    time.sleep(self.latency)
+                self._send_json({"error": f"stub {status}"}, status)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+
+class StubServer:
+    """起動中のスタブサーバー。url をベース URL として使う"""
+
+    def __init__(self, latency=0.0):
+        # テストごとに記録を分けるため、状態を持つクラスを毎回作る
+        handler = type("Handler", (RecordingStubHandler,), {
+            "failures": {}, "requests": [], "active": 0, "max_active": 0, "lock": threading.Lock(),
+        })
+        self.server, self.url = benchmark.start_stub_server(latency, handler)
+        # start_stub_server は latency を設定した派生クラスを作るため、そのクラスに記録が集まる
+        self.handler = self.server.RequestHandlerClass
+
+    @property
+    def requests(self):
+        return self.handler.requests
+
+    def fail(self, path, *statuses):
+        self.handler.failures.setdefault(path, []).extend(statuses)
+
+    def count(self, prefix=""):
+        return sum(1 for _, path, _ in self.handler.requests if path.startswith(prefix))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def slow_stub_server():
+    """1 リクエストに 0.2 秒かかるスタブ (並列に処理されているかの確認用)"""
+    server = StubServer(latency=0.2)
+    yield server
+    server.close()
+
+
+@pytest.fixture(autouse=True)
+def data_paths(monkeypatch, tmp_path):
+    """
+    キャッシュ・データストア・アーカイブの保存先を一時フォルダに向ける。
+    既定値は作業フォルダからの相対パスや .env の設定のため、そのままでは実際のキャッシュを書き換えてしまう
+    """
+    import update_weather
+    import getLocationData
+    import daily_store
+    import daily_archive
+    import exportDailyLocation
+    import location_points
+
+    monkeypatch.setattr(update_weather, "WEATHER_CACHE_DB", str(tmp_path / "weather_cache.sqlite3"))
+    monkeypatch.setattr(getLocationData, "CACHE_DB", str(tmp_path / "placeLocation.sqlite3"))
+    monkeypatch.setattr(getLocationData, "CACHE_CSV", str(tmp_path / "placeLocation.csv"))
+    # prune_store はデータストアから削除するため、実際のデータストアを開かないようにする
+    monkeypatch.setattr(daily_store, "DAILY_STORE_PATH", str(tmp_path / "daily_store.sqlite3"))
+    monkeypatch.setattr(daily_archive, "ARCHIVE_DIR", tmp_path / "archive")
+    monkeypatch.setattr(exportDailyLocation, "INDEX_PATH", str(tmp_path / "location_index.json"))
+    monkeypatch.setattr(location_points, "POINTS_DIR", tmp_path / "location_points")
@@ -0,0 +1,93 @@
+"""daily_archive.py のデータストアの整理 (保持期間を過ぎた日の削除) のテスト"""
+
+import os
+import stat
+import datetime
+
+import pytest
+
+import daily_archive
+import daily_store
+
+TODAY = datetime.date(2024, 5, 10)
+
+
+@pytest.fixture(autouse=True)
+def store_paths(tmp_path):
+    """データストアとアーカイブが一時フォルダにあること (conftest.py の data_paths) を確かめる"""
+    assert daily_store.DAILY_STORE_PATH == str(tmp_path / "daily_store.sqlite3")
+    assert daily_archive.ARCHIVE_DIR == tmp_path / "archive"
+
+
+def store_days(n):
+    """TODAY から遡って n 日分を全取得元に保存し、新しい順の日付のリストを返す"""
+    days = [(TODAY - datetime.timedelta(days=i)).isoformat() for i in range(n)]
+    for source in daily_store.SOURCES:
+        daily_store.put_days(source, {day: [{"source": source, "n": i}] * 3 for i, day in enumerate(days)})
+    return days
+
+
+def test_prunes_archived_days_before_the_retention_period():
+    days = store_days(40)
+    daily_archive.archive_days(days, quiet=True)
+
+    # 2024-04-09 (31 日前) より前の 8 日を削除する
+    assert daily_archive.prune_store(31, TODAY) == 8
+
+    for source in daily_store.SOURCES:
+        assert sorted(daily_store.stored_days(source)) == sorted(days[:32])
+    assert daily_archive.read_day(days[-1])[daily_store.PLACES] == [{"source": "places", "n": 39}] * 3
+
+
+def test_archives_missing_and_stale_days_before_pruning():
+    days = store_days(35)
+    daily_archive.archive_days(days[:33], quiet=True)
+    # アーカイブした後にデータストアの内容が変わった日
+    daily_store.put_day(daily_store.HISTORY, days[32], [{"changed": True}])
+
+    assert daily_archive.prune_store(31, TODAY) == 3
+
+    assert daily_archive.read_day(days[32], [daily_store.HISTORY]) == {daily_store.HISTORY: [{"changed": True}]}
+    assert daily_archive.read_day(days[34])[daily_store.LOCATION] == [{"source": "location", "n": 34}] * 3
+
+
+def test_keeps_days_that_fail_to_archive(monkeypatch):
+    days = store_days(33)
+    monkeypatch.setattr(daily_archive, "archive_days", lambda days, quiet=False: False)
+
+    assert daily_archive.prune_store(31, TODAY) == 0
+    assert len(daily_store.stored_days(daily_store.HISTORY)) == len(days)
+
+
+def test_zero_retention_keeps_everything():
+    days = store_days(40)
+    daily_archive.archive_days(days, quiet=True)
+
+    assert daily_archive.prune_store(0, TODAY) == 0
+    assert len(daily_store.stored_days(daily_store.HISTORY)) == 40
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Windows ではフォルダを fsync できない")
+def test_compact_syncs_the_new_file_before_replacing(monkeypatch):
+    days = store_days(3)
+    daily_archive.archive_days(days, quiet=True)
+    events = []
+    fsync, replace = os.fsync, os.replace
+
+    def record_fsync(fd):
+        st = os.fstat(fd)
+        events.append(("fsync", "dir" if stat.S_ISDIR(st.st_mode) else st.st_ino))
+        fsync(fd)
+
+    def record_replace(src, dst):
+        events.append(("replace", os.stat(src).st_ino))
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "fsync", record_fsync)
+    monkeypatch.setattr(os, "replace", record_replace)
+
+    daily_archive.compact(TODAY.strftime("%Y-%m"))
+
+    new_file = daily_archive.month_path(TODAY.strftime("%Y-%m")).stat().st_ino
+    assert events[-3:] == [("fsync", new_file), ("replace", new_file), ("fsync", "dir")]
+    assert daily_archive.read_day(days[0])[daily_store.HISTORY] == [{"source": "history", "n": 0}] * 3
@@ -0,0 +1,48 @@
+"""daily_note.py のセクションの追加・置き換えのテスト"""
+
+import daily_note
+
+BLOCK = "<!-- daily:訪れた場所 -->\n| n |\n<!-- /daily:訪れた場所 -->"
+
+
+def test_keeps_user_text_after_a_legacy_section():
+    content = "# day\n\n## 訪れた場所\n\n| a |\n\nmy own notes written later\n"
+
+    result = daily_note.upsert_section(content, "訪れた場所", "| n |", legacy_heading="## 訪れた場所")
+
+    assert result == f"# day\n\n{BLOCK}\n\nmy own notes written later\n"
+
+
+def test_replaces_a_whole_legacy_table():
+    content = (
+        "# day\n\n## 訪れた場所\n\n| 時間 | 場所 | 住所 |\n| :--- | :--- | :--- |\n"
+        "| 09:00 - 10:00 | **駅** | 東京 |\n\n## 閲覧履歴\n\n- (昨日の履歴はありません)\n"
+    )
+
+    result = daily_note.upsert_section(content, "訪れた場所", "| n |", legacy_heading="## 訪れた場所")
+
+    assert result == f"# day\n\n{BLOCK}\n\n## 閲覧履歴\n\n- (昨日の履歴はありません)\n"
+
+
+def test_removes_duplicated_legacy_sections_but_not_text_between_them():
+    content = "## 訪れた場所\n- (有効な移動履歴はありません)\nメモ\n\n## 訪れた場所\n\n| a |\n"
+
+    result = daily_note.upsert_section(content, "訪れた場所", "| n |", legacy_heading="## 訪れた場所")
+
+    assert result == f"{BLOCK}\n\nメモ\n"
+
+
+def test_replaces_an_existing_marked_section():
+    content = f"# day\n\n{BLOCK}\n\nafter\n"
+
+    result = daily_note.upsert_section(content, "訪れた場所", "| m |", legacy_heading="## 訪れた場所")
+
+    assert result == "# day\n\n<!-- daily:訪れた場所 -->\n| m |\n<!-- /daily:訪れた場所 -->\n\nafter\n"
+
+
+def test_properties_set_to_none_are_removed():
+    content = "---\na: 1\nb: 2\nb: 2\n---\n\nbody\n"
+
+    result = daily_note.upsert_properties(content, {"a": 3, "b": None, "c": None})
+
+    assert result == "---\na: 3\n---\n\nbody\n"
@@ -0,0 +1,54 @@
+"""exportDailyLocation.py の日付インデックス (古いインデックス・別のファイルのインデックス) のテスト"""
+
+import os
+import json
+
+import exportDailyLocation
+
+
+def segment(day, hour):
+    return {"startTime": f"{day}T{hour:02d}:00:00+09:00", "endTime": f"{day}T{hour:02d}:30:00+09:00"}
+
+
+def write_timeline(path, segments, head='{"semanticSegments": [', separator=", ", mtime_ns=None):
+    """Timeline JSON を書き込み、mtime_ns を指定した場合は更新日時をその値に戻す"""
+    body = separator.join(json.dumps(seg) for seg in segments)
+    path.write_text(f"{head}{body}]}}", encoding="utf-8")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return os.stat(path)
+
+
+def test_rebuilds_a_stale_index_once(tmp_path, capsys):
+    path = tmp_path / "Timeline.json"
+    stat = write_timeline(path, [segment("2024-03-01", 9), segment("2024-03-02", 10)])
+    exportDailyLocation.extract_days(str(path), ["2024-03-02"])
+
+    # サイズ・更新日時が同じまま、セグメントの位置だけがずれた (インデックスが古い)
+    moved = write_timeline(
+        path, [segment("2024-03-01", 9), segment("2024-03-02", 10)],
+        head='{"semanticSegments":[', separator=",  ", mtime_ns=stat.st_mtime_ns,
+    )
+    assert (moved.st_size, moved.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+
+    picked, total = exportDailyLocation.extract_days(str(path), ["2024-03-01", "2024-03-02"])
+
+    assert picked == {"2024-03-01": [segment("2024-03-01", 9)], "2024-03-02": [segment("2024-03-02", 10)]}
+    assert total == 2
+    assert capsys.readouterr().out.count("インデックスが元ファイルと一致しないため作り直します") == 1
+
+
+def test_does_not_use_the_index_of_another_file(tmp_path):
+    first = tmp_path / "first.json"
+    second = tmp_path / "second.json"
+    stat = write_timeline(first, [segment("2024-03-01", 9), segment("2024-03-02", 10)])
+    exportDailyLocation.extract_days(str(first), ["2024-03-01"])
+
+    # 同じサイズ・更新日時で日付だけが異なるファイル
+    write_timeline(second, [segment("2024-04-01", 9), segment("2024-04-02", 10)], mtime_ns=stat.st_mtime_ns)
+
+    picked, _ = exportDailyLocation.extract_days(str(second), ["2024-03-01", "2024-04-02"])
+
+    assert picked == {"2024-03-01": [], "2024-04-02": [segment("2024-04-02", 10)]}
+    index = exportDailyLocation.load_index(exportDailyLocation.INDEX_PATH)
+    assert index["source"] == os.path.abspath(second)
@@ -0,0 +1,76 @@
+"""getChromeHistory.py の閲覧履歴の取り込み (バッチでの受け渡し) のテスト"""
+
+import sqlite3
+import threading
+
+import pytest
+
+import getChromeHistory
+
+
+def make_history(path, n):
+    """Chrome の History と同じ列を持つ visits / urls を作る"""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE urls (id INTEGER PRIMARY KEY, url TEXT, title TEXT);
+        CREATE TABLE visits (id INTEGER PRIMARY KEY, url INTEGER, visit_time INTEGER, transition INTEGER,
+                             visit_duration INTEGER);
+    """)
+    conn.executemany("INSERT INTO urls VALUES (?, ?, ?)", [(i, f"https://ex.com/{i}", f"page {i}") for i in range(1, n + 1)])
+    conn.executemany("INSERT INTO visits VALUES (?, ?, ?, 0, 0)", [(i, i, 13_350_000_000_000_000 + i) for i in range(1, n + 1)])
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+@pytest.fixture
+def profiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(getChromeHistory, "INGEST_BATCH_SIZE", 10)
+    monkeypatch.setattr(getChromeHistory, "REPLICA_HISTORY_PATH", str(tmp_path / "History_replica"))
+    return [(f"p{n}", make_history(tmp_path / f"History{n}", 200)) for n in range(3)]
+
+
+@pytest.fixture
+def warehouse(tmp_path):
+    conn = getChromeHistory.open_warehouse(str(tmp_path / "warehouse.sqlite3"))
+    yield conn
+    conn.close()
+
+
+def test_ingests_all_profiles_in_batches(profiles, warehouse):
+    getChromeHistory.ingest_profiles(warehouse, profiles, max_workers=2)
+
+    counts = dict(warehouse.execute("SELECT source, COUNT(*) FROM visits GROUP BY source"))
+    assert counts == {"p0": 200, "p1": 200, "p2": 200}
+    assert set(warehouse.execute("SELECT source, last_visit_id FROM sources")) == {("p0", 200), ("p1", 200), ("p2", 200)}
+
+
+def test_write_error_stops_the_workers(profiles, tmp_path, monkeypatch):
+    def failing_store(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(getChromeHistory, "store_visits", failing_store)
+    path = str(tmp_path / "warehouse.sqlite3")
+    errors = []
+
+    def ingest():
+        # sqlite3 の接続は作ったスレッドでしか使えないため、このスレッドで開く
+        conn = getChromeHistory.open_warehouse(path)
+        try:
+            getChromeHistory.ingest_profiles(conn, profiles, max_workers=1)
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    # 書き込みに失敗しても、キューで待っているワーカーが止まり、例外が返る (固まらない)
+    thread = threading.Thread(target=ingest, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    # 途中で止まったプロファイルは取り込み済みの位置を進めない
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0] == 0
+    conn.close()
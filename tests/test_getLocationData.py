@@ -0,0 +1,173 @@
+"""getLocationData.py の Places API 照会 (並列化・レート制限・再試行) のテスト"""
+
+import time
+import importlib
+
+import pytest
+
+import getLocationData
+import metrics
+
+API_KEY = "test-key"
+
+
+@pytest.fixture(autouse=True)
+def places_api(stub_server, monkeypatch):
+    """照会先をスタブサーバーに向け、再試行の待ち時間を短くする"""
+    monkeypatch.setattr(getLocationData, "PLACES_API_BASE_URL", stub_server.url)
+    monkeypatch.setattr(getLocationData, "PLACES_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(getLocationData, "PLACES_MAX_RETRIES", 3)
+
+
+def place_ids(n):
+    return [f"bench-place-{i:05d}" for i in range(n)]
+
+
+def test_resolves_places_concurrently(slow_stub_server, monkeypatch):
+    monkeypatch.setattr(getLocationData, "PLACES_API_BASE_URL", slow_stub_server.url)
+    ids = place_ids(16)
+
+    started = time.monotonic()
+    results = getLocationData.resolve_places(ids, API_KEY, max_workers=8, qps=0)
+    elapsed = time.monotonic() - started
+
+    assert {pid: info["name"] for pid, info in results.items()} == {pid: f"場所 {i}" for i, pid in enumerate(ids)}
+    assert slow_stub_server.handler.max_active > 1
+    # 逐次なら 16 × 0.2 秒かかる
+    assert elapsed < 1.6
+
+
+def test_deduplicates_place_ids(stub_server):
+    ids = place_ids(3) * 4
+    results = getLocationData.resolve_places(ids, API_KEY, max_workers=4, qps=0)
+    assert sorted(results) == place_ids(3)
+    assert stub_server.count("/places/") == 3
+
+
+def test_calls_on_result_for_each_place(stub_server):
+    seen = []
+    getLocationData.resolve_places(place_ids(5), API_KEY, lambda pid, info, permanent: seen.append((pid, permanent)),
+                                   max_workers=3, qps=0)
+    assert sorted(seen) == [(pid, False) for pid in place_ids(5)]
+
+
+def test_rate_limit_spaces_requests(stub_server):
+    qps = 10
+    getLocationData.resolve_places(place_ids(6), API_KEY, max_workers=6, qps=qps)
+
+    times = sorted(t for t, _, _ in stub_server.requests)
+    # 6 件を 10 件/秒で送ると、最初と最後の間隔は 0.5 秒以上になる (計測の誤差を考慮)
+    assert times[-1] - times[0] >= 0.45
+    # 到着時刻はスレッドの起床の遅れで前後するため、隣り合う 2 件ではなく 3 件ごとの間隔で確かめる
+    assert min(c - a for a, c in zip(times, times[2:])) >= 1.5 / qps
+
+
+def test_retries_on_429_and_5xx(stub_server):
+    stub_server.fail("/places/bench-place-00001", 429, 503)
+    stub_server.fail("/places/bench-place-00002", 500)
+
+    results = getLocationData.resolve_places(place_ids(3), API_KEY, max_workers=3, qps=0)
+
+    assert all(results[pid] for pid in place_ids(3))
+    assert stub_server.count("/places/bench-place-00000") == 1
+    assert stub_server.count("/places/bench-place-00001") == 3
+    assert stub_server.count("/places/bench-place-00002") == 2
+
+
+def test_backoff_grows_between_retries(stub_server, monkeypatch):
+    monkeypatch.setattr(getLocationData, "PLACES_BACKOFF_BASE", 0.05)
+    monkeypatch.setattr(getLocationData.random, "random", lambda: 0.5)
+    stub_server.fail("/places/bench-place-00000", 503, 503, 503)
+
+    info, permanent = getLocationData.fetch_place_details("bench-place-00000", API_KEY)
+
+    assert info["name"] == "場所 0" and not permanent
+    times = [t for t, _, _ in stub_server.requests]
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    # 待ち時間は 0.05, 0.1, 0.2 秒と倍になっていく
+    assert len(gaps) == 3
+    assert gaps[0] >= 0.045 and gaps[1] >= 0.095 and gaps[2] >= 0.19
+    assert gaps[0] < gaps[1] < gaps[2]
+
+
+def test_gives_up_after_max_retries(stub_server):
+    stub_server.fail("/places/bench-place-00000", *[503] * 10)
+
+    info, permanent = getLocationData.fetch_place_details("bench-place-00000", API_KEY)
+
+    assert info is None
+    # 一時的な失敗は記録せず、次回の実行で再照会する
+    assert permanent is False
+    assert stub_server.count("/places/") == getLocationData.PLACES_MAX_RETRIES + 1
+
+
+def test_does_not_retry_client_errors(stub_server):
+    # スタブは数値で終わらない placeID に 404 を返す
+    info, permanent = getLocationData.fetch_place_details("unknown", API_KEY)
+    assert info is None and permanent is True
+    assert stub_server.count("/places/") == 1
+
+
+def test_retry_after_header_takes_precedence():
+    class Response:
+        headers = {"Retry-After": "3"}
+
+    assert getLocationData._retry_delay(Response(), 0) == 3.0
+
+
+def test_non_positive_max_workers_is_clamped(stub_server, monkeypatch):
+    results = getLocationData.resolve_places(place_ids(2), API_KEY, max_workers=0, qps=0)
+    assert sorted(results) == place_ids(2)
+
+    monkeypatch.setenv("PLACES_MAX_WORKERS", "0")
+    try:
+        assert importlib.reload(getLocationData).PLACES_MAX_WORKERS == 1
+    finally:
+        monkeypatch.delenv("PLACES_MAX_WORKERS")
+        importlib.reload(getLocationData)
+
+
+def test_api_calls_count_each_attempt(stub_server):
+    stub_server.fail("/places/bench-place-00001", 429, 503)
+
+    with metrics.StageMeter("places") as meter:
+        getLocationData.resolve_places(place_ids(3), API_KEY, max_workers=3, qps=0)
+
+    # ワーカースレッドでの照会も、再試行を含めて HTTP リクエストごとに数える
+    assert meter.result["api_calls"] == stub_server.count("/places/") == 5
+
+
+@pytest.fixture
+def cache():
+    conn = getLocationData.open_cache()
+    yield conn
+    conn.close()
+
+
+def test_failures_expire_after_the_negative_ttl(cache, monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(getLocationData.time, "time", lambda: now)
+    getLocationData.store_failure(cache, "missing", ttl_days=1)
+
+    monkeypatch.setattr(getLocationData.time, "time", lambda: now + 86399)
+    assert getLocationData.get_cached_places(cache, ["missing"]) == {"missing": {"info": None, "expired": False}}
+
+    monkeypatch.setattr(getLocationData.time, "time", lambda: now + 86400)
+    assert getLocationData.get_cached_places(cache, ["missing"]) == {"missing": {"info": None, "expired": True}}
+
+
+def test_zero_negative_ttl_does_not_cache_failures(cache):
+    getLocationData.store_failure(cache, "missing", ttl_days=0)
+
+    assert getLocationData.get_cached_places(cache, ["missing"]) == {}
+
+
+def test_failure_does_not_make_a_known_place_permanent(cache):
+    info = {"name": "駅", "address": "東京", "placeLocation": "geo:35.68,139.76"}
+    getLocationData.store_place(cache, "known", info, ttl_days=1)
+
+    getLocationData.store_failure(cache, "known", ttl_days=0)
+
+    row = cache.execute("SELECT expires_at FROM places WHERE place_id = 'known'").fetchone()
+    assert row["expires_at"] is not None
+    assert getLocationData.get_cached_places(cache, ["known"])["known"]["info"] == info
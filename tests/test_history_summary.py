@@ -0,0 +1,39 @@
+"""history_summary.py の集計結果の表と詳細ファイルのテスト"""
+
+import pytest
+
+import history_summary
+
+
+@pytest.fixture(autouse=True)
+def detail_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(history_summary, "HISTORY_DETAIL_DIR", tmp_path / "history_detail")
+
+
+def visit(time, url, title, duration=1.5, transition="link", source="default"):
+    return {"url": url, "title": title, "visit_time": f"2024-03-01 {time}",
+            "transition": transition, "duration_seconds": duration, "source": source}
+
+
+def test_pipes_in_title_and_url_do_not_break_the_table():
+    summary = history_summary.summarize_history([visit("10:00:00", "https://ex.com/a?x=1|2", "A|B")])
+
+    markdown = history_summary.summary_to_markdown(summary)
+
+    row = next(line for line in markdown.splitlines() if line.startswith("| [A"))
+    assert row.startswith(r"| [A\|B](https://ex.com/a?x=1%7C2) | ex.com | 1 |")
+    # エスケープしていない | は列の区切りだけ (5 列)
+    assert row.replace(r"\|", "").count("|") == 6
+
+
+def test_detail_keeps_every_visit():
+    items = [
+        visit("09:00:00", "https://ex.com/a", "A", 10.0, "typed"),
+        visit("09:30:00", "https://ex.com/b", "B", 2.5),
+        visit("11:00:00", "https://ex.com/a", "A (更新後)", 0.0, "reload", "work"),
+    ]
+    summary = history_summary.summarize_history(items)
+
+    history_summary.save_detail(summary, "2024-03-01")
+
+    assert history_summary.load_detail("2024-03-01") == items
@@ -0,0 +1,71 @@
+"""metrics.py のステージごとのカウンターのテスト"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+
+def test_counts_from_bound_worker_threads():
+    def work(n):
+        for _ in range(1000):
+            metrics.count("items")
+        return n
+
+    with metrics.StageMeter("stage") as meter:
+        metrics.count("items", 5)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            assert list(pool.map(metrics.bind(work), range(16))) == list(range(16))
+
+    assert meter.result["items"] == 16 * 1000 + 5
+
+
+def test_unbound_worker_threads_are_not_counted():
+    with metrics.StageMeter("stage") as meter:
+        thread = threading.Thread(target=metrics.count, args=("items",))
+        thread.start()
+        thread.join()
+    assert "items" not in meter.result
+
+
+def test_stages_keep_separate_counters():
+    with metrics.StageMeter("a") as a:
+        count_a = metrics.bind(metrics.count)
+    with metrics.StageMeter("b") as b:
+        metrics.count("items", 2)
+        # 別のステージで作った関数は、作ったステージに記録する
+        count_a("items", 3)
+    assert a.result.get("items") is None
+    assert a.counters["items"] == 3
+    assert b.result["items"] == 2
+
+
+def test_outside_a_stage_does_nothing():
+    assert metrics.bind(len) is len
+    metrics.count("items")
+
+
+def test_nested_meters_restore_the_outer_meter():
+    with metrics.StageMeter("outer") as outer:
+        metrics.count("items")
+        with metrics.StageMeter("inner") as inner:
+            metrics.count("items", 2)
+        metrics.count("items", 4)
+
+    assert inner.result["items"] == 2
+    assert outer.result["items"] == 5
+
+
+def run(stages, peak):
+    return {"peak_rss_bytes": peak, "stages": stages}
+
+
+def test_memory_is_compared_per_run_not_per_stage():
+    stage = {"status": "ok", "wall_seconds": 2.0, "cpu_seconds": 1.0}
+    runs = [run({"a": stage}, 100 * 2**20) for _ in range(3)]
+
+    # 実行全体の最大メモリが増えた場合は、ステージではなく実行全体の悪化として報告する
+    latest = run({"a": {**stage, "peak_rss_bytes": 900 * 2**20}}, 300 * 2**20)
+    assert metrics.find_regressions(runs + [latest]) == [("run", "peak_rss_bytes", 300 * 2**20, 100 * 2**20)]
+
+    assert metrics.find_regressions(runs + [run({"a": stage}, 120 * 2**20)]) == []
@@ -0,0 +1,64 @@
+"""movement_stats.py の移動統計 (保存先からの点の読み込み・プロパティの更新) のテスト"""
+
+import datetime
+
+import pytest
+
+import location_points
+import movement_stats
+
+DAY = "2024-03-01"
+
+
+def path_segment(hour, points, mode="IN_TRAIN"):
+    """hour 時から 1 点 10 分ごとに points (緯度, 経度) を通る移動"""
+    start = datetime.datetime.fromisoformat(f"{DAY}T{hour:02d}:00:00+09:00")
+    times = [start + datetime.timedelta(minutes=10 * i) for i in range(len(points))]
+    return {
+        "startTime": times[0].isoformat(),
+        "endTime": times[-1].isoformat(),
+        "activity": {"topCandidate": {"type": mode}},
+        "timelinePath": [{"point": f"{lat}°, {lon}°", "time": t.isoformat()} for (lat, lon), t in zip(points, times)],
+    }
+
+
+@pytest.fixture
+def note(tmp_path):
+    path = tmp_path / f"{DAY}.md"
+    path.write_text("---\ntags: daily\n移動時間_徒歩: 15\n移動時間_バス: 7\n---\n\n本文\n", encoding="utf-8")
+    return path
+
+
+def test_reads_path_points_from_the_columnar_store():
+    segments = [path_segment(9, [(35.68, 139.76), (35.69, 139.77), (35.70, 139.78)])]
+    first = movement_stats.movement_properties({DAY: segments})
+
+    assert len(location_points.load_day(DAY)["timestamp"]) == 3
+
+    # 取り込み済みの点は保存先から読み込むため、セグメントに経路がなくても同じ結果になる
+    without_path = [{k: v for k, v in seg.items() if k != "timelinePath"} for seg in segments]
+    _, props = movement_stats.day_properties(DAY, without_path)
+    assert props == first[DAY]
+    assert props["移動距離"] == pytest.approx(2.86, abs=0.01)
+
+
+def test_appended_segments_are_imported():
+    morning = path_segment(9, [(35.68, 139.76), (35.69, 139.77)])
+    movement_stats.movement_properties({DAY: [morning]})
+
+    evening = path_segment(18, [(35.69, 139.77), (35.68, 139.76)], mode="WALKING")
+    props = movement_stats.movement_properties({DAY: [morning, evening]})[DAY]
+
+    assert len(location_points.load_day(DAY)["timestamp"]) == 4
+    assert (props["移動時間_電車"], props["移動時間_徒歩"]) == (10, 10)
+
+
+def test_removes_modes_that_are_no_longer_in_the_result(note):
+    props = movement_stats.movement_properties({DAY: [path_segment(9, [(35.68, 139.76), (35.69, 139.77)])]})[DAY]
+
+    assert movement_stats.write_note_properties(note, props)
+
+    text = note.read_text(encoding="utf-8")
+    assert "移動時間_電車: 10" in text
+    assert "移動時間_徒歩" not in text and "移動時間_バス" not in text
+    assert "tags: daily" in text and text.endswith("本文\n")
@@ -0,0 +1,129 @@
+"""update_weather.py の天気の取得 (期間のまとめ・キャッシュ) のテスト"""
+
+import datetime
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+
+import update_weather
+
+LAT, LON = 35.6812, 139.7671
+
+
+@pytest.fixture(autouse=True)
+def weather_api(stub_server, monkeypatch):
+    """取得先をスタブサーバーに向ける (キャッシュは conftest.py の data_paths で一時フォルダに作る)"""
+    monkeypatch.setattr(update_weather, "WEATHER_API_URL", f"{stub_server.url}/v1/archive")
+    monkeypatch.setattr(update_weather, "WEATHER_BATCH_DAYS", 366)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    conn = update_weather.open_weather_cache()
+    assert (tmp_path / "weather_cache.sqlite3").exists()
+    yield conn
+    conn.close()
+
+
+def days(first, n):
+    start = datetime.date.fromisoformat(first)
+    return [start + datetime.timedelta(days=i) for i in range(n)]
+
+
+def weather_requests(stub_server):
+    """スタブが受け取った天気のリクエストのクエリ (順番どおり)"""
+    return [parse_qs(urlsplit(full).query) for _, path, full in stub_server.requests if path == "/v1/archive"]
+
+
+def test_fetches_a_range_in_one_request(stub_server, cache):
+    result = update_weather.get_weather_range(LAT, LON, days("2024-03-01", 30), cache)
+
+    assert len(result) == 30
+    assert result["2024-03-15"]["max_temp"] == 22.5
+    [query] = weather_requests(stub_server)
+    assert (query["start_date"], query["end_date"]) == (["2024-03-01"], ["2024-03-30"])
+
+
+def test_splits_long_ranges_into_batches(stub_server, cache, monkeypatch):
+    monkeypatch.setattr(update_weather, "WEATHER_BATCH_DAYS", 10)
+
+    result = update_weather.get_weather_range(LAT, LON, days("2024-03-01", 25), cache)
+
+    assert len(result) == 25
+    spans = [(q["start_date"][0], q["end_date"][0]) for q in weather_requests(stub_server)]
+    assert spans == [("2024-03-01", "2024-03-10"), ("2024-03-11", "2024-03-20"), ("2024-03-21", "2024-03-25")]
+
+
+def test_gaps_between_days_are_fetched_together(stub_server, cache):
+    wanted = [datetime.date(2024, 3, 1), datetime.date(2024, 3, 5), datetime.date(2024, 3, 9)]
+
+    result = update_weather.get_weather_range(LAT, LON, wanted, cache)
+
+    assert sorted(result) == ["2024-03-01", "2024-03-05", "2024-03-09"]
+    [query] = weather_requests(stub_server)
+    assert (query["start_date"], query["end_date"]) == (["2024-03-01"], ["2024-03-09"])
+
+
+def test_cache_is_keyed_by_rounded_coordinates(stub_server, cache):
+    update_weather.get_weather_range(35.6812, 139.7671, days("2024-03-01", 3), cache)
+    assert stub_server.count("/v1/archive") == 1
+
+    # 小数点以下 2 桁に丸めると同じ座標 (35.68, 139.77) になるため、キャッシュから返す
+    result = update_weather.get_weather_range(35.6849, 139.7651, days("2024-03-01", 3), cache)
+    assert len(result) == 3
+    assert stub_server.count("/v1/archive") == 1
+
+    # 丸めた座標が異なる場合は取得する
+    update_weather.get_weather_range(35.70, 139.77, days("2024-03-01", 3), cache)
+    assert stub_server.count("/v1/archive") == 2
+    [query] = weather_requests(stub_server)[1:]
+    assert (query["latitude"], query["longitude"]) == (["35.7"], ["139.77"])
+
+
+def test_cache_is_keyed_by_date(stub_server, cache):
+    update_weather.get_weather_range(LAT, LON, days("2024-03-01", 10), cache)
+
+    # キャッシュにない日だけを取得する
+    result = update_weather.get_weather_range(LAT, LON, days("2024-03-05", 8), cache)
+
+    assert len(result) == 8
+    spans = [(q["start_date"][0], q["end_date"][0]) for q in weather_requests(stub_server)]
+    assert spans == [("2024-03-01", "2024-03-10"), ("2024-03-11", "2024-03-12")]
+
+
+def test_failed_requests_are_not_cached(stub_server, cache):
+    stub_server.fail("/v1/archive", 500)
+
+    assert update_weather.get_weather_range(LAT, LON, days("2024-03-01", 2), cache) == {}
+    assert len(update_weather.get_weather_range(LAT, LON, days("2024-03-01", 2), cache)) == 2
+    assert stub_server.count("/v1/archive") == 2
+
+
+def visit(day, hour, hours, lat, lon):
+    start = datetime.datetime.fromisoformat(f"{day}T{hour:02d}:00:00+09:00")
+    return {
+        "startTime": start.isoformat(),
+        "endTime": (start + datetime.timedelta(hours=hours)).isoformat(),
+        "visit": {"topCandidate": {"placeLocation": {"latLng": f"{lat}°, {lon}°"}, "name": "場所"}},
+    }
+
+
+def test_second_run_makes_no_requests(stub_server):
+    loc_by_day = {
+        day.isoformat(): [visit(day.isoformat(), 9, 2, 35.68, 139.76), visit(day.isoformat(), 14, 3, 35.69, 139.70)]
+        for day in days("2024-03-01", 5)
+    }
+    loc_by_day["2024-03-06"] = None  # 訪問のない日は既定の座標の天気
+
+    first = update_weather.resolve_range_weather(loc_by_day)
+    requests_after_first = stub_server.count("/v1/archive")
+
+    # 訪問は 1 つのまとまりになるため、時間ごと・日ごと (訪問の地点と既定の座標) の 3 回で済む
+    assert requests_after_first == 3
+    assert all(w["daily"] for w in first.values())
+    assert first["2024-03-01"]["visits"][0]["temperature"] is not None
+
+    second = update_weather.resolve_range_weather(loc_by_day)
+
+    assert stub_server.count("/v1/archive") == requests_after_first
+    assert second == first
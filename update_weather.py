@@ -1,14 +1,22 @@
 """
-デイリーノートに天気情報を追記するスクリプト
+デイリーノートに天気情報を書き込むスクリプト
 """
 
 import os
+import math
+import time
+import sqlite3
+import argparse
 import datetime
 import requests
-import re
 from pathlib import Path
 from dotenv import load_dotenv
 
+import metrics
+from daily_note import DailyNote
+from exportDailyLocation import parse_dt
+from location_points import parse_point
+
 # --- 設定読み込み ---
 
 SCRIPT_DIR = Path(__file__).parent
@@ -39,37 +47,356 @@ except ValueError:
     DEFAULT_LAT = 35.6812
     DEFAULT_LON = 139.7671
 
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "https://archive-api.open-meteo.com/v1/archive")
+WEATHER_CACHE_DB = os.getenv("WEATHER_CACHE_DB", "weather_cache.sqlite3")
+
+try:
+    # キャッシュのキーにする座標の小数点以下の桁数 (2 桁でおよそ 1km)
+    WEATHER_GRID_DECIMALS = int(os.getenv("WEATHER_GRID_DECIMALS", "2"))
+    # 1 回のリクエストで取得する最大日数
+    WEATHER_BATCH_DAYS = max(1, int(os.getenv("WEATHER_BATCH_DAYS", "366")))
+except ValueError:
+    print("警告: 天気キャッシュの設定が不正です。デフォルト値を使用します。")
+    WEATHER_GRID_DECIMALS = 2
+    WEATHER_BATCH_DAYS = 366
+
+try:
+    # 訪問地点をまとめる半径 (km)。同じまとまりの訪問は 1 回のリクエストで天気を取得する
+    WEATHER_CLUSTER_KM = float(os.getenv("WEATHER_CLUSTER_KM", "10"))
+except ValueError:
+    print("警告: WEATHER_CLUSTER_KM の設定が不正です。デフォルト値(10)を使用します。")
+    WEATHER_CLUSTER_KM = 10.0
+
+WEATHER_TIMEOUT = 30
+HOURLY_VARIABLES = ["weathercode", "temperature_2m"]
+HOUR_FORMAT = "%Y-%m-%dT%H:00"
+DAILY_VARIABLES = ["weathercode", "temperature_2m_max", "temperature_2m_min", "surface_pressure_max", "surface_pressure_min"]
+
 # --- 関数定義 ---
 
-def get_weather_data(date_str, lat, lon):
-    url = "https://archive-api.open-meteo.com/v1/archive"
+def open_weather_cache(db_path=None):
+    """天気キャッシュ (SQLite) を開く。キーは (丸めた緯度, 丸めた経度, 日付)。db_path を省略した場合は WEATHER_CACHE_DB"""
+    conn = sqlite3.connect(db_path or WEATHER_CACHE_DB)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_weather (
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            date TEXT NOT NULL,
+            weathercode INTEGER,
+            max_temp REAL,
+            min_temp REAL,
+            max_pressure REAL,
+            min_pressure REAL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (lat, lon, date)
+        )
+    """)
+    # 時間ごとの天気 (time は UTC の "YYYY-MM-DDTHH:00")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS hourly_weather (
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            time TEXT NOT NULL,
+            weathercode INTEGER,
+            temperature REAL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (lat, lon, time)
+        )
+    """)
+    return conn
+
+def grid_key(lat, lon):
+    return round(lat, WEATHER_GRID_DECIMALS), round(lon, WEATHER_GRID_DECIMALS)
+
+def fetch_weather_range(lat, lon, start_date, end_date, session=None):
+    """
+    Open-Meteo の過去データ API から start_date〜end_date の日ごとの天気を 1 回のリクエストで取得する。
+    戻り値は {日付: (天気コード, 最高気温, 最低気温, 最高気圧, 最低気圧)}
+    """
     params = {
         "latitude": lat,
         "longitude": lon,
-        "start_date": date_str,
-        "end_date": date_str,
-        "daily": ["weathercode", "temperature_2m_max", "temperature_2m_min", "surface_pressure_max", "surface_pressure_min"],
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "daily": DAILY_VARIABLES,
         "timezone": "auto"
     }
+    response = (session or requests).get(WEATHER_API_URL, params=params, timeout=WEATHER_TIMEOUT)
+    response.raise_for_status()
+    daily = response.json().get("daily", {})
+
+    columns = [daily.get(name) or [] for name in DAILY_VARIABLES]
+    return {
+        day: tuple(col[i] if i < len(col) else None for col in columns)
+        for i, day in enumerate(daily.get("time", []))
+    }
+
+def _missing_spans(days, cached):
+    """
+    キャッシュにない日を含む期間 (最大 WEATHER_BATCH_DAYS 日) のリストを返す。
+    間の日 (ノートのない日など) もまとめて取得したほうがリクエスト数が少ないため、期間は途切れさせない。
+    """
+    spans = []
+    for day in sorted(d for d in days if d.isoformat() not in cached):
+        if spans and (day - spans[-1][0]).days < WEATHER_BATCH_DAYS:
+            spans[-1][1] = day
+        else:
+            spans.append([day, day])
+    return spans
+
+def get_weather_range(lat, lon, days, conn=None):
+    """
+    指定した座標・日付の天気を返す ({日付文字列: 天気情報})。
+    キャッシュにない日だけを連続した期間ごとにまとめて取得し、キャッシュに保存する。
+    値がまだ確定していない日 (直近の日など) は保存せず、次回の実行で再取得する。
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = open_weather_cache()
+    key_lat, key_lon = grid_key(lat, lon)
+    days = set(days)
+
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        daily = data.get("daily", {})
-
-        wmo_code = daily.get("weathercode", [None])[0]
-        weather_text = wmo_code_to_text(wmo_code)
-
-        return {
-            "weather": weather_text,
-            "max_temp": daily.get("temperature_2m_max", [None])[0],
-            "min_temp": daily.get("temperature_2m_min", [None])[0],
-            "max_pressure": daily.get("surface_pressure_max", [None])[0],
-            "min_pressure": daily.get("surface_pressure_min", [None])[0]
+        iso_days = sorted(d.isoformat() for d in days)
+        cached = {}
+        if iso_days:
+            for row in conn.execute(
+                "SELECT date, weathercode, max_temp, min_temp, max_pressure, min_pressure FROM daily_weather "
+                "WHERE lat = ? AND lon = ? AND date BETWEEN ? AND ?",
+                (key_lat, key_lon, iso_days[0], iso_days[-1]),
+            ):
+                cached[row[0]] = tuple(row[1:])
+
+        spans = _missing_spans(days, cached)
+        hits = sum(1 for d in iso_days if d in cached)
+        metrics.count("cache_hits", hits)
+        metrics.count("cache_misses", len(iso_days) - hits)
+        if spans:
+            with requests.Session() as session:
+                for start, end in spans:
+                    print(f"天気情報を取得中 (座標: {key_lat}, {key_lon} / {start} - {end})...")
+                    metrics.count("api_calls")
+                    try:
+                        fetched = fetch_weather_range(key_lat, key_lon, start, end, session)
+                    except Exception as e:
+                        print(f"天気情報の取得に失敗しました: {e}")
+                        continue
+                    now = time.time()
+                    complete = {d: v for d, v in fetched.items() if all(x is not None for x in v)}
+                    with conn:
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO daily_weather VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            [(key_lat, key_lon, d, *v, now) for d, v in complete.items()],
+                        )
+                    cached.update(fetched)
+    finally:
+        if own_conn:
+            conn.close()
+
+    result = {}
+    for day in iso_days:
+        if day not in cached:
+            continue
+        code, max_temp, min_temp, max_pressure, min_pressure = cached[day]
+        result[day] = {
+            "weather": wmo_code_to_text(code),
+            "max_temp": max_temp,
+            "min_temp": min_temp,
+            "max_pressure": max_pressure,
+            "min_pressure": min_pressure
         }
-    except Exception as e:
-        print(f"天気情報の取得に失敗しました: {e}")
+    return result
+
+def get_weather_data(date_str, lat, lon):
+    """指定日の天気情報 (キャッシュにあればリクエストしない)"""
+    try:
+        day = datetime.date.fromisoformat(date_str)
+    except ValueError:
+        print(f"天気情報の取得に失敗しました: 日付の形式が正しくありません ({date_str})")
         return None
+    return get_weather_range(lat, lon, [day]).get(date_str)
+
+def fetch_hourly_range(lat, lon, start_date, end_date, session=None):
+    """
+    start_date〜end_date (UTC) の時間ごとの天気を 1 回のリクエストで取得する。
+    戻り値は {"YYYY-MM-DDTHH:00" (UTC): (天気コード, 気温)}
+    """
+    params = {
+        "latitude": lat,
+        "longitude": lon,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "hourly": HOURLY_VARIABLES,
+        "timezone": "GMT"
+    }
+    response = (session or requests).get(WEATHER_API_URL, params=params, timeout=WEATHER_TIMEOUT)
+    response.raise_for_status()
+    hourly = response.json().get("hourly", {})
+
+    codes = hourly.get("weathercode") or []
+    temps = hourly.get("temperature_2m") or []
+    return {
+        t: (codes[i] if i < len(codes) else None, temps[i] if i < len(temps) else None)
+        for i, t in enumerate(hourly.get("time", []))
+    }
+
+def get_hourly_weather(lat, lon, start_date, end_date, conn):
+    """
+    指定した座標・期間 (UTC の日付) の時間ごとの天気を返す ({UTC の datetime: (天気コード, 気温)})。
+    キャッシュに揃っていない場合だけ期間全体を 1 回で取得し、値の揃った時間をキャッシュに保存する。
+    """
+    key_lat, key_lon = grid_key(lat, lon)
+    lo = f"{start_date.isoformat()}T00:00"
+    hi = f"{end_date.isoformat()}T23:00"
+    query = ("SELECT time, weathercode, temperature FROM hourly_weather "
+             "WHERE lat = ? AND lon = ? AND time BETWEEN ? AND ?")
+    hours = {row[0]: tuple(row[1:]) for row in conn.execute(query, (key_lat, key_lon, lo, hi))}
+
+    expected = ((end_date - start_date).days + 1) * 24
+    if len(hours) < expected:
+        metrics.count("cache_misses")
+        metrics.count("api_calls")
+        print(f"時間ごとの天気を取得中 (座標: {key_lat}, {key_lon} / {start_date} - {end_date})...")
+        try:
+            fetched = fetch_hourly_range(key_lat, key_lon, start_date, end_date)
+        except Exception as e:
+            print(f"天気情報の取得に失敗しました: {e}")
+            fetched = {}
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO hourly_weather VALUES (?, ?, ?, ?, ?, ?)",
+                [(key_lat, key_lon, t, *v, now) for t, v in fetched.items() if None not in v],
+            )
+        hours.update(fetched)
+
+    else:
+        metrics.count("cache_hits")
+
+    return {
+        datetime.datetime.strptime(t, HOUR_FORMAT).replace(tzinfo=datetime.timezone.utc): v
+        for t, v in hours.items()
+    }
+
+def _distance_km(lat1, lon1, lat2, lon2):
+    """2 点間の距離 (km, ハバーサイン)"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * math.asin(min(1.0, math.sqrt(a)))
+
+def cluster_points(points, radius_km=WEATHER_CLUSTER_KM):
+    """
+    座標のリストを、重心から radius_km 以内のまとまりに分ける (先に現れた点を優先する貪欲法)。
+    戻り値は [{"lat", "lon", "members": [points のインデックス]}]
+    """
+    clusters = []
+    for i, (lat, lon) in enumerate(points):
+        for c in clusters:
+            if _distance_km(c["lat"], c["lon"], lat, lon) <= radius_km:
+                n = len(c["members"])
+                c["lat"] = (c["lat"] * n + lat) / (n + 1)
+                c["lon"] = (c["lon"] * n + lon) / (n + 1)
+                c["members"].append(i)
+                break
+        else:
+            clusters.append({"lat": lat, "lon": lon, "members": [i]})
+    return clusters
+
+def _visit_window(entry):
+    """場所情報を書き込んだ訪問から (緯度, 経度, 開始, 終了) を返す。取り出せない場合は None"""
+    candidate = entry.get("visit", {}).get("topCandidate", {})
+    location = candidate.get("placeLocation")
+    if isinstance(location, dict):
+        location = location.get("latLng")
+    if not location or "startTime" not in entry or "endTime" not in entry:
+        return None
+    try:
+        lat, lon = parse_point(location)
+        return lat, lon, parse_dt(entry["startTime"]), parse_dt(entry["endTime"])
+    except ValueError:
+        return None
+
+def _hourly_summary(hours, start, end):
+    """滞在中の各時刻 (開始時刻を含む正時から) の値をまとめる。値がない場合は None"""
+    t = start.replace(minute=0, second=0, microsecond=0)
+    samples = []
+    while t <= end:
+        if t in hours and None not in hours[t]:
+            samples.append(hours[t])
+        t += datetime.timedelta(hours=1)
+    if not samples:
+        return None
+    codes = [code for code, _ in samples]
+    # 最も多い天気 (同数の場合は天気コードの大きい = 悪いほう)
+    code = max(set(codes), key=lambda x: (codes.count(x), x))
+    return {
+        "temperature": round(sum(temp for _, temp in samples) / len(samples), 1),
+        "weather": wmo_code_to_text(code),
+    }
+
+def visit_weather_days(entries_by_day):
+    """
+    複数日の訪問 ({日付: その日の訪問 (getLocationData.py の出力)}) に、滞在中の気温と天気を対応付ける。
+    全日の訪問地点をまとめ、まとまりごとに時間ごとの天気を期間全体でまとめて取得するため、
+    リクエスト数は訪問の数や日数ではなく地点のまとまりの数で決まる。
+    戻り値は {日付: ({訪問のインデックス: {"temperature", "weather"}}, その日最も長く滞在したまとまりの (緯度, 経度) または None)}
+    """
+    windows = {
+        (day, i): w
+        for day, entries in entries_by_day.items()
+        for i, entry in enumerate(entries)
+        if (w := _visit_window(entry))
+    }
+    visits = {day: {} for day in entries_by_day}
+    stay = {day: {} for day in entries_by_day}
+    if not windows:
+        return {day: ({}, None) for day in entries_by_day}
+
+    keys = list(windows)
+    clusters = cluster_points([windows[k][:2] for k in keys])
+
+    conn = open_weather_cache()
+    try:
+        for n, c in enumerate(clusters):
+            members = [keys[m] for m in c["members"]]
+            utc = {k: (windows[k][2].astimezone(datetime.timezone.utc), windows[k][3].astimezone(datetime.timezone.utc))
+                   for k in members}
+
+            # まとまりに訪問がある日 (UTC) を、最大 WEATHER_BATCH_DAYS 日の期間にまとめて取得する
+            dates = set()
+            for start, end in utc.values():
+                d = start.date()
+                while d <= end.date():
+                    dates.add(d)
+                    d += datetime.timedelta(days=1)
+            hours = {}
+            for span_start, span_end in _missing_spans(dates, {}):
+                hours.update(get_hourly_weather(c["lat"], c["lon"], span_start, span_end, conn))
+
+            for (day, i), (start, end) in utc.items():
+                stay[day][n] = stay[day].get(n, 0.0) + (end - start).total_seconds()
+                summary = _hourly_summary(hours, start, end)
+                if summary:
+                    visits[day][i] = summary
+    finally:
+        conn.close()
+
+    result = {}
+    for day in entries_by_day:
+        if stay[day]:
+            main_cluster = clusters[max(stay[day], key=stay[day].get)]
+            result[day] = (visits[day], (main_cluster["lat"], main_cluster["lon"]))
+        else:
+            result[day] = ({}, None)
+    return result
+
+def visit_weather(entries):
+    """
+    1 日分の訪問 (getLocationData.py の出力) に、滞在中の気温と天気を対応付ける。
+    戻り値は ({entries のインデックス: {"temperature", "weather"}}, 最も長く滞在したまとまりの (緯度, 経度) または None)
+    """
+    return visit_weather_days({0: entries})[0]
 
 def wmo_code_to_text(code):
     if code is None: return "不明"
@@ -81,76 +408,168 @@ def wmo_code_to_text(code):
     if code in [95, 96, 99]: return "雷雨"
     return f"その他({code})"
 
-def update_frontmatter(content, weather_data):
-    fm_pattern = r"^---\n(.*?)\n---"
-    match = re.search(fm_pattern, content, re.DOTALL)
-
-    new_properties = [
-        f"天気: {weather_data['weather']}",
-        f"最高気温: {weather_data['max_temp']}",
-        f"最低気温: {weather_data['min_temp']}",
-        f"最高気圧: {weather_data['max_pressure']}",
-        f"最低気圧: {weather_data['min_pressure']}"
-    ]
-    prop_block = "\n".join(new_properties)
-
-    if match:
-        original_fm = match.group(1)
-        new_fm = f"---\n{original_fm}\n{prop_block}\n---"
-        return content.replace(match.group(0), new_fm)
-    else:
-        return f"---\n{prop_block}\n---\n\n{content}"
+def weather_properties(weather_data):
+    """天気情報をデイリーノートのプロパティ (順序付き) に変換する"""
+    return {
+        "天気": weather_data["weather"],
+        "最高気温": weather_data["max_temp"],
+        "最低気温": weather_data["min_temp"],
+        "最高気圧": weather_data["max_pressure"],
+        "最低気圧": weather_data["min_pressure"],
+    }
 
-def update_weather_in_note(note_path, date_str, lat=None, lon=None):
-    """指定されたノートに天気情報を追記"""
+def apply_weather(note, date_str, lat=None, lon=None):
+    """天気情報を取得し、DailyNote に登録する (書き込みは呼び出し側で行う)"""
     if lat is None:
         lat = DEFAULT_LAT
     if lon is None:
         lon = DEFAULT_LON
 
-    print(f"天気情報を取得中 (座標: {lat}, {lon})...")
     weather_data = get_weather_data(date_str, lat, lon)
 
     if not weather_data:
         print("天気情報の取得に失敗したため、スキップします。")
         return False
 
+    note.set_properties(weather_properties(weather_data))
+    return True
+
+def resolve_day_weather(date_str, loc_data=None):
+    """
+    その日の訪問 (getLocationData.py の出力) から天気を求める。
+    日ごとの天気は最も長く滞在した場所 (訪問がない場合は DEFAULT_LAT / DEFAULT_LON) のもの。
+    戻り値は {"visits": {訪問のインデックス: {"temperature", "weather"}}, "daily": 日ごとの天気 (取得できない場合は None)}
+    """
+    visits, main_location = {}, None
+    if isinstance(loc_data, list):
+        try:
+            visits, main_location = visit_weather(loc_data)
+        except Exception as e:
+            print(f"訪問ごとの天気の取得に失敗しました: {e}")
+
+    lat, lon = main_location or (DEFAULT_LAT, DEFAULT_LON)
+    daily = get_weather_data(date_str, lat, lon)
+    if not daily:
+        print("天気情報の取得に失敗したため、スキップします。")
+    return {"visits": visits, "daily": daily}
+
+def resolve_range_weather(loc_by_day):
+    """
+    複数日の訪問 ({日付文字列: その日の訪問または None}) から各日の天気を求める (resolve_day_weather の期間版)。
+    訪問ごとの天気は地点のまとまりごとに、日ごとの天気は座標ごとに期間をまとめて取得する。
+    戻り値は {日付文字列: {"visits", "daily"}}
+    """
+    per_day = {}
+    entries = {d: v for d, v in loc_by_day.items() if isinstance(v, list)}
+    if entries:
+        try:
+            per_day = visit_weather_days(entries)
+        except Exception as e:
+            print(f"訪問ごとの天気の取得に失敗しました: {e}")
+
+    # 日ごとの天気は、その日最も長く滞在した場所 (訪問がない日は既定の座標) ごとにまとめて取得する
+    groups = {}
+    for date_str in loc_by_day:
+        main_location = per_day.get(date_str, ({}, None))[1]
+        lat, lon = main_location or (DEFAULT_LAT, DEFAULT_LON)
+        groups.setdefault(grid_key(lat, lon), []).append(date_str)
+
+    result = {}
+    conn = open_weather_cache()
+    try:
+        for (lat, lon), dates in groups.items():
+            weather = get_weather_range(lat, lon, [datetime.date.fromisoformat(d) for d in dates], conn)
+            for d in dates:
+                result[d] = {"visits": per_day.get(d, ({}, None))[0], "daily": weather.get(d)}
+    finally:
+        conn.close()
+
+    missing = sum(1 for w in result.values() if not w["daily"])
+    if missing:
+        print(f"天気情報を取得できなかった日: {missing} 日")
+    return result
+
+def update_weather_in_note(note_path, date_str, lat=None, lon=None):
+    """指定されたノートの天気情報を追加・更新"""
     if not note_path.exists():
         print(f"エラー: ノートが見つかりません -> {note_path}")
         return False
 
     try:
-        with open(note_path, "r", encoding="utf-8") as f:
-            content = f.read()
+        note = DailyNote(note_path)
     except Exception as e:
         print(f"エラー: ノートの読み込みに失敗しました: {e}")
         return False
 
+    if not apply_weather(note, date_str, lat, lon):
+        return False
+
     try:
-        updated_content = update_frontmatter(content, weather_data)
-        with open(note_path, "w", encoding="utf-8") as f:
-            f.write(updated_content)
-        print("天気情報をノートに追記しました。")
+        if note.save():
+            print("天気情報をノートに書き込みました。")
+        else:
+            print("天気情報に変更はありません。")
         return True
     except Exception as e:
         print(f"エラー: ノートの書き込みに失敗しました: {e}")
         return False
 
-if __name__ == "__main__":
-    import sys
+def backfill(first, last, lat=None, lon=None):
+    """
+    期間内の既存のデイリーノートに天気情報を書き込む。
+    期間の天気はまとめて取得 (キャッシュ済みの日はリクエストしない) してから各ノートに書き込む。
+    """
+    lat = DEFAULT_LAT if lat is None else lat
+    lon = DEFAULT_LON if lon is None else lon
+    notes = {}
+    day = first
+    while day <= last:
+        note_path = VAULT_PATH / DAILY_NOTE_FOLDER_STR / f"{day.isoformat()}.md"
+        if note_path.exists():
+            notes[day] = note_path
+        day += datetime.timedelta(days=1)
+
+    weather = get_weather_range(lat, lon, notes)
+    written = 0
+    for day, note_path in notes.items():
+        weather_data = weather.get(day.isoformat())
+        if not weather_data:
+            continue
+        note = DailyNote(note_path)
+        note.set_properties(weather_properties(weather_data))
+        if note.save():
+            written += 1
+    print(f"完了: ノート {len(notes)} 件中 {written} 件を更新しました (天気なし {len(notes) - len(weather)} 件)。")
 
+def main():
     # デフォルトの日付（前日）
     today = datetime.date.today()
     target_date = today - datetime.timedelta(days=1)
     target_date_str = target_date.strftime("%Y-%m-%d")
 
-    # デフォルトのノートパス
-    daily_note_path = VAULT_PATH / DAILY_NOTE_FOLDER_STR / f"{target_date_str}.md"
+    parser = argparse.ArgumentParser(description="デイリーノートに天気情報を書き込む")
+    parser.add_argument("note_path", nargs="?", help="ノートのパス (省略時は前日のデイリーノート)")
+    parser.add_argument("date", nargs="?", default=target_date_str, help="日付 (YYYY-MM-DD)")
+    parser.add_argument("lat", nargs="?", type=float, help="緯度 (省略時は DEFAULT_LAT)")
+    parser.add_argument("lon", nargs="?", type=float, help="経度 (省略時は DEFAULT_LON)")
+    parser.add_argument("--from", dest="date_from", help="バックフィルの開始日 (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", help="バックフィルの終了日 (YYYY-MM-DD、省略時は昨日)")
+    args = parser.parse_args()
+
+    if args.date_from:
+        try:
+            first = datetime.date.fromisoformat(args.date_from)
+            last = datetime.date.fromisoformat(args.date_to) if args.date_to else target_date
+        except ValueError:
+            print("エラー: 日付の形式が正しくありません。YYYY-MM-DD で指定してください。")
+            return
+        backfill(first, last)
+        return
 
-    # 引数処理
-    note_path = Path(sys.argv[1]) if len(sys.argv) > 1 else daily_note_path
-    date_str = sys.argv[2] if len(sys.argv) > 2 else target_date_str
-    lat = float(sys.argv[3]) if len(sys.argv) > 3 else None
-    lon = float(sys.argv[4]) if len(sys.argv) > 4 else None
+    # デフォルトのノートパス
+    daily_note_path = VAULT_PATH / DAILY_NOTE_FOLDER_STR / f"{args.date}.md"
+    note_path = Path(args.note_path) if args.note_path else daily_note_path
+    update_weather_in_note(note_path, args.date, args.lat, args.lon)
 
-    update_weather_in_note(note_path, date_str, lat, lon)
+if __name__ == "__main__":
+    main()